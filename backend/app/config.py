@@ -0,0 +1,44 @@
+"""
+Environment-based settings.
+
+The `.env` file is looked up relative to this package (backend/.env, then
+backend/app/.env) and read once, on first use, so importing modules stays free
+of file system side effects. Values already set in the environment win.
+"""
+import os
+import threading
+from typing import Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENV_FILES = (os.path.join(BACKEND_DIR, ".env"), os.path.join(BACKEND_DIR, "app", ".env"))
+
+_LOCK = threading.Lock()
+_LOADED = False
+
+
+def load_env():
+    """Loads the `.env` files into `os.environ` (once; later calls are no-ops)."""
+    global _LOADED
+    if _LOADED:
+        return
+    with _LOCK:
+        if _LOADED:
+            return
+        try:
+            from dotenv import load_dotenv
+        except ImportError:
+            load_dotenv = None
+        if load_dotenv is not None:
+            for path in ENV_FILES:
+                if os.path.exists(path):
+                    load_dotenv(path, override=False)
+        _LOADED = True
+
+
+def get(name: str, default: Optional[str] = None) -> Optional[str]:
+    load_env()
+    return os.getenv(name, default)
+
+
+def db_path() -> str:
+    return get("EXAM_DB_PATH", "exam_results.db")
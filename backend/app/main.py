@@ -78,34 +78,88 @@
 #
 
 
-from fastapi import FastAPI
+from fastapi import FastAPI, APIRouter, Header, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from app.services import question_bank, grading
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from app import config
+# Read .env before the services pick up their settings.
+config.load_env()
+from app.services import question_pool, topic_index, aggregates, events, exam_sessions, execution_grader, export, grading, idempotency, grading_cache, grading_queue, metrics, persistence, results, sandbox, similarity, surrogate
+from app.utils import pdf_utils
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+import time
+import asyncio
+import logging
 import sqlite3
 from typing import Optional
 
+logger = logging.getLogger(__name__)
+
 # --- Configuration & Database Setup ---
-DB_PATH = "exam_results.db"
-
-def setup_database():
-    """Initializes the database and creates the results table if it doesn't exist."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS results (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        full_name TEXT NOT NULL UNIQUE,
-        code_score REAL DEFAULT 0
-    )
-    """)
-    conn.commit()
-    conn.close()
+def setup_database(db_path: Optional[str] = None):
+    """Initializes the database and creates the results tables if they don't exist."""
+    persistence.setup_database(db_path or config.db_path())
 
-# Run setup on application startup
-setup_database()
+def _warmups() -> dict:
+    # Independent start-up work; each item reads through its own thread's connection.
+    tasks = {
+        "aggregates": lambda: aggregates.load(persistence.reader()),
+        "similarity": lambda: similarity.load(persistence.reader()),
+        "topics": lambda: topic_index.configure(True),
+        "question_pool": lambda: question_pool.load(persistence.reader()),
+        "grading_cache": lambda: grading_cache.configure(True),
+        "surrogate": lambda: surrogate.configure(True),
+        "llm": grading.warm_up,
+    }
+    if execution_grader.EXECUTION_GRADING:
+        if sandbox.available():
+            tasks["sandbox"] = sandbox.start_pool
+        else:
+            logger.warning("⚠️ EXECUTION_GRADING is on but the sandbox cannot isolate runs (no bwrap); "
+                           "answers will be graded without running them.")
+    return tasks
 
-app = FastAPI()
+def start_services(db_path: Optional[str] = None):
+    """Opens the database, warms every cache and client in parallel, then starts the workers."""
+    started = time.perf_counter()
+    db_path = db_path or config.db_path()
+    setup_database(db_path)
+    persistence.start(db_path)
+    tasks = _warmups()
+    with ThreadPoolExecutor(max_workers=len(tasks), thread_name_prefix="warmup") as pool:
+        futures = {name: pool.submit(fn) for name, fn in tasks.items()}
+        for name, fut in futures.items():
+            try:
+                fut.result()
+            except Exception as e:
+                logger.error(f"❌ Warm-up of {name} failed: {e}")
+                raise
+    grading_queue.start()
+    exam_sessions.start_reaper()
+    question_pool.start_worker()
+    logger.info(f"✅ Services started in {time.perf_counter() - started:.2f}s.")
+
+def stop_services():
+    """Stops the workers and closes pools and the database, in reverse start order."""
+    question_pool.stop_worker()
+    exam_sessions.stop_reaper()
+    grading_queue.stop()
+    grading_cache.configure(False)
+    surrogate.configure(False)
+    topic_index.configure(False)
+    sandbox.shutdown_pool()
+    pdf_utils.shutdown_pool()
+    persistence.stop()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(start_services)
+    try:
+        yield
+    finally:
+        await asyncio.to_thread(stop_services)
 
 # --- THE FIX IS HERE: Add all possible frontend origins ---
 origins = [
@@ -114,48 +168,284 @@ origins = [
     "http://192.168.1.162:3000",  # Your specific Network URL
 ]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+class RequestMetricsMiddleware:
+    """
+    Pure ASGI middleware (no per-request task or body stream, unlike
+    BaseHTTPMiddleware): takes the status from `http.response.start` and
+    records the request when its last `http.response.body` message is sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        state = {"status": 500, "recorded": False}
+
+        def record():
+            if state["recorded"]:
+                return
+            state["recorded"] = True
+            # Label by route template (/exam/submission/{submission_id}), not the raw path.
+            path = getattr(scope.get("route"), "path", "unmatched")
+            metrics.HTTP_LATENCY.observe(time.perf_counter() - start, method=scope["method"], route=path)
+            metrics.HTTP_REQUESTS.inc(method=scope["method"], route=path, status=state["status"])
+
+        async def send_timed(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                record()
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            record()  # the app failed or the client went away before the last body chunk
+
+router = APIRouter()
+
+def create_app() -> FastAPI:
+    """
+    Builds the application. Nothing is opened here: the database, caches, LLM
+    client and workers are set up by the lifespan hook when the server starts.
+    """
+    app = FastAPI(lifespan=lifespan)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.add_middleware(RequestMetricsMiddleware)
+    app.include_router(router)
+    return app
 
 # --- Pydantic Models ---
 class CodeSubmission(BaseModel):
     full_name: str
     code_answer: str
     question: Optional[str] = None
+    # Debugging part of a multi-part exam (see /exam/generate).
+    error_answer: Optional[str] = None
+    error_question: Optional[str] = None
+    session_id: Optional[str] = None
+
+class SessionStart(BaseModel):
+    full_name: str
+    pool: str = question_pool.DEFAULT_POOL
+
+class QuestionPoolCreate(BaseModel):
+    name: str
+    source_text: str
+
+class TopicDocument(BaseModel):
+    doc_id: str
+    text: str
+
+class SessionHeartbeat(BaseModel):
+    draft: Optional[str] = None
+    error_answer: Optional[str] = None  # draft of the debugging part
+
+class SessionClose(BaseModel):
+    code_answer: str
+    error_answer: Optional[str] = None
 
 # --- API Endpoints ---
-@app.get("/")
+@router.get("/")
 def root():
     return {"message": "Exam backend running with SQLite 🚀"}
 
-@app.post("/exam/generate")
-def generate_exam():
-    return question_bank.get_random_questions()
+@router.post("/exam/generate")
+async def generate_exam(full_name: Optional[str] = None, pool: str = question_pool.DEFAULT_POOL):
+    # Questions are generated ahead of time; this only takes the next one from the pool.
+    # The response lists every part of the exam; submit all answers together.
+    return await question_pool.assign(full_name, pool)
+
+@router.post("/exam/pools")
+async def create_question_pool(body: QuestionPoolCreate):
+    await question_pool.register_pool(body.name, body.source_text)
+    return {"message": "✅ Pool registered", "pool": body.name}
+
+@router.get("/exam/pools/stats")
+def question_pool_stats():
+    return question_pool.stats()
+
+@router.post("/topics/documents")
+def add_topic_document(body: TopicDocument):
+    counts = topic_index.add_document(body.doc_id, body.text)
+    return {"doc_id": body.doc_id, "terms": dict(counts.most_common())}
+
+@router.get("/topics")
+def list_topics(doc_id: Optional[str] = None, limit: int = 10):
+    return {"doc_id": doc_id, "topics": topic_index.top_topics(doc_id, limit), **topic_index.stats()}
+
+async def _idempotent(key: Optional[str], scope: str, payload: dict, response: Response, fn):
+    """
+    Runs `fn(record)` once per Idempotency-Key; retries with the same key get
+    the first response back. `record` is None when no key was sent.
+    """
+    if not key:
+        return await fn(None)
+    try:
+        body, replayed = await idempotency.run(key, scope, payload, fn)
+    except idempotency.IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return body
+
+@router.post("/exam/submit_code")
+async def submit_code(submission: CodeSubmission, response: Response, idempotency_key: Optional[str] = Header(None)):
+    return await _idempotent(idempotency_key, "submit_code", submission.model_dump(), response,
+                             lambda record: _submit_code(submission, record))
 
-@app.post("/exam/submit_code")
-def submit_code(submission: CodeSubmission):
-    code_score = grading.grade_code(submission.code_answer, submission.question)
+def _submitted(submission_id: int) -> dict:
+    return {"message": "✅ Code submitted", "submission_id": submission_id, "status": grading_queue.QUEUED}
+
+def _on_write(record):
+    """Writer-thread hook that stores the idempotent response in the submission's own transaction."""
+    if record is None:
+        return None
+    return lambda conn, submission_id: record(conn, _submitted(submission_id))
+
+async def _submit_code(submission: CodeSubmission, record=None):
+    # Grading happens on the background workers; the caller gets an id to poll.
+    if submission.session_id:
+        return await _close_session(submission.session_id, SessionClose(
+            code_answer=submission.code_answer, error_answer=submission.error_answer
+        ), record)
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE results SET code_score = ? WHERE full_name = ?",
-            (code_score, submission.full_name)
+        submission_id = await grading_queue.enqueue(
+            submission.full_name, submission.code_answer, submission.question,
+            submission.error_answer, submission.error_question, on_write=_on_write(record),
         )
-        if cursor.rowcount == 0:
-            cursor.execute(
-                "INSERT INTO results (full_name, code_score) VALUES (?, ?)",
-                (submission.full_name, code_score)
-            )
-        conn.commit()
-        conn.close()
     except sqlite3.Error as e:
-        print(f"Database error: {e}")
-        return {"message": "Error saving to database", "code_score": code_score}
-    return {"message": "✅ Code submitted", "code_score": code_score}
+        logger.error(f"❌ Database error: {e}")
+        raise HTTPException(status_code=503, detail="Error saving to database")
+    events.publish(events.SUBMISSION_RECEIVED, {"submission_id": submission_id, "full_name": submission.full_name})
+    return _submitted(submission_id)
+
+@router.post("/exam/session/start")
+async def start_session(body: SessionStart):
+    return await exam_sessions.start_session(body.full_name, body.pool)
+
+@router.get("/exam/session/{session_id}")
+def get_session(session_id: str):
+    try:
+        return exam_sessions.get_session(session_id)
+    except exam_sessions.SessionNotFound:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+@router.post("/exam/session/{session_id}/heartbeat")
+async def session_heartbeat(session_id: str, body: SessionHeartbeat):
+    try:
+        return await exam_sessions.heartbeat(session_id, body.draft, body.error_answer)
+    except exam_sessions.SessionNotFound:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+@router.post("/exam/session/{session_id}/close")
+async def close_session(session_id: str, body: SessionClose, response: Response, idempotency_key: Optional[str] = Header(None)):
+    return await _idempotent(idempotency_key, f"close:{session_id}", body.model_dump(), response,
+                             lambda record: _close_session(session_id, body, record))
+
+async def _close_session(session_id: str, body: SessionClose, record=None):
+    try:
+        submission_id = await exam_sessions.submit(session_id, body.code_answer, body.error_answer,
+                                                   on_write=_on_write(record))
+    except exam_sessions.SessionNotFound:
+        raise HTTPException(status_code=404, detail="Session not found")
+    except exam_sessions.SessionClosed as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return _submitted(submission_id)
+
+@router.get("/exam/submission/{submission_id}")
+def submission_status(submission_id: int):
+    status = grading_queue.get_status(submission_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Submission not found")
+    return status
+
+@router.get("/exam/submission/{submission_id}/similar")
+def similar_submissions(submission_id: int, threshold: float = similarity.FLAG_THRESHOLD):
+    if not 0 < threshold <= 1:
+        raise HTTPException(status_code=400, detail="threshold must be in (0, 1]")
+    matches = similarity.similar_to(submission_id, threshold)
+    if matches is None:
+        raise HTTPException(status_code=404, detail="Submission not found")
+    return {"submission_id": submission_id, "threshold": threshold, "matches": matches}
+
+@router.get("/similarity/stats")
+def similarity_stats():
+    return similarity.stats()
+
+@router.get("/grading/cache/stats")
+def grading_cache_stats():
+    return grading_cache.stats()
+
+@router.get("/idempotency/stats")
+def idempotency_stats():
+    return idempotency.stats()
+
+@router.get("/grading/surrogate/stats")
+def surrogate_stats():
+    return surrogate.stats()
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@router.get("/health/llm")
+def llm_health():
+    return grading.llm_status()
+
+@router.get("/results")
+def list_results(limit: int = 100, cursor: Optional[str] = None):
+    try:
+        return results.list_results(limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/results/changes")
+def result_changes(since: int = 0, limit: int = 100):
+    return results.changes_since(since, limit)
+
+@router.get("/export/{table}")
+def export_rows(table: str, format: str = "csv", compression: str = "none", pool: Optional[str] = None,
+                session_id: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None):
+    # Rows are read and encoded chunk by chunk while the response is being sent.
+    filters = {"pool": pool, "session_id": session_id, "since": since, "until": until}
+    try:
+        data = export.export(table, format, compression, filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        data,
+        media_type=export.media_type(format, compression),
+        headers={"Content-Disposition": f'attachment; filename="{export.filename(table, format, compression)}"'},
+    )
+
+@router.get("/results/aggregates")
+def result_aggregates():
+    return aggregates.snapshot(grading.TOTAL_MAX)
+
+@router.get("/events")
+async def event_stream(request: Request, last_event_id: Optional[int] = None):
+    # Browsers' EventSource resends the last id it saw in this header on reconnect.
+    header = request.headers.get("last-event-id")
+    if last_event_id is None and header and header.isdigit():
+        last_event_id = int(header)
+    return StreamingResponse(
+        events.stream(last_event_id, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
+# `uvicorn app.main:app`; building it is cheap, the work happens at startup.
+app = create_app()
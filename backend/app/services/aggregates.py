@@ -0,0 +1,90 @@
+import math
+import threading
+from collections import Counter
+from typing import Optional
+
+# Aggregates are over each candidate's total score (every exam part; equal to
+# the code score for single-part exams). Scores are always whole quarters (see grading._round_quarter), so a
+# histogram keyed by quarter gives exact percentiles without keeping rows.
+_BIN = 0.25
+
+_LOCK = threading.Lock()
+_HIST: Counter = Counter()
+_SUM = 0.0
+_VERSION = 0
+
+
+def _bin(score: float) -> float:
+    return round(round(score / _BIN) * _BIN, 2)
+
+
+def load(conn):
+    """Rebuilds the aggregates from the `results` table (one pass, at startup)."""
+    global _SUM, _VERSION
+    hist, total = Counter(), 0.0
+    for (score,) in conn.execute("SELECT COALESCE(total_score, code_score) FROM results"):
+        if score is not None:
+            hist[_bin(score)] += 1
+            total += score
+    version = conn.execute("SELECT COALESCE(MAX(version), 0) FROM results").fetchone()[0]
+    with _LOCK:
+        _HIST.clear()
+        _HIST.update(hist)
+        _SUM = total
+        _VERSION = version
+
+
+def record(old_score: Optional[float], new_score: float, version: Optional[int] = None):
+    """Applies one committed result write: `old_score` is what it replaced (None if new)."""
+    global _SUM, _VERSION
+    with _LOCK:
+        if old_score is not None:
+            b = _bin(old_score)
+            _HIST[b] -= 1
+            if _HIST[b] <= 0:
+                del _HIST[b]
+            _SUM -= old_score
+        _HIST[_bin(new_score)] += 1
+        _SUM += new_score
+        if version is not None:
+            _VERSION = max(_VERSION, version)
+
+
+def _percentile(items: list, count: int, p: float) -> Optional[float]:
+    """Nearest-rank percentile over (score, count) pairs sorted by score."""
+    if not count:
+        return None
+    rank = max(1, math.ceil(p / 100 * count))
+    seen = 0
+    for score, n in items:
+        seen += n
+        if seen >= rank:
+            return score
+    return items[-1][0]
+
+
+def snapshot(max_score: float) -> dict:
+    with _LOCK:
+        items = sorted(_HIST.items())
+        total = _SUM
+        version = _VERSION
+    count = sum(n for _, n in items)
+    histogram = []
+    steps = int(round(max_score / _BIN))
+    counts = dict(items)
+    for i in range(steps + 1):
+        score = round(i * _BIN, 2)
+        histogram.append({"score": score, "count": counts.get(score, 0)})
+    return {
+        "count": count,
+        "mean": round(total / count, 4) if count else 0.0,
+        "max": items[-1][0] if items else 0.0,
+        "min": items[0][0] if items else 0.0,
+        "p50": _percentile(items, count, 50),
+        "p90": _percentile(items, count, 90),
+        "p95": _percentile(items, count, 95),
+        "p99": _percentile(items, count, 99),
+        "histogram": histogram,
+        "max_score": max_score,
+        "version": version,
+    }
@@ -0,0 +1,321 @@
+"""
+Content-addressed store for large, repetitive text (submitted code, drafts,
+LLM feedback).
+
+Text is stored once per distinct content in the `blobs` table, keyed by its
+SHA-256, and compressed with zstd (optionally with a dictionary trained on
+answers or shell scripts) or zlib when zstandard is not installed. Rows keep
+a `*_blob` reference next to their (then empty) text column; `text_sql()`
+reads either form back with one primary-key lookup inside the same query,
+through the `blob_text()` SQL function every connection registers.
+
+The table lives in the results database itself, so a row and its blob are
+committed in the same transaction.
+
+    python -m app.services.blob_store stats
+    python -m app.services.blob_store pack                 # move existing inline text into blobs
+    python -m app.services.blob_store train-dict --from ./scripts
+    python -m app.services.blob_store gc --vacuum
+"""
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import argparse
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from app.services import persistence
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# ===== Config =====
+BLOB_STORE = os.getenv("BLOB_STORE", "1") == "1"
+# Shorter text stays inline: a 64-character hash would not save anything.
+BLOB_MIN_BYTES = int(os.getenv("BLOB_MIN_BYTES", "128"))
+BLOB_ZSTD_LEVEL = int(os.getenv("BLOB_ZSTD_LEVEL", "9"))
+BLOB_DICT_BYTES = int(os.getenv("BLOB_DICT_BYTES", str(16 * 1024)))
+# How often writers look for a newly trained dictionary.
+_DICT_RECHECK_SECONDS = 60.0
+
+# Every (table, inline text column, blob reference column) that points into `blobs`.
+REFERENCES = [
+    ("submissions", "code_answer", "code_blob"),
+    ("submissions", "error_answer", "error_blob"),
+    ("exam_sessions", "draft", "draft_blob"),
+    ("exam_sessions", "error_draft", "error_draft_blob"),
+    ("surrogate_examples", "code_answer", "code_blob"),
+    ("grading_cache", "feedback", "feedback_blob"),
+]
+
+_LOCK = threading.Lock()
+_DICTS: Dict[int, "zstandard.ZstdCompressionDict"] = {}
+_ACTIVE_DICT: Dict[str, object] = {"id": None, "checked": 0.0}
+_STATS = {"stored": 0, "deduplicated": 0, "inline": 0}
+
+
+# ===== Codecs =====
+def _zstd_dict(dict_id: int, source) -> "zstandard.ZstdCompressionDict":
+    """`source` is a connection, or a database path when called from inside a query (blob_text)."""
+    with _LOCK:
+        d = _DICTS.get(dict_id)
+    if d is None:
+        conn = source if isinstance(source, sqlite3.Connection) else sqlite3.connect(source)
+        try:
+            row = conn.execute("SELECT data FROM blob_dicts WHERE id = ?", (dict_id,)).fetchone()
+        finally:
+            if conn is not source:
+                conn.close()
+        if row is None:
+            raise ValueError(f"zstd dictionary {dict_id} is missing")
+        d = zstandard.ZstdCompressionDict(row[0])
+        with _LOCK:
+            _DICTS[dict_id] = d
+    return d
+
+
+def decode(codec: str, data: bytes, source=None) -> str:
+    if codec == "raw":
+        raw = data
+    elif codec == "zlib":
+        raw = zlib.decompress(data)
+    elif codec.startswith("zstd"):
+        if zstandard is None:
+            raise RuntimeError("blob is zstd-compressed but zstandard is not installed")
+        _, _, dict_id = codec.partition(":")
+        d = _zstd_dict(int(dict_id), source) if dict_id else None
+        raw = zstandard.ZstdDecompressor(dict_data=d).decompress(data)
+    else:
+        raise ValueError(f"unknown blob codec {codec!r}")
+    return raw.decode("utf-8")
+
+
+def _active_dict(conn: sqlite3.Connection) -> Optional[int]:
+    now = time.monotonic()
+    if now - _ACTIVE_DICT["checked"] >= _DICT_RECHECK_SECONDS:
+        row = conn.execute("SELECT MAX(id) FROM blob_dicts").fetchone()
+        _ACTIVE_DICT["id"], _ACTIVE_DICT["checked"] = row[0], now
+    return _ACTIVE_DICT["id"]
+
+
+def encode(raw: bytes, conn: Optional[sqlite3.Connection] = None) -> Tuple[str, bytes]:
+    """Returns `(codec, data)`: the smallest of the available encodings (raw included)."""
+    candidates = [("raw", raw), ("zlib", zlib.compress(raw, 9))]
+    if zstandard is not None:
+        candidates.append(("zstd", zstandard.ZstdCompressor(level=BLOB_ZSTD_LEVEL).compress(raw)))
+        dict_id = _active_dict(conn) if conn is not None else None
+        if dict_id is not None:
+            d = _zstd_dict(dict_id, conn)
+            candidates.append((f"zstd:{dict_id}",
+                               zstandard.ZstdCompressor(level=BLOB_ZSTD_LEVEL, dict_data=d).compress(raw)))
+    return min(candidates, key=lambda c: len(c[1]))
+
+
+def register(conn: sqlite3.Connection, db_path: str):
+    """Adds the `blob_text(codec, data)` SQL function to a connection on `db_path`."""
+    conn.create_function("blob_text", 2, lambda codec, data: None if data is None else decode(codec, data, db_path),
+                         deterministic=True)
+
+
+# ===== Public API =====
+def text_sql(inline_col: str, blob_col: str) -> str:
+    """SQL expression for a column's text, whether it is stored inline or as a blob."""
+    return (f"COALESCE((SELECT blob_text(b.codec, b.data) FROM blobs b WHERE b.hash = {blob_col}), "
+            f"{inline_col})")
+
+
+def put(conn: sqlite3.Connection, text: str) -> str:
+    """Writer-thread helper: stores `text` unless it is already there; returns its hash."""
+    raw = text.encode("utf-8")
+    digest = hashlib.sha256(raw).hexdigest()
+    if conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone() is not None:
+        _STATS["deduplicated"] += 1
+        return digest
+    codec, data = encode(raw, conn)
+    conn.execute(
+        "INSERT OR IGNORE INTO blobs (hash, codec, size, data, created_at) VALUES (?, ?, ?, ?, ?)",
+        (digest, codec, len(raw), data, time.time()),
+    )
+    _STATS["stored"] += 1
+    return digest
+
+
+def store(conn: sqlite3.Connection, text: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Writer-thread helper: returns `(inline, blob)` to write into a row's text
+    and reference columns. Short text (and everything, with BLOB_STORE=0)
+    stays inline.
+    """
+    if text is None:
+        return None, None
+    if not BLOB_STORE or len(text) < BLOB_MIN_BYTES:
+        _STATS["inline"] += 1
+        return text, None
+    return "", put(conn, text)
+
+
+def get(digest: str) -> Optional[str]:
+    conn = persistence.reader()
+    row = conn.execute("SELECT codec, data FROM blobs WHERE hash = ?", (digest,)).fetchone()
+    return decode(row["codec"], row["data"], conn) if row else None
+
+
+def stats() -> dict:
+    conn = persistence.reader()
+    row = conn.execute("SELECT COUNT(*) AS blobs, COALESCE(SUM(size), 0) AS raw_bytes, "
+                       "COALESCE(SUM(LENGTH(data)), 0) AS stored_bytes FROM blobs").fetchone()
+    codecs = conn.execute("SELECT codec, COUNT(*) AS n FROM blobs GROUP BY codec ORDER BY codec").fetchall()
+    inline = {
+        f"{table}.{column}": conn.execute(
+            f"SELECT COUNT(*) FROM {table} WHERE {ref} IS NULL AND LENGTH({column}) >= ?", (BLOB_MIN_BYTES,)
+        ).fetchone()[0]
+        for table, column, ref in REFERENCES
+    }
+    return {
+        **dict(row),
+        "ratio": round(row["raw_bytes"] / row["stored_bytes"], 2) if row["stored_bytes"] else None,
+        "codecs": {r["codec"]: r["n"] for r in codecs},
+        "inline_packable": inline,
+        "dictionaries": conn.execute("SELECT COUNT(*) FROM blob_dicts").fetchone()[0],
+        **_STATS,
+    }
+
+
+# ===== Maintenance =====
+def _unreferenced_sql() -> str:
+    return " AND ".join(f"NOT EXISTS (SELECT 1 FROM {table} t WHERE t.{ref} = b.hash)"
+                        for table, _, ref in REFERENCES)
+
+
+def gc(batch: int = 1000) -> dict:
+    """Deletes blobs no row references, in batches so writes keep flowing between them."""
+    deleted = 0
+    while True:
+        n = persistence.write(lambda conn: conn.execute(
+            f"DELETE FROM blobs WHERE rowid IN (SELECT b.rowid FROM blobs b WHERE {_unreferenced_sql()} LIMIT ?)",
+            (batch,),
+        ).rowcount)
+        deleted += n
+        if n < batch:
+            break
+    # Dictionaries nothing is compressed with any more, except the newest one.
+    dicts = persistence.write(lambda conn: conn.execute(
+        "DELETE FROM blob_dicts WHERE id < (SELECT MAX(id) FROM blob_dicts) AND NOT EXISTS "
+        "(SELECT 1 FROM blobs WHERE codec = 'zstd:' || blob_dicts.id)"
+    ).rowcount)
+    with _LOCK:
+        _DICTS.clear()
+    return {"deleted_blobs": deleted, "deleted_dictionaries": dicts}
+
+
+def _pack_page(conn: sqlite3.Connection, table: str, column: str, ref: str, rows: list):
+    for row in rows:
+        inline, blob = store(conn, row[column])
+        conn.execute(f"UPDATE {table} SET {column} = ?, {ref} = ? WHERE rowid = ?", (inline, blob, row["row_id"]))
+
+
+def pack(page_size: int = 500) -> Dict[str, int]:
+    """Moves text still stored inline (rows written before the blob store) into blobs."""
+    packed: Dict[str, int] = {}
+    for table, column, ref in REFERENCES:
+        last, count = 0, 0
+        while True:
+            rows = persistence.reader().execute(
+                f"SELECT rowid AS row_id, {column} FROM {table} WHERE rowid > ? AND {ref} IS NULL "
+                f"AND LENGTH({column}) >= ? ORDER BY rowid LIMIT ?",
+                (last, BLOB_MIN_BYTES, page_size),
+            ).fetchall()
+            if not rows:
+                break
+            persistence.write(lambda conn: _pack_page(conn, table, column, ref, rows))
+            last, count = rows[-1]["row_id"], count + len(rows)
+        packed[f"{table}.{column}"] = count
+    return packed
+
+
+def train_dictionary(sample_dir: Optional[str] = None, max_samples: int = 5000,
+                     dict_bytes: int = BLOB_DICT_BYTES) -> int:
+    """
+    Trains a zstd dictionary on the files under `sample_dir` (e.g. a folder of
+    shell scripts) or on the most recent stored answers; new blobs use it.
+    """
+    if zstandard is None:
+        raise ValueError("training a dictionary needs zstandard (pip install zstandard)")
+    samples: List[bytes] = []
+    if sample_dir:
+        for root, _, files in os.walk(sample_dir):
+            for name in sorted(files):
+                with open(os.path.join(root, name), "rb") as f:
+                    samples.append(f.read())
+                if len(samples) >= max_samples:
+                    break
+    else:
+        rows = persistence.reader().execute(
+            f"SELECT {text_sql('code_answer', 'code_blob')} AS code FROM submissions ORDER BY id DESC LIMIT ?",
+            (max_samples,),
+        ).fetchall()
+        samples = [r["code"].encode("utf-8") for r in rows if r["code"]]
+    if len(samples) < 10:
+        raise ValueError(f"need at least 10 samples to train a dictionary, found {len(samples)}")
+    d = zstandard.train_dictionary(dict_bytes, samples)
+    dict_id = persistence.write(lambda conn: conn.execute(
+        "INSERT INTO blob_dicts (data, samples, created_at) VALUES (?, ?, ?)",
+        (d.as_bytes(), len(samples), time.time()),
+    ).lastrowid)
+    _ACTIVE_DICT["checked"] = 0.0
+    logger.info(f"✅ Trained zstd dictionary {dict_id} ({len(d.as_bytes())} bytes) on {len(samples)} samples.")
+    return dict_id
+
+
+# ===== CLI =====
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Inspect and maintain the blob store.")
+    parser.add_argument("--db", default=os.getenv("EXAM_DB_PATH", "exam_results.db"))
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="sizes, compression ratio and inline text left to pack")
+    pack_p = sub.add_parser("pack", help="move inline text into blobs")
+    pack_p.add_argument("--page-size", type=int, default=500)
+    gc_p = sub.add_parser("gc", help="delete blobs nothing references")
+    gc_p.add_argument("--vacuum", action="store_true", help="then rebuild the file to return the space to the OS")
+    train_p = sub.add_parser("train-dict", help="train a zstd dictionary for new blobs")
+    train_p.add_argument("--from", dest="sample_dir", help="directory of sample files (default: stored answers)")
+    train_p.add_argument("--max-samples", type=int, default=5000)
+    train_p.add_argument("--dict-bytes", type=int, default=BLOB_DICT_BYTES)
+    args = parser.parse_args(argv)
+
+    persistence.setup_database(args.db)
+    persistence.start(args.db)
+    try:
+        if args.command == "stats":
+            out = stats()
+        elif args.command == "pack":
+            out = pack(args.page_size)
+        elif args.command == "gc":
+            out = gc()
+        else:
+            try:
+                out = {"dictionary_id": train_dictionary(args.sample_dir, args.max_samples, args.dict_bytes)}
+            except ValueError as e:
+                parser.error(str(e))
+    finally:
+        persistence.stop()
+    if args.command == "gc" and args.vacuum:
+        conn = persistence.connect(args.db)
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        out["vacuumed"] = True
+    print(json.dumps(out, indent=2))
+
+
+if __name__ == "__main__":
+    main()
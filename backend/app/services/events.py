@@ -0,0 +1,126 @@
+"""
+In-process event bus behind the `/events` Server-Sent Events stream.
+
+Publishers (route handlers, grading worker threads) call `publish()`. Each
+subscriber has a bounded queue on its own event loop. A subscriber that falls
+too far behind is dropped rather than slowing everyone else down; it can
+reconnect with the last id it saw and replay the recent events kept in a ring
+buffer.
+"""
+import os
+import json
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import AsyncIterator, Optional
+
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+# ===== Config =====
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", "1000"))
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("SUBSCRIBER_QUEUE_SIZE", "256"))
+HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
+SUBMISSION_RECEIVED = "submission_received"
+GRADED = "graded"
+AGGREGATES_CHANGED = "aggregates_changed"
+
+_LOCK = threading.Lock()
+_BUFFER: deque = deque(maxlen=EVENT_BUFFER_SIZE)
+_SUBSCRIBERS: set = set()
+_NEXT_ID = 1
+_STATS = {"published": 0, "dropped_subscribers": 0}
+
+
+class _Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.dropped = False
+
+    def offer(self, event: tuple):
+        # Runs on the subscriber's loop.
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped = True
+            _STATS["dropped_subscribers"] += 1
+            logger.warning("⚠️ Dropping a slow event subscriber.")
+
+
+def _format(event_id: int, event_type: str, data: str) -> str:
+    return f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n"
+
+
+# ===== Public API =====
+def publish(event_type: str, payload: dict):
+    """Fans an event out to every subscriber. Safe to call from any thread."""
+    global _NEXT_ID
+    data = json.dumps(payload, default=str)
+    with _LOCK:
+        event = (_NEXT_ID, event_type, data)
+        _NEXT_ID += 1
+        _BUFFER.append(event)
+        subscribers = list(_SUBSCRIBERS)
+        _STATS["published"] += 1
+    for sub in subscribers:
+        try:
+            sub.loop.call_soon_threadsafe(sub.offer, event)
+        except RuntimeError:
+            # The subscriber's loop has closed; it will be removed by its stream.
+            pass
+
+
+async def stream(last_event_id: Optional[int] = None, is_disconnected=None) -> AsyncIterator[str]:
+    """
+    Yields SSE-formatted text: first any buffered events after
+    `last_event_id`, then live events, with a comment heartbeat when idle.
+    `is_disconnected` is an optional coroutine function checked on heartbeats.
+    """
+    sub = _Subscriber(asyncio.get_running_loop())
+    with _LOCK:
+        _SUBSCRIBERS.add(sub)
+        backlog = list(_BUFFER)
+    try:
+        if last_event_id is not None:
+            if backlog and backlog[0][0] > last_event_id + 1:
+                # Events were lost from the ring buffer; tell the client to resync.
+                yield _format(backlog[0][0] - 1, "reset", "{}")
+            for event in backlog:
+                if event[0] > last_event_id:
+                    yield _format(*event)
+            seen = backlog[-1][0] if backlog else last_event_id
+        else:
+            seen = backlog[-1][0] if backlog else 0
+
+        while True:
+            try:
+                event = await asyncio.wait_for(sub.queue.get(), timeout=HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if is_disconnected is not None and await is_disconnected():
+                    return
+                yield ": heartbeat\n\n"
+                continue
+            if event[0] <= seen:
+                continue  # already sent from the backlog
+            seen = event[0]
+            yield _format(*event)
+            if sub.dropped:
+                yield _format(seen, "dropped", "{}")
+                return
+    finally:
+        with _LOCK:
+            _SUBSCRIBERS.discard(sub)
+
+
+def stats() -> dict:
+    with _LOCK:
+        return {**_STATS, "subscribers": len(_SUBSCRIBERS), "last_event_id": _NEXT_ID - 1}
+
+
+metrics.Gauge("sse_subscribers", "Connected /events subscribers.", fn=lambda: len(_SUBSCRIBERS))
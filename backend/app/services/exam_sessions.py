@@ -0,0 +1,229 @@
+"""
+Server-side exam sessions.
+
+The server owns each candidate's deadline: it hands the client a deadline
+timestamp to count down to, keeps the latest draft from heartbeats, rejects
+submissions that arrive after the deadline (plus a small grace period), and
+auto-submits the last draft of sessions nobody closed in time.
+"""
+import os
+import math
+import time
+import uuid
+import logging
+import sqlite3
+import threading
+from typing import Callable, Optional
+
+from app.services import blob_store, events, grading_queue, persistence, question_pool
+
+logger = logging.getLogger(__name__)
+
+# ===== Config =====
+EXAM_DURATION_SECONDS = int(os.getenv("EXAM_DURATION_SECONDS", "600"))
+# Allowance for a submission sent at the deadline. Clients may only notice
+# time-up on their next heartbeat (every 15s), so this must be longer than that.
+SUBMIT_GRACE_SECONDS = float(os.getenv("SUBMIT_GRACE_SECONDS", "30"))
+REAPER_INTERVAL_SECONDS = float(os.getenv("SESSION_REAPER_INTERVAL", "5"))
+
+ACTIVE = "active"
+SUBMITTED = "submitted"
+EXPIRED = "expired"
+
+_REAPER: Optional[threading.Thread] = None
+_STOP_REAPER = threading.Event()
+
+
+class SessionNotFound(LookupError):
+    pass
+
+
+class SessionClosed(Exception):
+    """The session was already submitted, expired, or is past its deadline."""
+
+
+# ===== Helper Functions =====
+def _public(row) -> dict:
+    now = time.time()
+    return {
+        "session_id": row["id"],
+        "full_name": row["full_name"],
+        "question": row["question"],
+        "error_question": row["error_question"],
+        "status": row["status"],
+        "started_at": row["started_at"],
+        "deadline": row["deadline"],
+        "server_time": now,
+        "time_left": max(0, math.ceil(row["deadline"] - now)) if row["status"] == ACTIVE else 0,
+        "submission_id": row["submission_id"],
+    }
+
+
+def _load(session_id: str):
+    row = persistence.reader().execute("SELECT * FROM exam_sessions WHERE id = ?", (session_id,)).fetchone()
+    if row is None:
+        raise SessionNotFound(session_id)
+    return row
+
+
+def _close(conn: sqlite3.Connection, session_id: str, status: str, answer: Optional[str],
+           enforce_deadline: bool, error_answer: Optional[str] = None) -> int:
+    """
+    Runs on the writer thread. Moves an active session to `status` and stores
+    its answer as a queued submission in the same transaction, so a session
+    can be closed exactly once even if the client and the reaper race.
+    """
+    row = conn.execute(
+        f"SELECT *, {blob_store.text_sql('draft', 'draft_blob')} AS draft_text, "
+        f"{blob_store.text_sql('error_draft', 'error_draft_blob')} AS error_draft_text FROM exam_sessions WHERE id = ?",
+        (session_id,),
+    ).fetchone()
+    if row is None:
+        raise SessionNotFound(session_id)
+    if row["status"] != ACTIVE:
+        raise SessionClosed(f"session is already {row['status']}")
+    if enforce_deadline and time.time() > row["deadline"] + SUBMIT_GRACE_SECONDS:
+        raise SessionClosed("the exam deadline has passed")
+
+    code_answer = answer if answer is not None else (row["draft_text"] or "")
+    if error_answer is None:
+        error_answer = row["error_draft_text"]
+    submission_id = grading_queue.insert_submission(
+        conn, row["full_name"], code_answer, row["question"], error_answer, row["error_question"]
+    )
+    # Same text as the submission, so the blob is shared rather than stored twice.
+    draft, draft_blob = blob_store.store(conn, code_answer)
+    conn.execute(
+        "UPDATE exam_sessions SET status = ?, draft = ?, draft_blob = ?, submission_id = ?, closed_at = ? "
+        "WHERE id = ?",
+        (status, draft, draft_blob, submission_id, time.time(), session_id),
+    )
+    return submission_id
+
+
+def _save_heartbeat(conn: sqlite3.Connection, session_id: str, draft: Optional[str],
+                    error_draft: Optional[str] = None):
+    """Writer-thread helper: stores the drafts that were sent (None keeps the saved one)."""
+    conn.execute("UPDATE exam_sessions SET last_heartbeat = ? WHERE id = ? AND status = ?",
+                 (time.time(), session_id, ACTIVE))
+    for column, text in (("draft", draft), ("error_draft", error_draft)):
+        if text is None:
+            continue
+        inline, blob = blob_store.store(conn, text)
+        conn.execute(
+            f"UPDATE exam_sessions SET {column} = ?, {column}_blob = ? WHERE id = ? AND status = ?",
+            (inline, blob, session_id, ACTIVE),
+        )
+
+
+# ===== Public API =====
+async def start_session(full_name: str, pool: str = question_pool.DEFAULT_POOL) -> dict:
+    session_id = uuid.uuid4().hex
+    assignment = await question_pool.assign(full_name, pool, session_id)
+    now = time.time()
+    await persistence.write_async(lambda conn: conn.execute(
+        "INSERT INTO exam_sessions (id, full_name, question, error_question, status, started_at, deadline, "
+        "last_heartbeat) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (session_id, full_name, assignment["code_question"], assignment["error_question"], ACTIVE, now,
+         now + EXAM_DURATION_SECONDS, now),
+    ))
+    return _public(_load(session_id))
+
+
+def get_session(session_id: str) -> dict:
+    return _public(_load(session_id))
+
+
+async def heartbeat(session_id: str, draft: Optional[str] = None, error_draft: Optional[str] = None) -> dict:
+    """
+    Records that the candidate is still there (and their latest drafts of
+    both parts); returns the session. Past the deadline the drafts sent with
+    this heartbeat are saved and then auto-submitted.
+    """
+    row = _load(session_id)
+    if row["status"] == ACTIVE:
+        if time.time() > row["deadline"] + SUBMIT_GRACE_SECONDS:
+            await _finalize(session_id, draft, error_draft)
+        else:
+            await persistence.write_async(lambda conn: _save_heartbeat(conn, session_id, draft, error_draft))
+    return _public(_load(session_id))
+
+
+async def submit(session_id: str, answer: str, error_answer: Optional[str] = None,
+                 on_write: Optional[Callable[[sqlite3.Connection, int], None]] = None) -> int:
+    """
+    Closes the session with the candidate's answers (all parts in one
+    submission) and queues it for grading. `on_write(conn, submission_id)`
+    runs in the closing transaction. Raises SessionClosed for late or
+    repeated submissions.
+    """
+    row = _load(session_id)
+
+    def _write(conn):
+        submission_id = _close(conn, session_id, SUBMITTED, answer, enforce_deadline=True, error_answer=error_answer)
+        if on_write is not None:
+            on_write(conn, submission_id)
+        return submission_id
+
+    submission_id = await persistence.write_async(_write)
+    grading_queue.dispatch(submission_id)
+    events.publish(events.SUBMISSION_RECEIVED, {"submission_id": submission_id, "full_name": row["full_name"]})
+    return submission_id
+
+
+async def _finalize(session_id: str, draft: Optional[str] = None, error_draft: Optional[str] = None):
+    try:
+        submission_id = await persistence.write_async(
+            lambda conn: _close(conn, session_id, EXPIRED, draft, enforce_deadline=False, error_answer=error_draft)
+        )
+    except SessionClosed:
+        return
+    grading_queue.dispatch(submission_id)
+    logger.info(f"Session {session_id} expired; auto-submitted its last draft as submission {submission_id}.")
+
+
+def finalize_expired() -> int:
+    """Auto-submits every active session past its deadline (plus grace). Returns how many."""
+    cutoff = time.time() - SUBMIT_GRACE_SECONDS
+    expired = [r["id"] for r in persistence.reader().execute(
+        "SELECT id FROM exam_sessions WHERE status = ? AND deadline < ?", (ACTIVE, cutoff)
+    )]
+    closed = 0
+    for session_id in expired:
+        try:
+            submission_id = persistence.write(
+                lambda conn, sid=session_id: _close(conn, sid, EXPIRED, None, enforce_deadline=False)
+            )
+        except SessionClosed:
+            continue
+        grading_queue.dispatch(submission_id)
+        closed += 1
+    if closed:
+        logger.info(f"Auto-submitted {closed} expired exam session(s).")
+    return closed
+
+
+def _reaper_loop():
+    while not _STOP_REAPER.wait(REAPER_INTERVAL_SECONDS):
+        try:
+            finalize_expired()
+        except Exception as e:
+            logger.error(f"❌ Session reaper failed: {e}")
+
+
+def start_reaper():
+    global _REAPER
+    if _REAPER is not None:
+        return
+    _STOP_REAPER.clear()
+    _REAPER = threading.Thread(target=_reaper_loop, name="session-reaper", daemon=True)
+    _REAPER.start()
+
+
+def stop_reaper(timeout: float = 5.0):
+    global _REAPER
+    if _REAPER is None:
+        return
+    _STOP_REAPER.set()
+    _REAPER.join(timeout)
+    _REAPER = None
@@ -0,0 +1,160 @@
+"""
+Deterministic grading by running the submission against its question's fixtures.
+
+Every (submission, fixture) pair becomes one sandbox run, and all of them are
+queued on the sandbox process pool at once, so a batch of submissions is
+graded in parallel across cores. A submission whose runs all completed gets a
+pass ratio; one whose runs could not be carried out (sandbox busy, no shell on
+this machine, question without fixtures) is reported as inconclusive (None) and
+left to the LLM.
+"""
+import os
+import re
+import time
+import fnmatch
+import logging
+from typing import List, Optional
+
+from app.services import question_bank, sandbox
+
+logger = logging.getLogger(__name__)
+
+# ===== Config =====
+# Off by default: enable only where sandbox.py can isolate runs (bubblewrap).
+EXECUTION_GRADING = os.getenv("EXECUTION_GRADING", "0") == "1"
+# Execution proves behaviour, not style, so it alone never earns full marks.
+EXECUTION_MARKS_CAP = float(os.getenv("EXECUTION_MARKS_CAP", "0.75"))
+
+_INTEGER = re.compile(r"(?<![\w.])-?\d+(?![\w.])")
+
+
+# ===== Checks =====
+def _output(result: dict) -> str:
+    return result["stdout"] + "\n" + result["stderr"]
+
+
+def _dated(pattern: str) -> str:
+    return pattern.replace("{today}", time.strftime("%Y-%m-%d"))
+
+
+def _check_passed(check: dict, result: dict) -> bool:
+    kind = check["type"]
+    if kind == "exit_code":
+        if "equals" in check:
+            return result["exit_code"] == check["equals"]
+        return result["exit_code"] != check["not_equals"]
+    if kind == "number":
+        found = {int(n) for n in _INTEGER.findall(_output(result))}
+        return any(n in found for n in check["any_of"])
+    if kind == "contains":
+        out = _output(result)
+        return all(s in out for s in check["all_of"])
+    if kind == "regex":
+        return re.search(check["pattern"], _output(result)) is not None
+    if kind == "not_regex":
+        return re.search(check["pattern"], _output(result)) is None
+    if kind == "numbers_at_most":
+        return len(_INTEGER.findall(_output(result))) <= check["count"]
+    if kind == "file_glob":
+        pattern = _dated(check["pattern"])
+        return any(fnmatch.fnmatch(path, pattern) for path in result["files"])
+    if kind == "archive_members":
+        pattern = _dated(check["pattern"])
+        for path, members in result.get("archives", {}).items():
+            names = {m.rstrip("/").rsplit("/", 1)[-1] for m in members}
+            if fnmatch.fnmatch(path, pattern) and all(n in names for n in check["all_of"]):
+                return True
+        return False
+    raise ValueError(f"unknown fixture check type: {kind}")
+
+
+# Checks an empty or hard-coded script can pass on its own.
+_NON_SUBSTANTIVE = {"exit_code", "not_regex", "numbers_at_most"}
+
+
+def _score_fixture(fixture: dict, result: dict) -> dict:
+    """
+    Weighted checks for one run. Exit-code and negative checks only count
+    alongside a real pass; a failed "gate" check zeroes the whole run.
+    """
+    passed, total, substantive, gated = 0.0, 0.0, False, False
+    outcomes = []
+    for check in fixture["checks"]:
+        weight = float(check.get("weight", 1))
+        ok = not result["timed_out"] and _check_passed(check, result)
+        total += weight
+        if ok:
+            passed += weight
+            substantive = substantive or check["type"] not in _NON_SUBSTANTIVE
+        elif check.get("gate"):
+            gated = True
+        outcomes.append({"type": check["type"], "passed": ok})
+    if not substantive or gated:
+        passed = 0.0
+    return {
+        "name": fixture["name"],
+        "passed": passed,
+        "total": total,
+        "timed_out": result["timed_out"],
+        "checks": outcomes,
+    }
+
+
+def _summary(fixtures: List[dict]) -> dict:
+    passed = sum(f["passed"] for f in fixtures)
+    total = sum(f["total"] for f in fixtures)
+    ok = sum(1 for f in fixtures if f["passed"] == f["total"])
+    return {
+        "ratio": passed / total if total else 0.0,
+        "fixtures": fixtures,
+        "feedback": f"Passed {ok} of {len(fixtures)} test case(s) when run.",
+    }
+
+
+# ===== Public API =====
+def has_fixtures(question: Optional[str]) -> bool:
+    return EXECUTION_GRADING and sandbox.available() and bool(question_bank.get_fixtures(question))
+
+
+def grade_batch(code_answers: List[str], question: Optional[str]) -> List[Optional[dict]]:
+    """
+    Runs every answer against every fixture of `question` on the sandbox pool.
+    Returns, per answer, {"ratio", "fixtures", "feedback"} with ratio in
+    [0, 1], or None when the answer could not be graded by execution.
+    """
+    if not has_fixtures(question):
+        return [None] * len(code_answers)
+    fixtures = question_bank.get_fixtures(question)
+
+    # Queue everything first so the pool works on all runs concurrently.
+    futures: List[Optional[list]] = []
+    for code in code_answers:
+        try:
+            futures.append([
+                sandbox.submit(
+                    code, "bash", args=f.get("args"), files=f.get("files"),
+                    dirs=f.get("dirs"), symlinks=f.get("symlinks"),
+                )
+                for f in fixtures
+            ])
+        except Exception as e:
+            logger.warning(f"⚠️ Could not queue sandbox runs: {e}")
+            futures.append(None)
+
+    graded: List[Optional[dict]] = []
+    for runs in futures:
+        if runs is None:
+            graded.append(None)
+            continue
+        try:
+            results = [run.result() for run in runs]
+        except Exception as e:
+            logger.warning(f"⚠️ Sandbox run failed, leaving the answer to the LLM: {e}")
+            graded.append(None)
+            continue
+        graded.append(_summary([_score_fixture(f, r) for f, r in zip(fixtures, results)]))
+    return graded
+
+
+def grade(code_answer: str, question: Optional[str]) -> Optional[dict]:
+    return grade_batch([code_answer], question)[0]
@@ -0,0 +1,275 @@
+"""
+Streaming bulk export of submissions and results.
+
+Rows are read in keyset-paginated chunks of EXPORT_CHUNK_ROWS (each chunk is
+its own short query, so the export never holds a read transaction open while
+grading writes continue) and encoded chunk by chunk, so memory use does not
+depend on the table size. CSV can be gzip- or zstd-compressed on the fly;
+Parquet (needs pyarrow) writes one row group per chunk and uses the chosen
+codec inside the file.
+
+    python -m app.services.export submissions --format csv --compression gzip -o cohort.csv.gz
+    python -m app.services.export results --format parquet --since 2026-10-01
+"""
+import io
+import os
+import csv
+import sys
+import zlib
+import argparse
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+from app.services import blob_store, persistence
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# ===== Config =====
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "2000"))
+FORMATS = ("csv", "parquet")
+COMPRESSIONS = ("none", "gzip", "zstd")
+
+# The pool (exam) a session's question came from; a subquery so a row can never repeat.
+_POOL_SQL = "(SELECT a.pool FROM question_assignments a WHERE a.session_id = e.id LIMIT 1)"
+
+# Per table: select list, FROM clause, the id column keyset pagination runs on,
+# the timestamp column used by since/until, and the columns with their types.
+_TABLES = {
+    "submissions": {
+        "select": "s.id, s.full_name, s.question, "
+                  f"{blob_store.text_sql('s.code_answer', 's.code_blob')} AS code_answer, s.error_question, "
+                  f"{blob_store.text_sql('s.error_answer', 's.error_blob')} AS error_answer, s.status, s.code_score, "
+                  "s.error_score, s.total_score, s.error, "
+                  f"s.created_at, s.updated_at, e.id AS session_id, {_POOL_SQL} AS pool",
+        "from": "submissions s LEFT JOIN exam_sessions e ON e.submission_id = s.id",
+        "id": "s.id",
+        "time": "s.created_at",
+        "columns": [("id", "int"), ("full_name", "str"), ("question", "str"), ("code_answer", "str"),
+                    ("error_question", "str"), ("error_answer", "str"), ("status", "str"), ("code_score", "float"),
+                    ("error_score", "float"), ("total_score", "float"), ("error", "str"), ("created_at", "str"),
+                    ("updated_at", "str"), ("session_id", "str"), ("pool", "str")],
+    },
+    "results": {
+        "select": "r.id, r.full_name, r.code_score, r.error_score, r.total_score, r.version, r.updated_at",
+        "from": "results r",
+        "id": "r.id",
+        "time": "r.updated_at",
+        "columns": [("id", "int"), ("full_name", "str"), ("code_score", "float"), ("error_score", "float"),
+                    ("total_score", "float"), ("version", "int"),
+                    ("updated_at", "str")],
+    },
+}
+
+_MEDIA_TYPES = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+
+# ===== Helper Functions =====
+def _timestamp(value: str) -> str:
+    """Accepts epoch seconds or an ISO date/time; returns SQLite's 'YYYY-MM-DD HH:MM:SS' (UTC)."""
+    invalid = ValueError(f"invalid time {value!r}: use epoch seconds or an ISO date/time")
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            raise invalid
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(timezone.utc)
+        return dt.strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        dt = datetime.fromtimestamp(seconds, tz=timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        # nan, inf and epochs outside the platform's time_t / datetime range.
+        raise invalid
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _where(table: str, filters: Dict[str, Optional[str]]) -> tuple:
+    spec = _TABLES[table]
+    clauses: List[str] = []
+    params: list = []
+    if filters.get("pool") is not None or filters.get("session_id") is not None:
+        if table != "submissions":
+            raise ValueError("pool and session_id filters apply to submissions only")
+        if filters.get("pool") is not None:
+            clauses.append(f"{_POOL_SQL} = ?")
+            params.append(filters["pool"])
+        if filters.get("session_id") is not None:
+            clauses.append("e.id = ?")
+            params.append(filters["session_id"])
+    if filters.get("since"):
+        clauses.append(f"{spec['time']} >= ?")
+        params.append(_timestamp(filters["since"]))
+    if filters.get("until"):
+        clauses.append(f"{spec['time']} < ?")
+        params.append(_timestamp(filters["until"]))
+    return clauses, params
+
+
+def iter_chunks(table: str, filters: Optional[Dict[str, Optional[str]]] = None,
+                chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[list]:
+    """Yields lists of row tuples in id order, one keyset page at a time."""
+    spec = _TABLES[table]
+    clauses, params = _where(table, filters or {})
+    last_id = 0
+    while True:
+        where = " AND ".join(clauses + [f"{spec['id']} > ?"])
+        rows = persistence.reader().execute(
+            f"SELECT {spec['select']} FROM {spec['from']} WHERE {where} ORDER BY {spec['id']} LIMIT ?",
+            (*params, last_id, chunk_rows),
+        ).fetchall()
+        if not rows:
+            return
+        yield [tuple(r) for r in rows]
+        last_id = rows[-1][0]
+
+
+# ===== Encoders =====
+def _csv_chunks(table: str, chunks: Iterator[list]) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow([name for name, _ in _TABLES[table]["columns"]])
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file that hands out what was written since the last `drain()`."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._parts.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self) -> bytes:
+        data, self._parts = b"".join(self._parts), []
+        return data
+
+
+def _parquet_chunks(table: str, chunks: Iterator[list], compression: str) -> Iterator[bytes]:
+    types = {"int": pa.int64(), "float": pa.float64(), "str": pa.string()}
+    columns = _TABLES[table]["columns"]
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, schema, compression="none" if compression == "none" else compression)
+    try:
+        for rows in chunks:
+            arrays = [pa.array([r[i] for r in rows], type=schema.field(i).type) for i in range(len(columns))]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def _compress(data: Iterator[bytes], compression: str) -> Iterator[bytes]:
+    if compression == "gzip":
+        comp = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    else:
+        comp = zstandard.ZstdCompressor().compressobj()
+    for part in data:
+        out = comp.compress(part)
+        if out:
+            yield out
+    yield comp.flush()
+
+
+# ===== Public API =====
+def export(table: str, fmt: str = "csv", compression: str = "none",
+           filters: Optional[Dict[str, Optional[str]]] = None, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+    """
+    Validates the request and returns an iterator of encoded bytes. Raises
+    ValueError for bad arguments or a missing optional dependency, before any
+    output is produced.
+    """
+    if table not in _TABLES:
+        raise ValueError(f"table must be one of {', '.join(_TABLES)}")
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"compression must be one of {', '.join(COMPRESSIONS)}")
+    if fmt == "parquet" and pq is None:
+        raise ValueError("Parquet export needs pyarrow (pip install pyarrow)")
+    if compression == "zstd" and fmt == "csv" and zstandard is None:
+        raise ValueError("zstd compression needs zstandard (pip install zstandard)")
+    filters = filters or {}
+    _where(table, filters)  # validate filters now rather than mid-stream
+    chunks = iter_chunks(table, filters, chunk_rows)
+    if fmt == "parquet":
+        return _parquet_chunks(table, chunks, compression)
+    data = _csv_chunks(table, chunks)
+    return data if compression == "none" else _compress(data, compression)
+
+
+def media_type(fmt: str, compression: str = "none") -> str:
+    if fmt == "csv" and compression == "gzip":
+        return "application/gzip"
+    if fmt == "csv" and compression == "zstd":
+        return "application/zstd"
+    return _MEDIA_TYPES[fmt]
+
+
+def filename(table: str, fmt: str, compression: str = "none") -> str:
+    name = f"{table}.{fmt}"
+    return name + _EXTENSIONS.get(compression, "") if fmt == "csv" else name
+
+
+# ===== CLI =====
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Stream submissions or results to CSV or Parquet.")
+    parser.add_argument("table", choices=list(_TABLES))
+    parser.add_argument("--db", default=os.getenv("EXAM_DB_PATH", "exam_results.db"))
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--compression", choices=COMPRESSIONS, default="none")
+    parser.add_argument("--pool", help="only submissions from this question pool (exam)")
+    parser.add_argument("--session-id")
+    parser.add_argument("--since", help="epoch seconds or ISO date/time (inclusive)")
+    parser.add_argument("--until", help="epoch seconds or ISO date/time (exclusive)")
+    parser.add_argument("--chunk-rows", type=int, default=EXPORT_CHUNK_ROWS)
+    parser.add_argument("-o", "--output", help="file to write (default: stdout)")
+    args = parser.parse_args(argv)
+
+    persistence.start(args.db)
+    filters = {"pool": args.pool, "session_id": args.session_id, "since": args.since, "until": args.until}
+    try:
+        data = export(args.table, args.format, args.compression, filters, args.chunk_rows)
+    except ValueError as e:
+        parser.error(str(e))
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for part in data:
+            out.write(part)
+    finally:
+        if args.output:
+            out.close()
+        persistence.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,18 @@
 # app/services/generation.py
 import random
-import re
+
+from app.services import topic_index
 
 def extract_topic(text: str) -> str:
     """
-    Very basic keyword/topic extractor.
-    You can extend with NLP later if needed.
+    Most frequent vocabulary term in `text` (see topic_index), found in a
+    single pass; the first one to appear wins ties.
     """
-    keywords = re.findall(r"\b(?:process|scheduling|threads|memory|paging|deadlock|filesystem|synchronization|semaphores)\b", text.lower())
-    return keywords[0] if keywords else "shell scripting in operating systems"
+    counts = topic_index.term_counts(text)
+    return max(counts, key=counts.get) if counts else topic_index.DEFAULT_TOPIC
 
-def generate_coding_question(text: str, unique=True, broader_topic=True) -> str:
-    topic = extract_topic(text)
+def generate_coding_question(text: str, unique=True, broader_topic=True, topic=None) -> str:
+    topic = topic or extract_topic(text)
     variations = [
         f"Write a shell script to simulate {topic}.",
         f"Create a shell script that accepts user input and demonstrates {topic}.",
@@ -20,8 +21,8 @@ def generate_coding_question(text: str, unique=True, broader_topic=True) -> str:
     ]
     return random.choice(variations)
 
-def generate_error_question(text: str, unique=True, broader_topic=True) -> str:
-    topic = extract_topic(text)
+def generate_error_question(text: str, unique=True, broader_topic=True, topic=None) -> str:
+    topic = topic or extract_topic(text)
     variations = [
         f"The following shell script related to {topic} contains an error. Identify and fix it:\n\n```sh\n#!/bin/bash\necho \"Enter filename:\"\nread file\nif [ -f $file ]\nthen\n    echo \"File exists\"\nelse\n    echo \"File not found\"\nfi\n```",
         f"A shell script intended to demonstrate {topic} is not working as expected. Describe one common mistake and provide the corrected version.",
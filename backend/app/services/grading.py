@@ -1,43 +1,73 @@
 import os
 import re
 import json
+import time
 import logging
-from typing import Optional
-from dotenv import load_dotenv
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
 
-# FIXED: Using a relative path for the .env file.
-# This assumes your .env file is in the root directory of your backend project.
-load_dotenv("D:/testAI/backend/app/.env")
-
-try:
-    import google.generativeai as genai
-except ImportError:
-    genai = None
+from app import config
+from app.services import execution_grader, grading_cache, heuristic_rules, llm_backends, llm_guard, metrics, prompt_builder, surrogate
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # ===== Config =====
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-1.5-flash")
-
 CODE_MAX = 3.0
+ERROR_MAX = 2.0
+# Marks per exam part; a multi-part submission's total is the sum of its parts.
+PART_MAX = {"code": CODE_MAX, "error": ERROR_MAX}
+TOTAL_MAX = sum(PART_MAX.values())
+# Upper bound on submissions packed into one batch grading request.
+GRADING_BATCH_SIZE = int(os.getenv("GRADING_BATCH_SIZE", "8"))
+# Bump whenever the rubric prompt or CODE_MAX changes so cached grades from the
+# old rubric are no longer reused.
+RUBRIC_VERSION = "2"
 
-# Initialize Gemini model
-_MODEL = None
-if genai and GEMINI_API_KEY:
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        _MODEL = genai.GenerativeModel(GEMINI_MODEL_NAME)
-        logger.info("✅ Gemini model initialized successfully for grading.")
-    except Exception as e:
-        logger.warning(f"⚠️ Failed to initialize Gemini: {e}")
-        _MODEL = None
-else:
-    if not GEMINI_API_KEY:
-        logger.warning("⚠️ GEMINI_API_KEY not set in .env file. Using heuristic grading fallback.")
-    if not genai:
-        logger.warning("⚠️ 'google-generativeai' not installed. Using heuristic grading fallback.")
+# The grading LLM (Gemini unless LLM_BACKEND says otherwise) is built on first use.
+_BACKEND: Optional[llm_backends.LLMBackend] = None
+_BACKEND_READY = False
+_BACKEND_LOCK = threading.Lock()
+# Shared limiter / retry / circuit breaker for every outbound LLM call.
+_GUARD = llm_guard.LLMGuard()
+
+def _backend() -> Optional[llm_backends.LLMBackend]:
+    global _BACKEND, _BACKEND_READY
+    if not _BACKEND_READY:
+        with _BACKEND_LOCK:
+            if not _BACKEND_READY:
+                _BACKEND = llm_backends.get_backend(
+                    config.get("GEMINI_API_KEY"), config.get("GEMINI_MODEL_NAME", "gemini-1.5-flash")
+                )
+                _BACKEND_READY = True
+    return _BACKEND
+
+def warm_up():
+    """Builds the LLM client now (at startup) instead of on the first grading call."""
+    _backend()
+
+# Gradings in progress, by cache key, so identical answers graded at the same
+# time (a double submit, or two workers) share one computation.
+_INFLIGHT: Dict[str, Future] = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+def _claim(key: str) -> Tuple[Future, bool]:
+    """Returns the future for `key` and whether the caller owns (must compute) it."""
+    with _INFLIGHT_LOCK:
+        fut = _INFLIGHT.get(key)
+        if fut is not None:
+            return fut, False
+        fut = _INFLIGHT[key] = Future()
+        return fut, True
+
+def _release(key: str, fut: Future, marks: Optional[float] = None, error: Optional[BaseException] = None):
+    with _INFLIGHT_LOCK:
+        _INFLIGHT.pop(key, None)
+    if error is not None:
+        fut.set_exception(error)
+    else:
+        fut.set_result(marks)
 
 # ===== Helper Functions =====
 def _clamp(x: float, lo: float, hi: float) -> float:
@@ -61,66 +91,368 @@ def _parse_json_maybe(text: str) -> Optional[dict]:
             try:
                 return json.loads(match.group(0))
             except json.JSONDecodeError:
-                return None
+                pass
+    metrics.LLM_PARSE_FAILURES.inc(kind="object")
     return None
 
-def _call_gemini(prompt: str) -> Optional[dict]:
-    if not _MODEL:
+def _parse_json_list_maybe(text: str) -> Optional[list]:
+    if not text:
+        return None
+    s = text.strip()
+    if s.startswith("```"):
+        s = re.sub(r"^```[a-zA-Z0-9]*\s*", "", s)
+        s = re.sub(r"\s*```$", "", s)
+    try:
+        data = json.loads(s)
+    except json.JSONDecodeError:
+        match = re.search(r"\[.*\]", s, re.DOTALL)
+        try:
+            data = json.loads(match.group(0)) if match else None
+        except json.JSONDecodeError:
+            data = None
+    if not isinstance(data, list):
+        metrics.LLM_PARSE_FAILURES.inc(kind="list")
+        return None
+    return data
+
+def _call_llm_text(prompt, guard: Optional[llm_guard.LLMGuard] = None) -> Optional[str]:
+    """
+    `prompt` is a plain string or a prompt_builder.Prompt (sent with its
+    system part). `guard` defaults to the grading guard.
+    """
+    guard = guard or _GUARD
+    backend = _backend()
+    if not backend:
         return None
+    if isinstance(prompt, prompt_builder.Prompt):
+        system, prompt = prompt.system, prompt.user
+    else:
+        system = None
+    start = time.perf_counter()
+    outcome = "ok"
     try:
-        resp = _MODEL.generate_content(prompt)
-        text = getattr(resp, "text", "") or ""
-        return _parse_json_maybe(text)
+        return guard.call(lambda timeout: backend.generate(prompt, timeout=timeout, system=system))
+    except llm_guard.LLMGuardError as e:
+        outcome = "skipped"
+        logger.warning(f"⚠️ Skipping LLM ({backend.name}): {e}")
+        return None
     except Exception as e:
-        logger.error(f"❌ Gemini API call failed: {e}")
+        outcome = "error"
+        logger.error(f"❌ LLM ({backend.name}) call failed: {e}")
+        return None
+    finally:
+        metrics.LLM_LATENCY.observe(time.perf_counter() - start, backend=backend.name, outcome=outcome)
+
+def complete(prompt: str, guard: Optional[llm_guard.LLMGuard] = None) -> Optional[str]:
+    """
+    Free-text LLM call through the same backend, for other services. Pass
+    their own `guard` so background work does not take grading's slots and
+    breaker budget.
+    """
+    return _call_llm_text(prompt, guard)
+
+def llm_available(guard: Optional[llm_guard.LLMGuard] = None) -> bool:
+    return bool(_backend()) and (guard or _GUARD).is_available()
+
+def llm_status() -> dict:
+    """Backend name plus limiter / circuit breaker state, for monitoring."""
+    backend = _backend()
+    return {"backend": backend.name if backend else None, **_GUARD.snapshot(), "prompts": prompt_builder.stats()}
+
+def _call_llm(prompt) -> Optional[dict]:
+    return _parse_json_maybe(_call_llm_text(prompt))
+
+def _coerce_marks(value, max_marks: float) -> Optional[float]:
+    try:
+        return _clamp(_round_quarter(float(value)), 0.0, max_marks)
+    except (ValueError, TypeError):
         return None
 
 # ===== Heuristic Fallback (if Gemini fails) =====
-def _heuristic_score_code(answer: str, max_marks: float) -> float:
-    logger.info("Using heuristic fallback for code grading.")
-    if not answer or not answer.strip():
-        return 0.0
-    score = 0.5
-    if "#!/bin/bash" in answer: score += 0.5
-    if re.search(r"\b(find|grep|awk|sed|ps|sort)\b", answer): score += 0.5
-    if re.search(r"\b(for|while|if)\b", answer): score += 0.5
-    if re.search(r"set -[euo]", answer): score += 0.25
-    if re.search(r"\[\[.*\]\]", answer): score += 0.25
-    return _clamp(_round_quarter(score), 0.0, max_marks)
+# Rule set per part: None lets heuristic_rules detect bash / python from the code.
+_HEURISTIC_LANGUAGE = {"code": None, "error": "debug"}
 
-# ===== Public API (used by the main FastAPI route) =====
-def grade_code(code_answer: str, question: Optional[str] = None) -> float:
-    max_marks = CODE_MAX
-    prompt = f"""
-You are an expert examiner grading a shell-scripting exam question.
+def _heuristic_scores(answers: List[str], max_marks: float, part: str = "code") -> List[float]:
+    logger.info(f"Using heuristic fallback for {len(answers)} {part} answer(s).")
+    metrics.GRADES.inc(len(answers), method="heuristic")
+    scores = []
+    for result in heuristic_rules.score_batch(answers, max_marks, _HEURISTIC_LANGUAGE[part]):
+        logger.debug(result["feedback"])
+        scores.append(_clamp(_round_quarter(result["marks"]), 0.0, max_marks))
+    return scores
 
-The Question:
-{question or "A standard shell scripting task involving file operations, process management, or text manipulation."}
+def _heuristic_score_code(answer: str, max_marks: float, part: str = "code") -> float:
+    return _heuristic_scores([answer], max_marks, part)[0]
 
-The Student's Submitted Answer:
-```bash
-{code_answer}
-```
+# ===== Prompts =====
+# The static instructions (role, rubric, output format) form the system part of
+# every grading prompt and never change between requests, so the backend can
+# keep them as a cached prefix; only the question and answers vary.
+_TRUNCATION_NOTE = 'Parts of a long answer may be replaced by an "[... characters omitted ...]" marker; grade what is shown.'
 
-Please grade the answer based on the following rubric:
+# Each exam part has its own examiner role and rubric.
+_TASKS = {
+    "code": "a shell-scripting exam question",
+    "error": "a debugging exam question (find, explain and fix the errors in a shell script)",
+}
+_RUBRICS = {
+    "code": f"""Please grade the answer based on the following rubric:
 - Correctness: Does the script achieve the goal?
 - Best Practices: Does it use quotes correctly? Does it handle potential errors?
 - Efficiency: Is the use of commands and pipelines logical?
+{_TRUNCATION_NOTE}""",
+    "error": f"""Please grade the answer based on the following rubric:
+- Diagnosis: Does it identify the actual error(s) in the given script, not unrelated style points?
+- Explanation: Does it say why the error breaks the script (what happens when it runs)?
+- Fix: Is the corrected script or line right, and does it avoid introducing new errors?
+An answer that only rewrites the script without naming the error, or names it without fixing it, earns partial marks.
+{_TRUNCATION_NOTE}""",
+}
+
+_DEFAULT_QUESTION = "A standard shell scripting task involving file operations, process management, or text manipulation."
+
+def _code_system(max_marks: float, part: str = "code") -> str:
+    return f"""You are an expert examiner grading {_TASKS[part]}.
+
+{_RUBRICS[part]}
 
 Return your response in JSON format ONLY, with no other text or code fences. The JSON must have this exact schema:
 {{
   "marks": <a number between 0.0 and {max_marks}, in increments of 0.25>,
   "feedback": "<A concise, one-sentence feedback for the student.>"
-}}
-"""
-    data = _call_gemini(prompt)
+}}"""
+
+def _batch_system(max_marks: float, part: str = "code") -> str:
+    return f"""You are an expert examiner grading several students' answers to the same question, {_TASKS[part]}.
+Grade every submission independently; do not compare them with each other.
+
+{_RUBRICS[part]}
+
+Return your response in JSON format ONLY, with no other text or code fences: a JSON array with exactly one
+object per submission, using this exact schema:
+[
+  {{"id": <the submission number>, "marks": <a number between 0.0 and {max_marks}, in increments of 0.25>, "feedback": "<A concise, one-sentence feedback for the student.>"}}
+]"""
+
+def _code_prompt(code_answer: str, question: Optional[str], max_marks: float, part: str = "code") -> prompt_builder.Prompt:
+    return prompt_builder.build(
+        _code_system(max_marks, part),
+        "The Question:\n{question}\n\nThe Student's Submitted Answer:\n```bash\n{code}\n```\n",
+        {"question": question or _DEFAULT_QUESTION, "code": code_answer},
+        {"question": prompt_builder.PROMPT_QUESTION_TOKENS, "code": prompt_builder.PROMPT_CODE_TOKENS},
+    )
+
+def _batch_prompt(answers: List[tuple], question: Optional[str], max_marks: float, part: str = "code") -> prompt_builder.Prompt:
+    """`answers` is a list of (id, code) pairs; ids are echoed back by the model."""
+    per_answer = min(prompt_builder.PROMPT_CODE_TOKENS, prompt_builder.PROMPT_BATCH_TOKENS // max(1, len(answers)))
+    blocks = []
+    for sid, code in answers:
+        code, cut = prompt_builder.fit(code, per_answer, "code")
+        if cut:
+            prompt_builder.record_truncation("code")
+        blocks.append(f"<<<SUBMISSION {sid}>>>\n{code}\n<<<END SUBMISSION {sid}>>>")
+    return prompt_builder.build(
+        _batch_system(max_marks, part),
+        "The Question:\n{question}\n\nThe Students' Submitted Answers (each between its SUBMISSION markers):\n\n{blocks}\n",
+        {"question": question or _DEFAULT_QUESTION, "blocks": "\n\n".join(blocks)},
+        {"question": prompt_builder.PROMPT_QUESTION_TOKENS},
+    )
+
+def _namespace(max_marks: float, part: str = "code") -> str:
+    return f"{part}:{RUBRIC_VERSION}:{max_marks}"
+
+def _cache_key(code_answer: str, question: Optional[str], max_marks: float, part: str = "code") -> str:
+    return grading_cache.make_key(question, code_answer, namespace=_namespace(max_marks, part))
+
+def _execution_marks(executed: dict, max_marks: float) -> float:
+    # Capped below max_marks: passing the fixtures says nothing about style or robustness.
+    cap = max_marks * execution_grader.EXECUTION_MARKS_CAP
+    return _clamp(_round_quarter(executed["ratio"] * cap), 0.0, max_marks)
+
+# ===== Public API (used by the main FastAPI route) =====
+def grade_heuristic_batch(code_answers: List[str], part: str = "code") -> List[float]:
+    """Rule-engine marks only (no cache, sandbox or LLM); cheap enough for worker processes."""
+    return _heuristic_scores(code_answers, PART_MAX[part], part) if code_answers else []
+
+def grade_execution_batch(code_answers: List[str], question: Optional[str] = None) -> List[Optional[float]]:
+    """Marks from running the answers against the question's fixtures; None where that was not possible."""
+    if not execution_grader.has_fixtures(question):
+        return [None] * len(code_answers)
+    return [None if r is None else _execution_marks(r, CODE_MAX)
+            for r in execution_grader.grade_batch(code_answers, question)]
+
+def grade_code(code_answer: str, question: Optional[str] = None, local: bool = True) -> float:
+    max_marks = CODE_MAX
+    if not code_answer or not code_answer.strip():
+        metrics.GRADES.inc(method="empty")
+        return 0.0
+
+    cache_key = _cache_key(code_answer, question, max_marks)
+    cached = grading_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Grading cache hit with score: {cached['marks']}")
+        metrics.GRADES.inc(method="cache")
+        return cached["marks"]
+
+    fut, owner = _claim(cache_key)
+    if not owner:
+        metrics.GRADES.inc(method="coalesced")
+        return fut.result()
+    try:
+        marks = _grade_code_uncached(code_answer, question, max_marks, cache_key, local)
+    except BaseException as e:
+        _release(cache_key, fut, error=e)
+        raise
+    _release(cache_key, fut, marks)
+    return marks
+
+def _grade_code_uncached(code_answer: str, question: Optional[str], max_marks: float, cache_key: str, local: bool,
+                         part: str = "code") -> float:
+    # Questions with fixtures are graded by running the script; the LLM is
+    # only asked when the runs could not be carried out.
+    executed = execution_grader.grade(code_answer, question) if local and part == "code" else None
+    if executed is not None:
+        marks = _execution_marks(executed, max_marks)
+        logger.info(f"Execution graded with score: {marks}. {executed['feedback']}")
+        grading_cache.put(cache_key, marks, executed["feedback"])
+        metrics.GRADES.inc(method="execution")
+        return marks
+
+    # Next, answers close to several earlier LLM-graded ones that agree.
+    prediction = surrogate.predict_batch([code_answer], question, _namespace(max_marks, part))[0] if local else None
+    if surrogate.should_skip_llm(prediction):
+        marks = _coerce_marks(prediction["marks"], max_marks)
+        logger.info(f"Surrogate graded with score: {marks} from {prediction['neighbours']} similar answer(s).")
+        metrics.GRADES.inc(method="surrogate")
+        return marks
+
+    data = _call_llm(_code_prompt(code_answer, question, max_marks, part))
     if data and "marks" in data:
-        try:
-            marks = float(data["marks"])
-            logger.info(f"Gemini graded with score: {marks}. Feedback: {data.get('feedback', 'N/A')}")
-            return _clamp(_round_quarter(marks), 0.0, max_marks)
-        except (ValueError, TypeError):
-            logger.warning("Gemini returned invalid marks. Falling back to heuristic grading.")
-            pass
-
-    return _heuristic_score_code(code_answer, max_marks)
+        marks = _coerce_marks(data["marks"], max_marks)
+        if marks is not None:
+            logger.info(f"LLM graded with score: {marks}. Feedback: {data.get('feedback', 'N/A')}")
+            surrogate.observe(code_answer, question, marks, _namespace(max_marks, part), prediction)
+            metrics.GRADES.inc(method="llm")
+            # Only LLM and execution grades are cached; the heuristic is cheap and
+            # should not pin a degraded score once Gemini is reachable again.
+            grading_cache.put(cache_key, marks, data.get("feedback"))
+            return marks
+        logger.warning("LLM returned invalid marks. Falling back to heuristic grading.")
+
+    return _heuristic_score_code(code_answer, max_marks, part)
+
+def grade_code_batch(code_answers: List[str], question: Optional[str] = None, max_marks: float = CODE_MAX,
+                     part: str = "code") -> List[float]:
+    """
+    Grades many answers to the same question. Questions with fixtures are first
+    graded by running every answer in the sandbox pool in parallel; the rest
+    are scored by the surrogate when similar graded answers agree, and what is
+    left is packed, up to GRADING_BATCH_SIZE at a time, into LLM requests. Items
+    the model leaves out or returns unparseable marks for are re-graded one by
+    one. Identical answers are graded once, and answers another thread is
+    already grading wait for its result.
+    `part` picks the rubric, prompt and heuristic rules ("error" answers are
+    graded as debugging explanations and never executed) and `max_marks` is
+    its weight (PART_MAX). Returns scores in the same order as `code_answers`.
+    """
+    scores: List[Optional[float]] = [None] * len(code_answers)
+    pending = []
+    first: Dict[str, int] = {}  # cache key -> first index with that answer
+    copies: Dict[int, int] = {}  # duplicate index -> index it copies
+    owned: Dict[str, Future] = {}
+    waiting: Dict[int, Future] = {}
+    for i, code in enumerate(code_answers):
+        if not code or not code.strip():
+            scores[i] = 0.0
+            metrics.GRADES.inc(method="empty")
+            continue
+        key = _cache_key(code, question, max_marks, part)
+        if key in first:
+            copies[i] = first[key]
+            continue
+        first[key] = i
+        cached = grading_cache.get(key)
+        if cached is not None:
+            scores[i] = cached["marks"]
+            metrics.GRADES.inc(method="cache")
+            continue
+        fut, owner = _claim(key)
+        if owner:
+            owned[key] = fut
+            pending.append(i)
+        else:
+            waiting[i] = fut
+
+    try:
+        _grade_pending(code_answers, question, pending, scores, max_marks, part)
+    except BaseException as e:
+        for key, fut in owned.items():
+            _release(key, fut, error=e)
+        raise
+    for key, fut in owned.items():
+        _release(key, fut, scores[first[key]])
+    for i, fut in waiting.items():
+        scores[i] = fut.result()
+    for i, src in copies.items():
+        scores[i] = scores[src]
+    if waiting or copies:
+        metrics.GRADES.inc(len(waiting) + len(copies), method="coalesced")
+    return scores
+
+def _grade_pending(code_answers: List[str], question: Optional[str], pending: List[int],
+                   scores: List[Optional[float]], max_marks: float, part: str = "code"):
+    """Fills `scores` for the `pending` indexes (distinct answers this thread owns)."""
+    if pending and part == "code" and execution_grader.has_fixtures(question):
+        executed = execution_grader.grade_batch([code_answers[i] for i in pending], question)
+        for i, result in zip(pending, executed):
+            if result is not None:
+                scores[i] = _execution_marks(result, max_marks)
+                grading_cache.put(_cache_key(code_answers[i], question, max_marks, part), scores[i], result["feedback"])
+        pending = [i for i in pending if scores[i] is None]
+        metrics.GRADES.inc(len(executed) - len(pending), method="execution")
+        logger.info(f"Execution graded {len(executed) - len(pending)}/{len(executed)} submissions.")
+
+    predictions = {}
+    if pending:
+        for i, prediction in zip(pending, surrogate.predict_batch([code_answers[i] for i in pending], question, _namespace(max_marks, part))):
+            if surrogate.should_skip_llm(prediction):
+                scores[i] = _coerce_marks(prediction["marks"], max_marks)
+            else:
+                predictions[i] = prediction
+        skipped = sum(1 for i in pending if scores[i] is not None)
+        if skipped:
+            metrics.GRADES.inc(skipped, method="surrogate")
+            logger.info(f"Surrogate graded {skipped}/{len(pending)} submissions from similar graded answers.")
+        pending = [i for i in pending if scores[i] is None]
+
+    if len(pending) > 1 and llm_available():
+        for start in range(0, len(pending), GRADING_BATCH_SIZE):
+            chunk = pending[start:start + GRADING_BATCH_SIZE]
+            text = _call_llm_text(_batch_prompt([(i, code_answers[i]) for i in chunk], question, max_marks, part))
+            items = _parse_json_list_maybe(text) or []
+            wanted = set(chunk)
+            for item in items:
+                if not isinstance(item, dict):
+                    continue
+                try:
+                    i = int(item.get("id"))
+                except (TypeError, ValueError):
+                    continue
+                marks = _coerce_marks(item.get("marks"), max_marks)
+                if i in wanted and marks is not None and scores[i] is None:
+                    scores[i] = marks
+                    grading_cache.put(_cache_key(code_answers[i], question, max_marks, part), marks, item.get("feedback"))
+                    surrogate.observe(code_answers[i], question, marks, _namespace(max_marks, part), predictions.get(i))
+                    metrics.GRADES.inc(method="llm")
+            missed = sum(1 for i in chunk if scores[i] is None)
+            logger.info(f"Batch graded {len(chunk) - missed}/{len(chunk)} submissions in one LLM call.")
+
+    pending = [i for i in pending if scores[i] is None]
+    if pending and not llm_available():
+        # No LLM to ask: score the rest of the batch with the rule engine in one go.
+        for i, marks in zip(pending, _heuristic_scores([code_answers[i] for i in pending], max_marks, part)):
+            scores[i] = marks
+    for i in pending:
+        if scores[i] is None:
+            key = _cache_key(code_answers[i], question, max_marks, part)
+            scores[i] = _grade_code_uncached(code_answers[i], question, max_marks, key, local=False, part=part)
@@ -0,0 +1,211 @@
+import os
+import re
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+from app.services import blob_store, persistence
+
+logger = logging.getLogger(__name__)
+
+# ===== Config =====
+# Upper bound on the in-process tier, measured in bytes of cached entries.
+GRADING_CACHE_MAX_BYTES = int(os.getenv("GRADING_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+
+# Rough per-entry bookkeeping cost (key, dict, floats) on top of the feedback text.
+_ENTRY_OVERHEAD = 200
+
+_LOCK = threading.Lock()
+_MEMORY: "OrderedDict[str, dict]" = OrderedDict()
+_MEMORY_BYTES = 0
+_PERSIST = False
+_STATS = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+
+# ===== Normalization =====
+# `<<EOF`, `<<-EOF` or `<<'EOF'` (not the `<<<` here-string).
+_HEREDOC = re.compile(r"<<(-?)[ \t]*(['\"]?)([A-Za-z_][\w.-]*)\2")
+
+
+def _normalize_line(line: str, quote: Optional[str]) -> tuple:
+    """
+    Drops a trailing `# comment` and collapses whitespace, both only outside
+    quotes (`#` inside quotes or words like `$#` is kept). `quote` is the
+    quote still open from the previous line. Returns (text, quote still open
+    at the end, heredoc terminators started on this line as (word, strip_tabs)).
+    """
+    out: List[str] = []
+    heredocs = []
+    space = False
+    for i, ch in enumerate(line):
+        if quote:
+            out.append(ch)
+            if ch == quote:
+                quote = None
+            continue
+        if ch.isspace():
+            space = bool(out)
+            continue
+        if ch == "#" and (i == 0 or line[i - 1].isspace()):
+            break
+        if space:
+            out.append(" ")
+            space = False
+        if ch in ("'", '"'):
+            quote = ch
+        elif ch == "<" and (i == 0 or line[i - 1] != "<"):
+            m = _HEREDOC.match(line, i)
+            if m:
+                heredocs.append((m.group(3), m.group(1) == "-"))
+        out.append(ch)
+    return "".join(out), quote, heredocs
+
+
+def normalize_code(code: str) -> str:
+    """
+    Canonical form of a script for cache lookups: comments, blank lines and
+    whitespace differences outside quotes are removed. Quoted strings (also
+    across lines) and heredoc bodies are kept verbatim, since whitespace there
+    changes the output. The shebang is kept since it changes what the script
+    means.
+    """
+    lines: List[str] = []
+    quote = None
+    heredocs: List[tuple] = []
+    for i, raw in enumerate((code or "").splitlines()):
+        if heredocs:
+            lines.append(raw)
+            word, strip_tabs = heredocs[0]
+            if (raw.lstrip("\t") if strip_tabs else raw) == word:
+                heredocs.pop(0)
+            continue
+        if quote is None and i == 0 and raw.strip().startswith("#!"):
+            lines.append(re.sub(r"\s+", " ", raw.strip()))
+            continue
+        inside = quote is not None
+        text, quote, started = _normalize_line(raw, quote)
+        heredocs.extend(started)
+        if text or inside:
+            lines.append(text)
+    return "\n".join(lines)
+
+
+def normalize_question(question: Optional[str]) -> str:
+    return re.sub(r"\s+", " ", (question or "").strip().lower())
+
+
+def make_key(question: Optional[str], code: str, namespace: str = "") -> str:
+    """Content address of a (question, answer) pair; `namespace` separates rubric versions."""
+    h = hashlib.sha256()
+    for part in (namespace, normalize_question(question), normalize_code(code)):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+# ===== Memory tier =====
+def _entry_size(key: str, entry: dict) -> int:
+    return len(key) + len(entry.get("feedback") or "") + _ENTRY_OVERHEAD
+
+
+def _remember(key: str, entry: dict):
+    global _MEMORY_BYTES
+    if key in _MEMORY:
+        _MEMORY_BYTES -= _entry_size(key, _MEMORY.pop(key))
+    _MEMORY[key] = entry
+    _MEMORY_BYTES += _entry_size(key, entry)
+    while _MEMORY_BYTES > GRADING_CACHE_MAX_BYTES and len(_MEMORY) > 1:
+        old_key, old_entry = _MEMORY.popitem(last=False)
+        _MEMORY_BYTES -= _entry_size(old_key, old_entry)
+        _STATS["evictions"] += 1
+
+
+def _log_persist_failure(fut):
+    if fut.exception() is not None:
+        logger.warning(f"⚠️ Could not persist grading cache entry: {fut.exception()}")
+
+
+# ===== Public API =====
+def configure(persist: bool):
+    """
+    Turns the persistent tier (the `grading_cache` table) on or off. Needs the
+    persistence writer to be running while enabled.
+    """
+    global _PERSIST
+    _PERSIST = persist
+
+
+def get(key: str) -> Optional[dict]:
+    """Returns `{"marks", "feedback"}` for a cached grade, or None."""
+    with _LOCK:
+        entry = _MEMORY.get(key)
+        if entry is not None:
+            _MEMORY.move_to_end(key)
+            _STATS["memory_hits"] += 1
+            return dict(entry)
+
+    # The disk read runs without the lock so other lookups are not queued behind it.
+    row = None
+    if _PERSIST:
+        try:
+            row = persistence.reader().execute(
+                f"SELECT marks, {blob_store.text_sql('feedback', 'feedback_blob')} FROM grading_cache "
+                "WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Grading cache lookup failed: {e}")
+
+    with _LOCK:
+        if row is None:
+            _STATS["misses"] += 1
+            return None
+        # A put() that landed meanwhile is at least as fresh as the row.
+        entry = _MEMORY.get(key)
+        if entry is None:
+            entry = {"marks": row[0], "feedback": row[1]}
+            _remember(key, entry)
+        _STATS["disk_hits"] += 1
+        return dict(entry)
+
+
+def put(key: str, marks: float, feedback: Optional[str] = None):
+    entry = {"marks": marks, "feedback": feedback}
+    with _LOCK:
+        _remember(key, entry)
+        _STATS["stores"] += 1
+    if not _PERSIST:
+        return
+    # Fire and forget: a lost cache row only costs one more LLM call later.
+    try:
+        fut = persistence.submit(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO grading_cache (key, marks, feedback, feedback_blob) VALUES (?, ?, ?, ?)",
+            (key, marks, *blob_store.store(conn, feedback)),
+        ))
+    except RuntimeError as e:
+        logger.warning(f"⚠️ Could not persist grading cache entry: {e}")
+        return
+    fut.add_done_callback(_log_persist_failure)
+
+
+def clear_memory():
+    global _MEMORY_BYTES
+    with _LOCK:
+        _MEMORY.clear()
+        _MEMORY_BYTES = 0
+
+
+def stats() -> dict:
+    with _LOCK:
+        hits = _STATS["memory_hits"] + _STATS["disk_hits"]
+        lookups = hits + _STATS["misses"]
+        return {
+            **_STATS,
+            "hits": hits,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(_MEMORY),
+            "memory_bytes": _MEMORY_BYTES,
+            "memory_max_bytes": GRADING_CACHE_MAX_BYTES,
+        }
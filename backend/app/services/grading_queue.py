@@ -0,0 +1,317 @@
+import os
+import queue
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Optional
+
+from app.services import aggregates, blob_store, events, grading, metrics, persistence, similarity
+
+logger = logging.getLogger(__name__)
+
+# ===== Config =====
+GRADING_WORKERS = int(os.getenv("GRADING_WORKERS", "4"))
+
+# Job states, persisted in the `submissions.status` column.
+QUEUED = "queued"
+GRADING = "grading"
+DONE = "done"
+FAILED = "failed"
+
+_QUEUE: "queue.Queue[Optional[int]]" = queue.Queue()
+_WORKERS: list = []
+_STOP = object()
+# Grades the parts / question groups of one batch side by side; shared by all workers.
+_PART_POOL: Optional[ThreadPoolExecutor] = None
+_PART_POOL_LOCK = threading.Lock()
+
+
+# ===== Helper Functions =====
+def _set_status(submission_id: int, status: str, error: Optional[str] = None):
+    persistence.write(lambda conn: conn.execute(
+        "UPDATE submissions SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+        (status, error, submission_id),
+    ))
+
+
+def _write_result(conn: sqlite3.Connection, submission_id: int, full_name: str, parts: dict) -> tuple:
+    # Runs on the writer thread: every part's score, the total and the job state
+    # land in the same transaction, so a `done` job always has its result row.
+    code_score, error_score, total = parts["code"], parts.get("error"), sum(parts.values())
+    outcome = persistence.upsert_result(conn, full_name, code_score, error_score, total)
+    conn.execute(
+        "UPDATE submissions SET status = ?, code_score = ?, error_score = ?, total_score = ?, error = NULL, "
+        "updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+        (DONE, code_score, error_score, total, submission_id),
+    )
+    return outcome
+
+
+def _check_similarity(rows: list) -> dict:
+    """
+    Adds each answer to the near-duplicate index, logs likely copies of other
+    candidates' answers and returns {submission id: score} for answers close
+    enough to an already graded one to reuse its grade.
+    """
+    threshold = min(similarity.FLAG_THRESHOLD, similarity.REUSE_THRESHOLD or similarity.FLAG_THRESHOLD)
+    reused = {}
+    for r in rows:
+        try:
+            matches = similarity.index_submission(r["id"], r["question"], r["code_answer"], threshold)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not index submission {r['id']} for similarity: {e}")
+            continue
+        if not matches:
+            continue
+        ids = [m["submission_id"] for m in matches]
+        earlier = {e["id"]: e for e in persistence.reader().execute(
+            f"SELECT id, full_name, status, code_score FROM submissions WHERE id IN ({','.join('?' * len(ids))})", ids
+        )}
+        copies = [
+            m for m in matches
+            if m["similarity"] >= similarity.FLAG_THRESHOLD
+            and m["submission_id"] in earlier and earlier[m["submission_id"]]["full_name"] != r["full_name"]
+        ]
+        if copies:
+            logger.warning(
+                f"⚠️ Submission {r['id']} ({r['full_name']}) is a near-copy of "
+                + ", ".join(f"#{m['submission_id']} ({m['similarity']:.0%})" for m in copies)
+            )
+        if similarity.REUSE_THRESHOLD > 0:
+            for m in matches:
+                e = earlier.get(m["submission_id"])
+                if m["similarity"] >= similarity.REUSE_THRESHOLD and e and e["status"] == DONE and e["code_score"] is not None:
+                    reused[r["id"]] = e["code_score"]
+                    metrics.GRADES.inc(method="reused")
+                    logger.info(f"Submission {r['id']} reuses the grade of #{m['submission_id']} ({m['similarity']:.0%} similar).")
+                    break
+    return reused
+
+
+def _part_pool() -> ThreadPoolExecutor:
+    global _PART_POOL
+    with _PART_POOL_LOCK:
+        if _PART_POOL is None:
+            _PART_POOL = ThreadPoolExecutor(max_workers=max(1, GRADING_WORKERS) * len(grading.PART_MAX),
+                                            thread_name_prefix="grader-part")
+        return _PART_POOL
+
+
+def _fan_out(tasks: list) -> list:
+    """Runs every task's scorer on the part pool at once; failures are returned, not raised."""
+    futures = [_part_pool().submit(score_group, group) for _, group, score_group in tasks]
+    wait(futures)
+    return [f.exception() if f.exception() is not None else f.result() for f in futures]
+
+
+def _grade_jobs(submission_ids: list):
+    """
+    Grades a handful of jobs taken off the queue together. For each exam part,
+    jobs that share a question go to the LLM as one batch request;
+    near-duplicates of an already graded answer can reuse its code grade
+    (SIMILARITY_REUSE_THRESHOLD). The batches of all parts are graded
+    concurrently, so a multi-part submission takes about as long as its
+    slowest part.
+    """
+    placeholders = ",".join("?" * len(submission_ids))
+    rows = persistence.reader().execute(
+        f"SELECT id, full_name, question, question AS code_question, "
+        f"{blob_store.text_sql('code_answer', 'code_blob')} AS code_answer, error_question, "
+        f"{blob_store.text_sql('error_answer', 'error_blob')} AS error_answer "
+        f"FROM submissions WHERE id IN ({placeholders}) ORDER BY id",
+        submission_ids,
+    ).fetchall()
+    if len(rows) < len(submission_ids):
+        logger.warning(f"{len(submission_ids) - len(rows)} submission(s) vanished before grading.")
+
+    persistence.write(lambda conn: conn.executemany(
+        "UPDATE submissions SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+        [(GRADING, r["id"]) for r in rows],
+    ))
+
+    reused = _check_similarity(rows)
+    tasks = []  # (part, rows, scorer)
+    if reused:
+        tasks.append(("code", [r for r in rows if r["id"] in reused], lambda g: [reused[r["id"]] for r in g]))
+    for part, max_marks in grading.PART_MAX.items():
+        by_question = {}
+        for r in rows:
+            if part == "code" and r["id"] in reused:
+                continue
+            # Parts other than code are graded only for exams that include them.
+            if part != "code" and r[f"{part}_question"] is None and r[f"{part}_answer"] is None:
+                continue
+            by_question.setdefault(r[f"{part}_question"], []).append(r)
+        for question, group in by_question.items():
+            tasks.append((part, group, lambda g, p=part, q=question, m=max_marks: grading.grade_code_batch(
+                [r[f"{p}_answer"] or "" for r in g], q, m, p)))
+
+    scores = {r["id"]: {} for r in rows}
+    failed = {}
+    for (part, group, _), outcome in zip(tasks, _fan_out(tasks)):
+        if isinstance(outcome, BaseException):
+            logger.error(f"❌ Grading the {part} part of submissions {[r['id'] for r in group]} failed: {outcome}")
+            failed.update({r["id"]: outcome for r in group})
+        else:
+            for r, score in zip(group, outcome):
+                scores[r["id"]][part] = score
+
+    graded = [r for r in rows if r["id"] not in failed]
+    futures = [
+        persistence.submit(lambda conn, r=r: _write_result(conn, r["id"], r["full_name"], scores[r["id"]]))
+        for r in graded
+    ]
+    for r, fut in zip(graded, futures):
+        parts = scores[r["id"]]
+        try:
+            previous, version = fut.result()
+        except Exception as e:
+            logger.error(f"❌ Saving the grade of submission {r['id']} failed: {e}")
+            failed[r["id"]] = e
+            continue
+        aggregates.record(previous, sum(parts.values()), version)
+        logger.info(f"Submission {r['id']} graded: {parts}")
+        events.publish(events.GRADED, {
+            "submission_id": r["id"], "full_name": r["full_name"],
+            "code_score": parts["code"], "error_score": parts.get("error"),
+            "total_score": sum(parts.values()), "version": version,
+        })
+    if len(failed) < len(rows):
+        events.publish(events.AGGREGATES_CHANGED, aggregates.snapshot(grading.TOTAL_MAX))
+    for submission_id, e in failed.items():
+        try:
+            _set_status(submission_id, FAILED, str(e))
+        except Exception as db_err:
+            logger.error(f"❌ Could not mark submission {submission_id} as failed: {db_err}")
+
+
+def _worker_loop():
+    while True:
+        # Take one job, plus whatever else is already waiting, so a backlog
+        # (e.g. a deadline burst) is graded in batches instead of one by one.
+        jobs = [_QUEUE.get()]
+        while len(jobs) < grading.GRADING_BATCH_SIZE and jobs[-1] is not _STOP:
+            try:
+                jobs.append(_QUEUE.get_nowait())
+            except queue.Empty:
+                break
+        submission_ids = [j for j in jobs if j is not _STOP]
+        try:
+            if submission_ids:
+                _grade_jobs(submission_ids)
+        except Exception as e:
+            logger.error(f"❌ Grading submissions {submission_ids} failed: {e}")
+        finally:
+            for _ in jobs:
+                _QUEUE.task_done()
+        if jobs[-1] is _STOP:
+            return
+
+
+# ===== Public API =====
+def start(workers: int = GRADING_WORKERS):
+    """
+    Starts the grading workers and re-queues any job that did not finish
+    before the last shutdown (`queued`, or interrupted while `grading`).
+    Needs the persistence writer to be running.
+    """
+    if _WORKERS:
+        return
+
+    persistence.write(lambda conn: conn.execute(
+        "UPDATE submissions SET status = ? WHERE status = ?", (QUEUED, GRADING)
+    ))
+    pending = [r["id"] for r in persistence.reader().execute(
+        "SELECT id FROM submissions WHERE status = ? ORDER BY id", (QUEUED,)
+    )]
+    for submission_id in pending:
+        _QUEUE.put(submission_id)
+    if pending:
+        logger.info(f"Re-queued {len(pending)} unfinished grading job(s).")
+
+    for i in range(max(1, workers)):
+        t = threading.Thread(target=_worker_loop, name=f"grader-{i}", daemon=True)
+        t.start()
+        _WORKERS.append(t)
+
+
+def stop(timeout: float = 5.0):
+    """Asks every worker to exit once it finishes its current job, then stops the part pool."""
+    global _PART_POOL
+    for _ in _WORKERS:
+        _QUEUE.put(_STOP)
+    for t in _WORKERS:
+        t.join(timeout)
+    _WORKERS.clear()
+    with _PART_POOL_LOCK:
+        if _PART_POOL is not None:
+            _PART_POOL.shutdown(wait=False, cancel_futures=True)
+            _PART_POOL = None
+
+
+def insert_submission(conn: sqlite3.Connection, full_name: str, code_answer: str, question: Optional[str],
+                      error_answer: Optional[str] = None, error_question: Optional[str] = None) -> int:
+    """
+    Writer-thread helper: stores a `queued` submission, with the debugging
+    part's answer for multi-part exams. Call `dispatch()` after commit.
+    """
+    code, code_blob = blob_store.store(conn, code_answer)
+    error, error_blob = blob_store.store(conn, error_answer)
+    return conn.execute(
+        "INSERT INTO submissions (full_name, question, code_answer, code_blob, error_question, error_answer, "
+        "error_blob, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (full_name, question, code, code_blob, error_question, error, error_blob, QUEUED),
+    ).lastrowid
+
+
+async def enqueue(full_name: str, code_answer: str, question: Optional[str] = None,
+                  error_answer: Optional[str] = None, error_question: Optional[str] = None,
+                  on_write: Optional[Callable[[sqlite3.Connection, int], None]] = None) -> int:
+    """
+    Persists a submission as a `queued` job and hands it to the workers once
+    the row is durably committed. `on_write(conn, submission_id)` runs in the
+    same transaction as the insert.
+    """
+    def _write(conn):
+        submission_id = insert_submission(conn, full_name, code_answer, question, error_answer, error_question)
+        if on_write is not None:
+            on_write(conn, submission_id)
+        return submission_id
+
+    submission_id = await persistence.write_async(_write)
+    dispatch(submission_id)
+    return submission_id
+
+
+def dispatch(submission_id: int):
+    """Hands an already committed submission to the grading workers."""
+    _QUEUE.put(submission_id)
+
+
+def get_status(submission_id: int) -> Optional[dict]:
+    row = persistence.reader().execute(
+        "SELECT id, full_name, status, code_score, error_score, total_score, error, created_at, updated_at "
+        "FROM submissions WHERE id = ?",
+        (submission_id,),
+    ).fetchone()
+    if row is None:
+        return None
+    return {
+        "submission_id": row["id"],
+        "full_name": row["full_name"],
+        "status": row["status"],
+        "code_score": row["code_score"],
+        "error_score": row["error_score"],
+        "total_score": row["total_score"],
+        "error": row["error"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    }
+
+
+def queue_depth() -> int:
+    return _QUEUE.qsize()
+
+
+metrics.Gauge("grading_queue_depth", "Submissions waiting for a grading worker.", fn=queue_depth)
@@ -0,0 +1,144 @@
+"""
+Rule-based fallback grading.
+
+Rules are declared as data (name, pattern, weight, language, cap) and all
+rules of a language are compiled into one scanner that extracts every
+feature in a single pass. Each rule sits in its own lookahead group
+`(?=(?P<rN>...))`, so rules whose matches overlap (a shebang line also
+mentions `sh`, `if` inside `[[ ]]`, ...) are all counted at the same
+position; a leading alternation of all rules makes the scan skip positions
+where nothing can match. Patterns are written to consume as little as
+possible (no `.*` spans), which keeps the scan linear even on long
+single-line answers.
+"""
+import re
+from typing import Dict, List, NamedTuple, Optional
+
+BASE_SCORE = 0.5
+
+
+class Rule(NamedTuple):
+    name: str
+    pattern: str
+    weight: float
+    language: str = "bash"  # "bash", "python", "debug" or "any"
+    cap: int = 1  # matches counted at most this many times
+    description: str = ""
+
+
+RULES = [
+    # --- bash ---
+    Rule("shebang", r"\A\s*#![ \t]*/(?:usr/)?bin/(?:env[ \t]+)?(?:ba)?sh\b", 0.5,
+         description="starts with a shell shebang"),
+    Rule("core_tools", r"\b(?:find|grep|awk|sed|ps|sort|tar|xargs|cut)\b", 0.5,
+         description="uses standard text / file tools"),
+    Rule("control_flow", r"\b(?:for|while|if|case)\b", 0.5,
+         description="uses loops or conditionals"),
+    Rule("strict_mode", r"\bset[ \t]+-[a-z]*[euo]", 0.25,
+         description="enables strict mode (set -e/-u/-o)"),
+    Rule("double_bracket", r"\[\[[ \t]", 0.25,
+         description="uses [[ ]] tests"),
+    Rule("quoted_vars", r"\"\$\{?\w", 0.25,
+         description="quotes variable expansions"),
+    Rule("arg_check", r"\$#|\$\{1:?[-?]|-z[ \t]+\"?\$1", 0.25,
+         description="checks its arguments"),
+    # --- python ---
+    Rule("py_shebang", r"\A\s*#![ \t]*/(?:usr/)?bin/(?:env[ \t]+)?python", 0.5, "python",
+         description="starts with a python shebang"),
+    Rule("py_function", r"^[ \t]*def[ \t]+\w+[ \t]*\(", 0.5, "python",
+         description="defines functions"),
+    Rule("py_control_flow", r"\b(?:for|while|if)\b", 0.5, "python",
+         description="uses loops or conditionals"),
+    Rule("py_errors", r"^[ \t]*(?:try|except\b)", 0.25, "python",
+         description="handles errors"),
+    Rule("py_stdlib", r"\b(?:os|subprocess|shutil|pathlib|sys|argparse)\b", 0.25, "python",
+         description="uses the standard library"),
+    Rule("py_main_guard", r"__name__[ \t]*==[ \t]*['\"]__main__['\"]", 0.25, "python",
+         description="has a main guard"),
+    # --- debug (answers to find-and-fix questions; never auto-detected) ---
+    Rule("names_error", r"(?i)\b(?:error|bug|issue|problem|mistake|wrong|missing|fails?)\b", 0.5, "debug",
+         description="names the error"),
+    Rule("explains_cause", r"(?i)\b(?:because|since|causes?|so that|otherwise|instead of|which means)\b", 0.25, "debug",
+         description="explains why it fails"),
+    Rule("shell_specifics", r"(?i)\b(?:quot(?:e|es|ed|ing)|unquoted|spaces?|syntax|exit (?:code|status)|permission|"
+         r"unbound|word splitting|glob)\b", 0.25, "debug",
+         description="points at a concrete shell pitfall"),
+    Rule("gives_fix", r"```|^[ \t]*(?:#!|if[ \t]|then\b|fi\b|for[ \t]|done\b|echo[ \t])", 0.5, "debug",
+         description="gives the corrected code"),
+]
+
+_PYTHON_HINT = re.compile(r"\A\s*#![^\n]*python|^(?:import|from)[ \t]+\w+|^def[ \t]+\w+[ \t]*\(", re.MULTILINE)
+_INLINE_FLAGS = re.compile(r"\A\(\?([aiLmsux]+)\)")
+_SCANNERS: Dict[str, tuple] = {}
+
+
+def _scoped(pattern: str) -> str:
+    """Turns leading inline flags, e.g. `(?i)...`, into a group that keeps them local."""
+    return _INLINE_FLAGS.sub(r"(?\1:", pattern, count=1) + ")" if _INLINE_FLAGS.match(pattern) else pattern
+
+
+def _scanner(language: str) -> tuple:
+    """(combined pattern, rules) for a language, built once."""
+    if language not in _SCANNERS:
+        rules = [r for r in RULES if r.language in (language, "any")]
+        patterns = [_scoped(r.pattern) for r in rules]
+        anchor = "|".join(f"(?:{p})" for p in patterns)
+        groups = "".join(f"(?=(?P<r{i}>{p}))?" for i, p in enumerate(patterns))
+        _SCANNERS[language] = (re.compile(f"(?=(?:{anchor})){groups}", re.MULTILINE), rules)
+    return _SCANNERS[language]
+
+
+def detect_language(code: str) -> str:
+    return "python" if _PYTHON_HINT.search(code) else "bash"
+
+
+def rule_names(language: str = "bash") -> List[str]:
+    """Column order of the feature vectors returned for `language`."""
+    return [r.name for r in _scanner(language)[1]]
+
+
+def features(code: str, language: Optional[str] = None) -> Dict[str, int]:
+    """Match counts per rule (uncapped), from one scan of `code`."""
+    language = language or detect_language(code)
+    scanner, rules = _scanner(language)
+    counts = [0] * len(rules)
+    for match in scanner.finditer(code):
+        for i, found in enumerate(match.groups()):
+            if found is not None:
+                counts[i] += 1
+    return {r.name: n for r, n in zip(rules, counts)}
+
+
+def score_batch(code_answers: List[str], max_marks: float, language: Optional[str] = None) -> List[dict]:
+    """
+    Scores every answer. Each result has `marks` (not yet rounded), the
+    detected `language`, the per-rule `vector` (in `rule_names(language)`
+    order) and a short `feedback` naming the rules that matched.
+    """
+    results = []
+    for code in code_answers:
+        if not code or not code.strip():
+            results.append({"marks": 0.0, "language": language or "bash", "vector": [], "feedback": "Empty answer."})
+            continue
+        lang = language or detect_language(code)
+        counts = features(code, lang)
+        rules = _scanner(lang)[1]
+        score = BASE_SCORE
+        matched = []
+        for rule in rules:
+            hits = min(counts[rule.name], rule.cap)
+            if hits:
+                score += rule.weight * hits
+                matched.append(rule.description or rule.name)
+        feedback = ("Heuristic grade: " + "; ".join(matched) + ".") if matched else "Heuristic grade: no recognised features."
+        results.append({
+            "marks": min(score, max_marks),
+            "language": lang,
+            "vector": [counts[r.name] for r in rules],
+            "feedback": feedback,
+        })
+    return results
+
+
+def score(code: str, max_marks: float, language: Optional[str] = None) -> dict:
+    return score_batch([code], max_marks, language)[0]
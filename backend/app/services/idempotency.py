@@ -0,0 +1,120 @@
+"""
+Idempotency keys for write endpoints.
+
+A client sends an `Idempotency-Key` header that stays the same for every
+retry of one logical request (one candidate's submission). The first request
+with a key runs and its response is stored in `idempotency_keys`, in the
+same writer transaction as the row the request creates when the handler
+passes the `record` hook into its write; later ones get the stored response
+back. Requests that arrive while the first is still running wait for it
+instead of running again. Reusing a key with a different body is an error.
+Keys expire after IDEMPOTENCY_TTL seconds.
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from app.services import persistence
+
+logger = logging.getLogger(__name__)
+
+# ===== Config =====
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+MAX_KEY_LENGTH = 200
+
+_INFLIGHT: Dict[str, Tuple[str, asyncio.Future]] = {}  # key -> (fingerprint, future response)
+_STATS = {"executed": 0, "replayed": 0, "joined": 0, "conflicts": 0}
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a request with a different body."""
+
+
+def fingerprint(payload: dict) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _lookup(key: str) -> Optional[tuple]:
+    row = persistence.reader().execute(
+        "SELECT fingerprint, response FROM idempotency_keys WHERE key = ? AND created_at >= ?",
+        (key, time.time() - IDEMPOTENCY_TTL),
+    ).fetchone()
+    return (row["fingerprint"], json.loads(row["response"])) if row else None
+
+
+def _store(conn, key: str, fp: str, response: dict):
+    now = time.time()
+    conn.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (now - IDEMPOTENCY_TTL,))
+    conn.execute(
+        "INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, response, created_at) VALUES (?, ?, ?, ?)",
+        (key, fp, json.dumps(response), now),
+    )
+
+
+def _check(key: str, stored_fp: str, fp: str):
+    if stored_fp != fp:
+        _STATS["conflicts"] += 1
+        raise IdempotencyConflict(f"Idempotency-Key {key!r} was already used with a different request body")
+
+
+# ===== Public API =====
+async def run(key: str, scope: str, payload: dict,
+              fn: Callable[[Callable[[sqlite3.Connection, dict], None]], Awaitable[dict]]) -> Tuple[dict, bool]:
+    """
+    Runs `fn(record)` at most once per (`scope`, `key`) and returns `(response, replayed)`.
+    `fn` should call `record(conn, response)` on the writer thread inside the
+    transaction that makes its change, so the change and the key commit
+    together; if it never does, the response is stored after `fn` returns.
+    Only successful responses are stored; if `fn` raises, the next retry runs again.
+    """
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+    full_key = f"{scope}:{key}"
+    fp = fingerprint(payload)
+
+    stored = _lookup(full_key)
+    if stored is not None:
+        _check(key, stored[0], fp)
+        _STATS["replayed"] += 1
+        return stored[1], True
+
+    inflight = _INFLIGHT.get(full_key)
+    if inflight is not None:
+        _check(key, inflight[0], fp)
+        _STATS["joined"] += 1
+        return await asyncio.shield(inflight[1]), True
+
+    fut = asyncio.get_running_loop().create_future()
+    _INFLIGHT[full_key] = (fp, fut)
+    recorded = []
+
+    def record(conn: sqlite3.Connection, result: dict):
+        _store(conn, full_key, fp, result)
+        recorded.append(True)
+
+    try:
+        response = await fn(record)
+        if not recorded:
+            await persistence.write_async(lambda conn: _store(conn, full_key, fp, response))
+    except asyncio.CancelledError:
+        fut.cancel()
+        raise
+    except Exception as e:
+        fut.set_exception(e)
+        fut.exception()  # retrieved, so an unawaited future does not log it again
+        raise
+    else:
+        fut.set_result(response)
+        _STATS["executed"] += 1
+        return response, False
+    finally:
+        _INFLIGHT.pop(full_key, None)
+
+
+def stats() -> dict:
+    return {**_STATS, "in_flight": len(_INFLIGHT)}
@@ -0,0 +1,98 @@
+import os
+import json
+import logging
+import urllib.request
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# ===== Config =====
+# "gemini" (default), "stub" (in-process, deterministic) or "http" (a stub or
+# proxy server speaking the tiny JSON protocol in `HTTPBackend`).
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").lower()
+LLM_HTTP_URL = os.getenv("LLM_HTTP_URL", "http://127.0.0.1:8765/generate")
+
+
+class LLMBackend:
+    """
+    Minimal interface the graders need from a language model: take a prompt,
+    return the raw response text. Parsing stays in the caller. `system` is
+    the static instruction prefix shared by many requests; backends that
+    support it keep it separate so the provider can reuse it.
+    """
+    name = "base"
+
+    def generate(self, prompt: str, timeout: Optional[float] = None, system: Optional[str] = None) -> str:
+        raise NotImplementedError
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, api_key: str, model_name: str):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self._genai = genai
+        self._model_name = model_name
+        self._model = genai.GenerativeModel(model_name)
+        # One model object per system instruction; there are only a few (single / batch rubric).
+        self._system_models = {}
+
+    def _model_for(self, system: Optional[str]):
+        if not system:
+            return self._model
+        model = self._system_models.get(system)
+        if model is None:
+            model = self._genai.GenerativeModel(self._model_name, system_instruction=system)
+            self._system_models[system] = model
+        return model
+
+    def generate(self, prompt: str, timeout: Optional[float] = None, system: Optional[str] = None) -> str:
+        request_options = {"timeout": timeout} if timeout else None
+        resp = self._model_for(system).generate_content(prompt, request_options=request_options)
+        return getattr(resp, "text", "") or ""
+
+
+class HTTPBackend(LLMBackend):
+    """Posts `{"prompt": ..., "system": ...}` to `url` and expects `{"text": ...}` back."""
+    name = "http"
+
+    def __init__(self, url: str = LLM_HTTP_URL, timeout: float = 30.0):
+        self.url = url
+        self.timeout = timeout
+
+    def generate(self, prompt: str, timeout: Optional[float] = None, system: Optional[str] = None) -> str:
+        payload = {"prompt": prompt}
+        if system:
+            payload["system"] = system
+        body = json.dumps(payload).encode("utf-8")
+        req = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=timeout or self.timeout) as resp:
+            return json.loads(resp.read().decode("utf-8")).get("text", "")
+
+
+def get_backend(api_key: Optional[str] = None, model_name: str = "gemini-1.5-flash") -> Optional[LLMBackend]:
+    """
+    Builds the backend selected by LLM_BACKEND, or returns None when it cannot
+    be used (callers then fall back to heuristic grading).
+    """
+    if LLM_BACKEND == "stub":
+        from app.services.stub_llm import StubBackend
+        logger.info("✅ Using the deterministic stub LLM backend.")
+        return StubBackend()
+    if LLM_BACKEND == "http":
+        logger.info(f"✅ Using HTTP LLM backend at {LLM_HTTP_URL}.")
+        return HTTPBackend()
+
+    if not api_key:
+        logger.warning("⚠️ GEMINI_API_KEY not set in .env file. Using heuristic grading fallback.")
+        return None
+    try:
+        backend = GeminiBackend(api_key, model_name)
+        logger.info("✅ Gemini model initialized successfully for grading.")
+        return backend
+    except ImportError:
+        logger.warning("⚠️ 'google-generativeai' not installed. Using heuristic grading fallback.")
+    except Exception as e:
+        logger.warning(f"⚠️ Failed to initialize Gemini: {e}")
+    return None
@@ -0,0 +1,272 @@
+import os
+import time
+import random
+import socket
+import logging
+import threading
+import urllib.error
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# ===== Config =====
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_RATE_PER_SEC = float(os.getenv("LLM_RATE_PER_SEC", "10"))
+LLM_BURST = int(os.getenv("LLM_BURST", "20"))
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "20"))
+LLM_TOTAL_DEADLINE = float(os.getenv("LLM_TOTAL_DEADLINE", "45"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+
+# Error class names from google.api_core / httpx / requests worth retrying.
+_RETRYABLE_NAMES = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded",
+    "InternalServerError", "Aborted", "GatewayTimeout", "BadGateway",
+    "ConnectError", "ReadTimeout", "ConnectTimeout",
+}
+
+
+class LLMGuardError(Exception):
+    """Raised instead of calling the backend (circuit open, no capacity before the deadline)."""
+
+
+class CircuitOpenError(LLMGuardError):
+    pass
+
+
+class LimiterTimeout(LLMGuardError):
+    pass
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, urllib.error.HTTPError):
+        return exc.code == 429 or exc.code >= 500
+    if isinstance(exc, (TimeoutError, socket.timeout, ConnectionError, urllib.error.URLError)):
+        return True
+    return getattr(exc, "retryable", False) or type(exc).__name__ in _RETRYABLE_NAMES
+
+
+# ===== Rate limiting =====
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def acquire(self, deadline: float) -> bool:
+        """Takes one token, waiting until `deadline` (monotonic) at most."""
+        if self.rate <= 0:
+            return True
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def available(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return round(self._tokens, 2)
+
+
+# ===== Circuit breaker =====
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and rejects calls for
+    `reset_after` seconds. Then a single probe call is let through
+    (half-open): success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, threshold: int, reset_after: float):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.trips = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_after:
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def cancel_probe(self):
+        """Gives the half-open probe back when the call never reached the backend."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info("✅ LLM circuit closed again after a successful probe.")
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.threshold:
+                if self.state != OPEN:
+                    self.trips += 1
+                    logger.warning(f"⚠️ LLM circuit opened after {self.consecutive_failures} failure(s).")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = round(max(0.0, self.reset_after - (time.monotonic() - self.opened_at)), 2)
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "trips": self.trips,
+                "probe_in": retry_in,
+            }
+
+
+# ===== Guard =====
+class LLMGuard:
+    """
+    Wraps every outbound LLM call with a concurrency cap, a rate limit,
+    per-attempt timeouts inside an overall deadline, jittered exponential
+    retries for transient errors, and a circuit breaker.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, rate: float = LLM_RATE_PER_SEC,
+                 burst: int = LLM_BURST, call_timeout: float = LLM_CALL_TIMEOUT,
+                 total_deadline: float = LLM_TOTAL_DEADLINE, max_retries: int = LLM_MAX_RETRIES,
+                 breaker_threshold: int = LLM_BREAKER_THRESHOLD, breaker_reset: float = LLM_BREAKER_RESET,
+                 base_backoff: float = 0.5):
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self.call_timeout = call_timeout
+        self.total_deadline = total_deadline
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {"calls": 0, "successes": 0, "failures": 0, "retries": 0,
+                       "rejected_open": 0, "rejected_capacity": 0}
+
+    def _bump(self, key: str, n: int = 1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": uniform in [0, base * 2^attempt].
+        return random.uniform(0, self.base_backoff * (2 ** attempt))
+
+    def call(self, fn: Callable[[float], str]) -> str:
+        """
+        Runs `fn(timeout)` under the guard and returns its result. Raises
+        LLMGuardError when the call was not attempted, or the backend's last
+        error when every attempt failed.
+        """
+        deadline = time.monotonic() + self.total_deadline
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._bump("rejected_open")
+                raise CircuitOpenError("LLM circuit is open")
+
+            remaining = deadline - time.monotonic()
+            if not self._slots.acquire(timeout=max(0.0, remaining)):
+                self._bump("rejected_capacity")
+                self.breaker.cancel_probe()
+                raise LimiterTimeout("no LLM concurrency slot before the deadline")
+            try:
+                if not self.bucket.acquire(deadline):
+                    self._bump("rejected_capacity")
+                    raise LimiterTimeout("LLM rate limit exceeded before the deadline")
+                with self._lock:
+                    self._in_flight += 1
+                    self._stats["calls"] += 1
+                try:
+                    timeout = max(0.1, min(self.call_timeout, deadline - time.monotonic()))
+                    result = fn(timeout)
+                finally:
+                    with self._lock:
+                        self._in_flight -= 1
+            except LLMGuardError:
+                self.breaker.cancel_probe()
+                raise
+            except Exception as e:
+                error = e
+            else:
+                error = None
+            finally:
+                # The slot is given back before any backoff sleep, so waiting
+                # retries never hold capacity other callers could use.
+                self._slots.release()
+
+            if error is not None:
+                self._bump("failures")
+                if not is_retryable(error):
+                    # The backend answered (bad request, validation, ...): not an outage.
+                    self.breaker.cancel_probe()
+                    raise error
+                self.breaker.record_failure()
+                pause = self._backoff(attempt)
+                if attempt >= self.max_retries or time.monotonic() + pause >= deadline:
+                    raise error
+                attempt += 1
+                self._bump("retries")
+                logger.warning(f"⚠️ LLM call failed ({error}); retry {attempt}/{self.max_retries} in {pause:.2f}s.")
+                time.sleep(pause)
+                continue
+
+            self._bump("successes")
+            self.breaker.record_success()
+            return result
+
+    def is_available(self) -> bool:
+        """Cheap check for callers that want to skip building a prompt at all."""
+        snap = self.breaker.snapshot()
+        return snap["state"] != OPEN or snap["probe_in"] == 0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            in_flight = self._in_flight
+        return {
+            "breaker": self.breaker.snapshot(),
+            "in_flight": in_flight,
+            "max_concurrency": self.max_concurrency,
+            "tokens_available": self.bucket.available(),
+            "rate_per_sec": self.bucket.rate,
+            **stats,
+        }
@@ -0,0 +1,427 @@
+"""
+SQLite access for the results database.
+
+All writes go through one dedicated writer thread. It collects whatever was
+queued within a few milliseconds and commits it as a single transaction
+(group commit), so concurrent submissions never fight over the write lock
+and share one fsync. Every queued write gets a Future that resolves once its
+transaction is committed; readers use their own WAL connections and are never
+blocked by the writer.
+"""
+import os
+import time
+import queue
+import sqlite3
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+from app.services import blob_store, metrics
+
+logger = logging.getLogger(__name__)
+
+# ===== Config =====
+# How long the writer waits for more work before committing a group.
+GROUP_COMMIT_MS = float(os.getenv("SQLITE_GROUP_COMMIT_MS", "5"))
+GROUP_COMMIT_MAX = int(os.getenv("SQLITE_GROUP_COMMIT_MAX", "256"))
+# FULL: a write is acknowledged only after its group has been fsynced.
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "FULL")
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS results (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        full_name TEXT NOT NULL UNIQUE,
+        code_score REAL DEFAULT 0,
+        version INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS submissions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        full_name TEXT NOT NULL,
+        question TEXT,
+        code_answer TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        code_score REAL,
+        error TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS exam_sessions (
+        id TEXT PRIMARY KEY,
+        full_name TEXT NOT NULL,
+        question TEXT,
+        status TEXT NOT NULL DEFAULT 'active',
+        started_at REAL NOT NULL,
+        deadline REAL NOT NULL,
+        last_heartbeat REAL,
+        draft TEXT,
+        submission_id INTEGER,
+        closed_at REAL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS similarity_signatures (
+        submission_id INTEGER PRIMARY KEY,
+        question_key TEXT NOT NULL,
+        signature BLOB NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS surrogate_examples (
+        key TEXT PRIMARY KEY,
+        index_key TEXT NOT NULL,
+        code_answer TEXT NOT NULL,
+        marks REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS question_pools (
+        name TEXT PRIMARY KEY,
+        source_text TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS question_pool (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        pool TEXT NOT NULL,
+        question TEXT NOT NULL,
+        content_hash TEXT NOT NULL,
+        source TEXT,
+        created_at REAL,
+        assigned_at REAL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS question_assignments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        pool TEXT NOT NULL,
+        question_id INTEGER,
+        question TEXT NOT NULL,
+        full_name TEXT,
+        session_id TEXT,
+        assigned_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS topic_terms (
+        doc_id TEXT NOT NULL,
+        term TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (doc_id, term)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS grading_cache (
+        key TEXT PRIMARY KEY,
+        marks REAL NOT NULL,
+        feedback TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS grading_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        mode TEXT NOT NULL,
+        rubric_version TEXT NOT NULL,
+        code_max REAL NOT NULL,
+        status TEXT NOT NULL DEFAULT 'running',
+        last_submission_id INTEGER NOT NULL DEFAULT 0,
+        graded INTEGER NOT NULL DEFAULT 0,
+        started_at REAL NOT NULL,
+        updated_at REAL,
+        finished_at REAL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS run_scores (
+        run_id INTEGER NOT NULL,
+        submission_id INTEGER NOT NULL,
+        code_score REAL NOT NULL,
+        PRIMARY KEY (run_id, submission_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        key TEXT PRIMARY KEY,
+        fingerprint TEXT NOT NULL,
+        response TEXT NOT NULL,
+        created_at REAL NOT NULL
+    )
+    """,
+    # Content-addressed text (see blob_store); rows point at it by hash.
+    """
+    CREATE TABLE IF NOT EXISTS blobs (
+        hash TEXT PRIMARY KEY,
+        codec TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        created_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS blob_dicts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        data BLOB NOT NULL,
+        samples INTEGER,
+        created_at REAL NOT NULL
+    )
+    """,
+]
+
+# Columns added after a table was first shipped; created on older databases.
+COLUMNS = [
+    ("results", "version", "INTEGER NOT NULL DEFAULT 0"),
+    ("results", "updated_at", "TEXT"),
+    ("submissions", "code_blob", "TEXT"),
+    ("exam_sessions", "draft_blob", "TEXT"),
+    ("surrogate_examples", "code_blob", "TEXT"),
+    ("grading_cache", "feedback_blob", "TEXT"),
+    # Multi-part exams: the debugging part and the total, as in models.Student.
+    ("submissions", "error_question", "TEXT"),
+    ("submissions", "error_answer", "TEXT"),
+    ("submissions", "error_blob", "TEXT"),
+    ("submissions", "error_score", "REAL"),
+    ("submissions", "total_score", "REAL"),
+    ("results", "error_score", "REAL"),
+    ("results", "total_score", "REAL"),
+    ("exam_sessions", "error_question", "TEXT"),
+    ("exam_sessions", "error_draft", "TEXT"),
+    ("exam_sessions", "error_draft_blob", "TEXT"),
+    ("question_assignments", "error_question", "TEXT"),
+    ("run_scores", "error_score", "REAL"),
+    ("run_scores", "total_score", "REAL"),
+]
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_submissions_status ON submissions (status)",
+    "CREATE INDEX IF NOT EXISTS idx_results_version ON results (version)",
+    "CREATE INDEX IF NOT EXISTS idx_results_score ON results (code_score DESC, id)",
+    "CREATE INDEX IF NOT EXISTS idx_sessions_active ON exam_sessions (status, deadline)",
+    # Only questions still waiting in a pool must be unique; once assigned the
+    # same text may be stocked again.
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_question_pool_unassigned ON question_pool (pool, content_hash) "
+    "WHERE assigned_at IS NULL",
+    "CREATE INDEX IF NOT EXISTS idx_question_assignments_name ON question_assignments (full_name)",
+    "CREATE INDEX IF NOT EXISTS idx_idempotency_created ON idempotency_keys (created_at)",
+    # Export joins submissions to their session and pool.
+    "CREATE INDEX IF NOT EXISTS idx_sessions_submission ON exam_sessions (submission_id)",
+    "CREATE INDEX IF NOT EXISTS idx_question_assignments_session ON question_assignments (session_id)",
+    # Blob garbage collection looks up every reference by hash.
+    "CREATE INDEX IF NOT EXISTS idx_submissions_code_blob ON submissions (code_blob)",
+    "CREATE INDEX IF NOT EXISTS idx_submissions_error_blob ON submissions (error_blob)",
+    "CREATE INDEX IF NOT EXISTS idx_sessions_draft_blob ON exam_sessions (draft_blob)",
+    "CREATE INDEX IF NOT EXISTS idx_sessions_error_draft_blob ON exam_sessions (error_draft_blob)",
+    "CREATE INDEX IF NOT EXISTS idx_surrogate_code_blob ON surrogate_examples (code_blob)",
+    "CREATE INDEX IF NOT EXISTS idx_grading_cache_feedback_blob ON grading_cache (feedback_blob)",
+]
+
+# Every write to `results` takes the next row version, so readers can ask for
+# "everything changed since version N". Safe because there is a single writer.
+UPSERT_RESULT_SQL = (
+    "INSERT INTO results (full_name, code_score, error_score, total_score, version, updated_at) "
+    "VALUES (?, ?, ?, ?, (SELECT COALESCE(MAX(version), 0) + 1 FROM results), CURRENT_TIMESTAMP) "
+    "ON CONFLICT(full_name) DO UPDATE SET code_score = excluded.code_score, "
+    "error_score = excluded.error_score, total_score = excluded.total_score, "
+    "version = excluded.version, updated_at = excluded.updated_at"
+)
+
+_DB_PATH: Optional[str] = None
+_QUEUE: "queue.Queue" = queue.Queue()
+_WRITER: Optional[threading.Thread] = None
+_STOP = object()
+_LOCAL = threading.local()
+_STATS = {"writes": 0, "commits": 0, "failed_writes": 0, "largest_group": 0}
+
+
+# ===== Connections =====
+def connect(db_path: Optional[str] = None, readonly: bool = False) -> sqlite3.Connection:
+    """Opens a connection with the tuned pragmas (WAL, busy timeout, in-memory temp)."""
+    db_path = db_path or _DB_PATH
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    blob_store.register(conn, db_path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+    conn.execute("PRAGMA busy_timeout = 5000")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -16000")
+    if readonly:
+        conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+def reader() -> sqlite3.Connection:
+    """A read-only connection owned by the calling thread, reused across calls."""
+    conn = getattr(_LOCAL, "conn", None)
+    if conn is None or getattr(_LOCAL, "path", None) != _DB_PATH:
+        conn = connect(readonly=True)
+        _LOCAL.conn, _LOCAL.path = conn, _DB_PATH
+    return conn
+
+
+def setup_database(db_path: str):
+    """Creates every table the backend uses and switches the file to WAL."""
+    conn = connect(db_path)
+    try:
+        with conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            for table, column, ddl in COLUMNS:
+                existing = {r["name"] for r in conn.execute(f"PRAGMA table_info({table})")}
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+            for statement in INDEXES:
+                conn.execute(statement)
+    finally:
+        conn.close()
+
+
+# ===== Writer =====
+def _run_group(conn: sqlite3.Connection, group: list):
+    """Applies a group of writes in one transaction; each write gets its own savepoint."""
+    outcomes = []
+    started = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for i, (fn, fut, _) in enumerate(group):
+            conn.execute(f"SAVEPOINT w{i}")
+            try:
+                outcomes.append((fut, fn(conn), None))
+                conn.execute(f"RELEASE w{i}")
+            except Exception as e:
+                conn.execute(f"ROLLBACK TO w{i}")
+                conn.execute(f"RELEASE w{i}")
+                outcomes.append((fut, None, e))
+        conn.execute("COMMIT")
+    except Exception as e:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        for _, fut, _ in group:
+            fut.set_exception(e)
+        _STATS["failed_writes"] += len(group)
+        logger.error(f"❌ Group commit of {len(group)} write(s) failed: {e}")
+        return
+
+    committed = time.perf_counter()
+    metrics.DB_COMMIT_LATENCY.observe(committed - started)
+    metrics.DB_GROUP_SIZE.observe(len(group))
+    for _, _, queued_at in group:
+        metrics.DB_WRITE_LATENCY.observe(committed - queued_at)
+    _STATS["commits"] += 1
+    _STATS["largest_group"] = max(_STATS["largest_group"], len(group))
+    for fut, result, error in outcomes:
+        if error is None:
+            _STATS["writes"] += 1
+            fut.set_result(result)
+        else:
+            _STATS["failed_writes"] += 1
+            fut.set_exception(error)
+
+
+def _writer_loop(db_path: str):
+    conn = connect(db_path)
+    conn.isolation_level = None  # transactions are managed explicitly in _run_group
+    try:
+        while True:
+            item = _QUEUE.get()
+            if item is _STOP:
+                return
+            group = [item]
+            window_end = time.monotonic() + GROUP_COMMIT_MS / 1000
+            stopping = False
+            while len(group) < GROUP_COMMIT_MAX:
+                remaining = window_end - time.monotonic()
+                try:
+                    item = _QUEUE.get(timeout=remaining) if remaining > 0 else _QUEUE.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                group.append(item)
+            _run_group(conn, group)
+            if stopping:
+                return
+    finally:
+        conn.close()
+
+
+def start(db_path: str):
+    global _DB_PATH, _WRITER
+    if _WRITER is not None:
+        return
+    _DB_PATH = db_path
+    _WRITER = threading.Thread(target=_writer_loop, args=(db_path,), name="sqlite-writer", daemon=True)
+    _WRITER.start()
+
+
+def stop(timeout: float = 5.0):
+    """Flushes queued writes and stops the writer thread."""
+    global _WRITER
+    if _WRITER is None:
+        return
+    _QUEUE.put(_STOP)
+    _WRITER.join(timeout)
+    _WRITER = None
+
+
+# ===== Public API =====
+def submit(fn: Callable[[sqlite3.Connection], Any]) -> Future:
+    """
+    Queues `fn(conn)` for the writer thread. The returned Future resolves to
+    `fn`'s return value once the transaction containing it has committed.
+    """
+    if _WRITER is None:
+        raise RuntimeError("persistence writer is not running; call persistence.start() first")
+    fut: Future = Future()
+    _QUEUE.put((fn, fut, time.perf_counter()))
+    return fut
+
+
+def write(fn: Callable[[sqlite3.Connection], Any], timeout: Optional[float] = 30) -> Any:
+    """Blocking variant of `submit` for worker threads."""
+    return submit(fn).result(timeout)
+
+
+async def write_async(fn: Callable[[sqlite3.Connection], Any]) -> Any:
+    """Awaitable variant of `submit` for async routes."""
+    return await asyncio.wrap_future(submit(fn))
+
+
+def execute(sql: str, params: tuple = ()) -> Future:
+    """Queues a single statement; resolves to the cursor's `lastrowid`."""
+    return submit(lambda conn: conn.execute(sql, params).lastrowid)
+
+
+def upsert_result(conn: sqlite3.Connection, full_name: str, code_score: float,
+                  error_score: Optional[float] = None, total_score: Optional[float] = None) -> tuple:
+    """
+    Writes a candidate's scores (the total defaults to the code score).
+    Returns `(previous_score, version)`, where `previous_score` is the previous
+    total score or None for a new candidate, for the running aggregates.
+    """
+    row = conn.execute("SELECT COALESCE(total_score, code_score) FROM results WHERE full_name = ?",
+                       (full_name,)).fetchone()
+    total = code_score if total_score is None else total_score
+    conn.execute(UPSERT_RESULT_SQL, (full_name, code_score, error_score, total))
+    version = conn.execute("SELECT version FROM results WHERE full_name = ?", (full_name,)).fetchone()[0]
+    return (row[0] if row else None), version
+
+
+def pending_writes() -> int:
+    return _QUEUE.qsize()
+
+
+def stats() -> dict:
+    return {**_STATS, "pending": pending_writes()}
+
+
+metrics.Gauge("db_pending_writes", "Writes queued for the writer thread.", fn=pending_writes)
@@ -0,0 +1,108 @@
+"""
+Prompt assembly with token budgets.
+
+A prompt is split into a static `system` part (role, rubric, output format),
+identical across requests so the backend can keep it as a system instruction
+and reuse cached context, and a `user` part holding the per-request fields.
+Each field has a token budget; an oversized field keeps its head and tail and
+gets a marker saying how much was cut, so one huge paste cannot blow up cost
+or latency. Sizes of every prompt built are recorded in `stats()`.
+"""
+import os
+import math
+import logging
+import threading
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# ===== Config =====
+# Rough size of a token for code and English mixed; errs on the side of more tokens.
+PROMPT_CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "3.5"))
+PROMPT_CODE_TOKENS = int(os.getenv("PROMPT_CODE_TOKENS", "2000"))
+PROMPT_QUESTION_TOKENS = int(os.getenv("PROMPT_QUESTION_TOKENS", "400"))
+# Total for all answers in one batch request; each answer gets an equal share.
+PROMPT_BATCH_TOKENS = int(os.getenv("PROMPT_BATCH_TOKENS", "12000"))
+# Share of a truncated field kept from its start; the rest comes from its end.
+_HEAD_SHARE = 0.7
+
+_LOCK = threading.Lock()
+_STATS = {"prompts": 0, "system_tokens": 0, "user_tokens": 0, "max_user_tokens": 0, "user_chars": 0}
+_TRUNCATED: Counter = Counter()
+
+
+class Prompt(NamedTuple):
+    system: str
+    user: str
+    tokens: int
+    truncated: List[str]
+
+    @property
+    def text(self) -> str:
+        """System and user parts as one string, for backends without system instructions."""
+        return f"{self.system}\n\n{self.user}"
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text or "") / PROMPT_CHARS_PER_TOKEN)
+
+
+def fit(text: str, budget: Optional[int], field: str = "field") -> tuple:
+    """
+    Returns `(text, truncated)`. Text over `budget` tokens keeps its first and
+    last lines (cut on line breaks where possible) around a truncation marker.
+    """
+    text = text or ""
+    if budget is None or estimate_tokens(text) <= budget:
+        return text, False
+    keep = int(budget * PROMPT_CHARS_PER_TOKEN)
+    head_len = int(keep * _HEAD_SHARE)
+    tail_len = keep - head_len
+    head = text[:head_len]
+    tail = text[len(text) - tail_len:] if tail_len else ""
+    # Prefer whole lines on both sides of the cut.
+    if "\n" in head[head_len // 2:]:
+        head = head[:head.rfind("\n")]
+    if "\n" in tail[:tail_len // 2]:
+        tail = tail[tail.find("\n") + 1:]
+    omitted = len(text) - len(head) - len(tail)
+    marker = f"\n[... {omitted} characters omitted: {field} exceeded its {budget}-token budget ...]\n"
+    return head + marker + tail, True
+
+
+def build(system: str, template: str, fields: Dict[str, str], budgets: Optional[Dict[str, int]] = None) -> Prompt:
+    """Fits every field to its budget (fields without one are used as is) and fills `template`."""
+    budgets = budgets or {}
+    fitted, truncated = {}, []
+    for name, value in fields.items():
+        fitted[name], cut = fit(value, budgets.get(name), name)
+        if cut:
+            truncated.append(name)
+    user = template.format(**fitted)
+    system_tokens, user_tokens = estimate_tokens(system), estimate_tokens(user)
+    with _LOCK:
+        _STATS["prompts"] += 1
+        _STATS["system_tokens"] += system_tokens
+        _STATS["user_tokens"] += user_tokens
+        _STATS["user_chars"] += len(user)
+        _STATS["max_user_tokens"] = max(_STATS["max_user_tokens"], user_tokens)
+        _TRUNCATED.update(truncated)
+    if truncated:
+        logger.info(f"Prompt fields truncated to their token budgets: {', '.join(truncated)}.")
+    logger.debug(f"Built prompt: ~{system_tokens} system + ~{user_tokens} user tokens ({len(user)} chars).")
+    return Prompt(system, user, system_tokens + user_tokens, truncated)
+
+
+def record_truncation(field: str):
+    """Counts a field that the caller cut with `fit()` before calling `build()`."""
+    with _LOCK:
+        _TRUNCATED[field] += 1
+
+
+def stats() -> dict:
+    with _LOCK:
+        s = dict(_STATS)
+        s["truncated_fields"] = dict(_TRUNCATED)
+    s["avg_user_tokens"] = round(s["user_tokens"] / s["prompts"], 1) if s["prompts"] else 0.0
+    return s
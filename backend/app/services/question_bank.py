@@ -11,6 +11,160 @@ coding_questions = [
     "Write a shell script that creates a daily backup of a specified directory and renames the backup file with the current date (e.g., backup-YYYY-MM-DD.tar.gz).",
 ]
 
+# Deterministic test cases for the questions that can be checked by running the
+# script in the sandbox. Each fixture seeds a scratch directory (which is also
+# $HOME and the working directory), runs the script with `args`, and scores the
+# checks that pass. Questions without fixtures (they depend on /var/log, login
+# history or the network) are graded by the LLM only.
+#
+# Every question has several fixtures with different arguments and trees, so a
+# script that hard-codes the expected output passes at most one of them.
+#
+# Check types (each has an optional "weight", default 1, and an optional
+# "gate": a failed gate check zeroes the whole fixture):
+#   exit_code        {"equals": n} or {"not_equals": n}
+#   number           stdout+stderr contains one of `any_of` as a standalone integer
+#   contains         stdout+stderr contains every string in `all_of`
+#   regex            stdout+stderr matches `pattern`
+#   not_regex        stdout+stderr does not match `pattern`
+#   numbers_at_most  stdout+stderr holds at most `count` standalone integers
+#                    (defeats printing every plausible answer)
+#   file_glob        a path left in the scratch directory matches `pattern`
+#   archive_members  a tar archive matching `pattern` contains files named
+#                    every entry of `all_of` (a bare `touch` does not pass)
+# ("{today}" in a pattern is replaced with the current YYYY-MM-DD date.)
+# exit_code, not_regex and numbers_at_most only count when another check in the
+# same fixture passes, so `exit 0` or an empty script earns nothing.
+_ERROR_TEXT = r"(?i)not (running|found)|no such|error"
+
+question_fixtures = {
+    coding_questions[1]: [
+        {
+            "name": "missing process reports an error",
+            "args": ["no_such_process_xyz"],
+            "checks": [
+                {"type": "regex", "pattern": _ERROR_TEXT},
+                {"type": "exit_code", "not_equals": 0, "weight": 0.5},
+            ],
+        },
+        {
+            # The script's own shell is always running inside the sandbox.
+            "name": "running process prints its stats",
+            "args": ["bash"],
+            "checks": [
+                {"type": "regex", "pattern": r"\b[1-9]\d*\b", "weight": 2},
+                {"type": "regex", "pattern": r"\d+\.\d", "weight": 2},
+                {"type": "not_regex", "pattern": _ERROR_TEXT, "gate": True},
+                {"type": "exit_code", "equals": 0, "weight": 0.5},
+            ],
+        },
+    ],
+    coding_questions[4]: [
+        {
+            "name": "nested tree",
+            "args": ["tree"],
+            "files": {
+                "tree/a.txt": "a\n", "tree/b.txt": "b\n", "tree/sub/c.txt": "c\n",
+                "tree/sub/deeper/d.txt": "d\n", "tree/sub/deeper/e.txt": "e\n",
+                "tree/x/f.txt": "f\n", "tree/x/g.txt": "g\n",
+            },
+            "checks": [
+                {"type": "number", "any_of": [7]},
+                # Counting the directory itself (`find -type d`) is accepted too.
+                {"type": "number", "any_of": [3, 4]},
+                {"type": "numbers_at_most", "count": 4, "gate": True},
+                {"type": "exit_code", "equals": 0, "weight": 0.5},
+            ],
+        },
+        {
+            "name": "files only",
+            "args": ["flat"],
+            "files": {f"flat/f{i}.log": "x\n" for i in range(12)},
+            "checks": [
+                {"type": "number", "any_of": [12]},
+                {"type": "number", "any_of": [0, 1]},
+                {"type": "numbers_at_most", "count": 4, "gate": True},
+            ],
+        },
+        {
+            "name": "empty directories",
+            "args": ["empty"],
+            "dirs": [f"empty/d{i}" for i in range(9)],
+            "checks": [
+                {"type": "number", "any_of": [9, 10]},
+                {"type": "number", "any_of": [0]},
+                {"type": "numbers_at_most", "count": 4, "gate": True},
+            ],
+        },
+        {
+            "name": "different path",
+            "args": ["work/project"],
+            "files": {"work/project/src/main.c": "int main;\n", "work/project/README": "r\n",
+                      "work/elsewhere.txt": "not counted\n"},
+            "dirs": ["work/project/build", "work/project/src/include"],
+            "checks": [
+                {"type": "number", "any_of": [2]},
+                {"type": "number", "any_of": [3, 4]},
+                {"type": "numbers_at_most", "count": 4, "gate": True},
+            ],
+        },
+    ],
+    coding_questions[5]: [
+        {
+            "name": "links in home",
+            "files": {"notes.txt": "n\n", "docs/guide.md": "g\n", "unrelated.txt": "u\n"},
+            "symlinks": {"notes-link": "notes.txt", "docs/guide-link": "guide.md"},
+            "checks": [
+                {"type": "contains", "all_of": ["notes-link", "notes.txt"]},
+                {"type": "contains", "all_of": ["guide-link", "guide.md"]},
+                # Regular files are not links and must not be listed.
+                {"type": "not_regex", "pattern": r"unrelated", "gate": True},
+            ],
+        },
+        {
+            "name": "other links",
+            "files": {"etc/app/settings.conf": "s\n", "plain-file.txt": "p\n"},
+            "dirs": ["logs"],
+            "symlinks": {"cfg-current": "etc/app/settings.conf", "logs/latest": "../plain-file.txt"},
+            "checks": [
+                {"type": "contains", "all_of": ["cfg-current", "settings.conf"]},
+                {"type": "contains", "all_of": ["latest", "plain-file.txt"]},
+                {"type": "not_regex", "pattern": r"notes-link|guide-link", "gate": True},
+            ],
+        },
+    ],
+    coding_questions[6]: [
+        {
+            "name": "dated archive",
+            "args": ["project"],
+            "files": {"project/main.sh": "echo hi\n", "project/data/rows.csv": "1,2\n"},
+            "checks": [
+                {"type": "archive_members", "pattern": "*backup-{today}.tar.gz",
+                 "all_of": ["main.sh", "rows.csv"], "weight": 2},
+                {"type": "exit_code", "equals": 0, "weight": 0.5},
+            ],
+        },
+        {
+            "name": "other directory",
+            "args": ["site"],
+            "files": {"site/index.html": "<p>hi</p>\n", "site/css/style.css": "p{}\n"},
+            "checks": [
+                {"type": "archive_members", "pattern": "*backup-{today}.tar.gz",
+                 "all_of": ["index.html", "style.css"], "weight": 2},
+                {"type": "exit_code", "equals": 0, "weight": 0.5},
+            ],
+        },
+    ],
+}
+
+
+def get_fixtures(question):
+    """Returns the execution fixtures for a question, or an empty list."""
+    if not question:
+        return []
+    return question_fixtures.get(question.strip(), [])
+
+
 def get_random_questions():
     """
     Selects a single random coding question.
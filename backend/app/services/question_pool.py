@@ -0,0 +1,277 @@
+"""
+Pre-generated exam questions.
+
+Each pool (one per topic or assignment) keeps a stock of unassigned questions
+in the `question_pool` table and mirrors it in an in-memory deque, so handing
+a question to a candidate is a pop plus one queued write. A background worker
+tops a pool up whenever it drops below QUESTION_POOL_LOW_WATER, first from the
+LLM (CODING_PROMPT over the pool's assignment text) and otherwise from the
+static bank and the templates in `generation`, steering each new question to
+a topic drawn by TF-IDF weight from the topic index. Unassigned questions are
+deduplicated on their normalised text.
+
+With EXAM_PARTS including "error", each assignment also carries a debugging
+question (find and fix the error), built from the templates in `generation`
+on the same pool text.
+"""
+import os
+import time
+import random
+import hashlib
+import logging
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+from app.services import generation, grading, llm_guard, persistence, question_bank, topic_index
+from app.utils.coding_prompts import CODING_PROMPT
+
+logger = logging.getLogger(__name__)
+
+# ===== Config =====
+DEFAULT_POOL = "default"
+QUESTION_POOL_LOW_WATER = int(os.getenv("QUESTION_POOL_LOW_WATER", "10"))
+QUESTION_POOL_TARGET = int(os.getenv("QUESTION_POOL_TARGET", "30"))
+QUESTION_POOL_REFILL_INTERVAL = float(os.getenv("QUESTION_POOL_REFILL_INTERVAL", "60"))
+# Ask the LLM for new questions (otherwise only the bank and templates are used).
+QUESTION_POOL_USE_LLM = os.getenv("QUESTION_POOL_USE_LLM", "1") == "1"
+# Generation has its own LLM guard (slots, rate and breaker), kept small so a
+# refill at exam start never competes with grading for the LLM.
+QUESTION_POOL_LLM_CONCURRENCY = int(os.getenv("QUESTION_POOL_LLM_CONCURRENCY", "1"))
+QUESTION_POOL_LLM_RATE = float(os.getenv("QUESTION_POOL_LLM_RATE", "1"))
+# A burst of assignments below the low-water mark wakes the worker once per this many seconds.
+QUESTION_POOL_REFILL_DEBOUNCE = float(os.getenv("QUESTION_POOL_REFILL_DEBOUNCE", "2"))
+# Parts of every exam handed out, from grading.PART_MAX ("code" is always included).
+EXAM_PARTS = ["code"] + [p for p in os.getenv("EXAM_PARTS", "code,error").replace(" ", "").split(",")
+                         if p in grading.PART_MAX and p != "code"]
+_MIN_LENGTH, _MAX_LENGTH = 20, 1000
+_REFILL_CHUNK = 5
+
+_LOCK = threading.Lock()
+_AVAILABLE: Dict[str, deque] = {}  # pool -> deque of (id, question)
+_SOURCES: Dict[str, str] = {DEFAULT_POOL: ""}  # pool -> assignment text
+_WAKE = threading.Event()
+_STOP = threading.Event()
+_WORKER: Optional[threading.Thread] = None
+_STATS = {"assigned": 0, "empty_pool_fallbacks": 0, "generated": 0, "duplicates": 0, "rejected": 0}
+_GUARD = llm_guard.LLMGuard(max_concurrency=max(1, QUESTION_POOL_LLM_CONCURRENCY), rate=QUESTION_POOL_LLM_RATE,
+                            burst=max(1, QUESTION_POOL_LLM_CONCURRENCY))
+
+
+# ===== Helper Functions =====
+def content_hash(question: str) -> str:
+    normalized = " ".join(question.lower().split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def _clean(text: Optional[str]) -> Optional[str]:
+    """Strips an LLM answer down to the problem statement; None if it does not look like one."""
+    if not text:
+        return None
+    s = text.strip().strip("`").strip()
+    if s.lower().startswith(("question:", "problem:")):
+        s = s.split(":", 1)[1].strip()
+    if not (_MIN_LENGTH <= len(s) <= _MAX_LENGTH) or s.startswith(("{", "[")):
+        return None
+    return s
+
+
+def _topic_doc(pool: str) -> Optional[str]:
+    # The default pool draws on every indexed document; other pools on their own text.
+    return None if pool == DEFAULT_POOL else f"pool:{pool}"
+
+
+def _pick_topic(pool: str) -> str:
+    return topic_index.pick_topic(_topic_doc(pool)) or topic_index.DEFAULT_TOPIC
+
+
+def _candidates(pool: str, source_text: str, count: int):
+    """Yields up to `count` (question, source) pairs for a pool, LLM first."""
+    produced = 0
+    if QUESTION_POOL_USE_LLM and grading.llm_available(_GUARD):
+        failures = 0
+        while produced < count and failures < 3:
+            prompt = CODING_PROMPT.format(assignment_text=source_text or topic_index.DEFAULT_TOPIC)
+            prompt += f"\nFocus the question on: {_pick_topic(pool)}.\n"
+            question = _clean(grading.complete(prompt, _GUARD))
+            if question is None:
+                failures += 1
+                with _LOCK:  # the event loop updates _STATS too (assign)
+                    _STATS["rejected"] += 1
+                continue
+            produced += 1
+            yield question, "llm"
+    if pool == DEFAULT_POOL:
+        for question in random.sample(question_bank.coding_questions, len(question_bank.coding_questions)):
+            if produced >= count:
+                return
+            produced += 1
+            yield question, "bank"
+    for _ in range(max(0, count - produced)):
+        yield generation.generate_coding_question(source_text, topic=_pick_topic(pool)), "template"
+
+
+def _insert(conn, pool: str, items: list) -> list:
+    # Runs on the writer thread. The partial unique index on unassigned rows
+    # makes a duplicate insert a no-op.
+    added = []
+    for question, source in items:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO question_pool (pool, question, content_hash, source, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (pool, question, content_hash(question), source, time.time()),
+        )
+        if cur.rowcount:
+            added.append((cur.lastrowid, question))
+    return added
+
+
+def _assign(conn, pool: str, question_id: Optional[int], question: str, error_question: Optional[str],
+            full_name: Optional[str], session_id: Optional[str]) -> int:
+    now = time.time()
+    if question_id is not None:
+        conn.execute("UPDATE question_pool SET assigned_at = ? WHERE id = ?", (now, question_id))
+    return conn.execute(
+        "INSERT INTO question_assignments (pool, question_id, question, error_question, full_name, session_id, "
+        "assigned_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (pool, question_id, question, error_question, full_name, session_id, now),
+    ).lastrowid
+
+
+def refill(pool: str = DEFAULT_POOL) -> int:
+    """Tops `pool` up to QUESTION_POOL_TARGET. Returns how many questions were added."""
+    with _LOCK:
+        have = len(_AVAILABLE.get(pool, ()))
+        source_text = _SOURCES.get(pool, "")
+    need = QUESTION_POOL_TARGET - have
+    if need <= 0:
+        return 0
+    # Generation is rate limited, so questions are stocked a few at a time as
+    # they arrive. Duplicates of what is already stocked are dropped; the next
+    # wake-up tops up the rest.
+    added, chunk = 0, []
+    for item in _candidates(pool, source_text, need):
+        if _STOP.is_set():
+            break
+        chunk.append(item)
+        if len(chunk) >= _REFILL_CHUNK:
+            added += _stock(pool, chunk)
+            chunk = []
+    if chunk:
+        added += _stock(pool, chunk)
+    if added:
+        logger.info(f"Question pool '{pool}' refilled with {added} question(s).")
+    return added
+
+
+def _stock(pool: str, items: list) -> int:
+    added = persistence.write(lambda conn: _insert(conn, pool, items))
+    with _LOCK:
+        _AVAILABLE.setdefault(pool, deque()).extend(added)
+        _STATS["generated"] += len(added)
+        _STATS["duplicates"] += len(items) - len(added)
+    return len(added)
+
+
+def _refill_loop():
+    while not _STOP.is_set():
+        _WAKE.wait(QUESTION_POOL_REFILL_INTERVAL)
+        # Let a burst of wake-ups (every assign below the low-water mark) settle into one refill.
+        if _STOP.wait(QUESTION_POOL_REFILL_DEBOUNCE):
+            return
+        _WAKE.clear()
+        with _LOCK:
+            low = [p for p in _SOURCES if len(_AVAILABLE.get(p, ())) < QUESTION_POOL_LOW_WATER]
+        for pool in low:
+            try:
+                refill(pool)
+            except Exception as e:
+                logger.error(f"❌ Refilling question pool '{pool}' failed: {e}")
+
+
+# ===== Public API =====
+def load(conn):
+    """Loads the registered pools and their unassigned questions (at startup)."""
+    with _LOCK:
+        _AVAILABLE.clear()
+        for row in conn.execute("SELECT name, source_text FROM question_pools"):
+            _SOURCES[row["name"]] = row["source_text"] or ""
+        for row in conn.execute("SELECT id, pool, question FROM question_pool WHERE assigned_at IS NULL ORDER BY id"):
+            _AVAILABLE.setdefault(row["pool"], deque()).append((row["id"], row["question"]))
+            _SOURCES.setdefault(row["pool"], "")
+
+
+async def register_pool(name: str, source_text: str):
+    """Creates or updates a pool for an assignment and schedules its first fill."""
+    await persistence.write_async(lambda conn: conn.execute(
+        "INSERT INTO question_pools (name, source_text) VALUES (?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET source_text = excluded.source_text",
+        (name, source_text),
+    ))
+    topic_index.add_document(_topic_doc(name) or name, source_text)
+    with _LOCK:
+        _SOURCES[name] = source_text
+    _WAKE.set()
+
+
+async def assign(full_name: Optional[str] = None, pool: str = DEFAULT_POOL, session_id: Optional[str] = None) -> dict:
+    """
+    Pops the next question from `pool` and records who got it. Falls back to
+    a random bank question if the pool is empty, so starting an exam never
+    waits for generation. `parts` lists every part of the exam with its marks.
+    """
+    with _LOCK:
+        available = _AVAILABLE.get(pool)
+        item = available.popleft() if available else None
+        remaining = len(available) if available else 0
+        _STATS["assigned"] += 1
+        if item is None:
+            _STATS["empty_pool_fallbacks"] += 1
+    if remaining < QUESTION_POOL_LOW_WATER:
+        _WAKE.set()
+    if item is None:
+        logger.warning(f"⚠️ Question pool '{pool}' is empty; using a bank question.")
+        question_id, question = None, question_bank.get_random_questions()["code_question"]
+    else:
+        question_id, question = item
+    error_question = None
+    if "error" in EXAM_PARTS:
+        with _LOCK:
+            source_text = _SOURCES.get(pool, "")
+        error_question = generation.generate_error_question(source_text, topic=_pick_topic(pool))
+    assignment_id = await persistence.write_async(
+        lambda conn: _assign(conn, pool, question_id, question, error_question, full_name, session_id)
+    )
+    questions = {"code": question, "error": error_question}
+    return {
+        "assignment_id": assignment_id, "question_id": question_id, "pool": pool,
+        "code_question": question, "error_question": error_question,
+        "parts": [{"part": p, "question": questions[p], "max_marks": grading.PART_MAX[p]} for p in EXAM_PARTS],
+    }
+
+
+def start_worker():
+    global _WORKER
+    if _WORKER is not None:
+        return
+    _STOP.clear()
+    _WAKE.set()  # fill right away
+    _WORKER = threading.Thread(target=_refill_loop, name="question-pool", daemon=True)
+    _WORKER.start()
+
+
+def stop_worker(timeout: float = 5.0):
+    global _WORKER
+    if _WORKER is None:
+        return
+    _STOP.set()
+    _WAKE.set()
+    _WORKER.join(timeout)
+    _WORKER = None
+
+
+def stats() -> dict:
+    with _LOCK:
+        counts = dict(_STATS)
+        available = {pool: len(_AVAILABLE.get(pool, ())) for pool in _SOURCES}
+    return {**counts, "available": available, "llm": _GUARD.snapshot()}
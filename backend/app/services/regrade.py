@@ -0,0 +1,300 @@
+"""
+Offline re-grading of stored submissions.
+
+A re-grade is a *grading run*: a row in `grading_runs` (mode, rubric version,
+CODE_MAX) plus one `run_scores` row per submission with its code, debugging
+and total scores (the debugging part is re-graded where the submission has
+one), so the live scores in `submissions` are never overwritten and runs can
+be compared with each other.
+Submissions are streamed in id order, one page at a time (keyset pagination),
+and each page is committed together with the run's checkpoint, so an
+interrupted run resumes after the last committed page.
+
+Modes:
+- heuristic: rule-engine marks, computed on a process pool.
+- execution: fixture runs on the sandbox pool; the rule engine where a question
+  has no fixtures.
+- llm: the full grading pipeline (cache, execution, surrogate, LLM), with up to
+  --concurrency question batches in flight at once.
+
+    python -m app.services.regrade run --mode llm --name rubric-v2
+    python -m app.services.regrade resume 3
+    python -m app.services.regrade compare 3          # against the live scores
+    python -m app.services.regrade compare 3 --against 2
+    python -m app.services.regrade compare 3 --score error
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+from app.services import blob_store, grading, grading_cache, persistence, surrogate
+
+logger = logging.getLogger(__name__)
+
+# ===== Config =====
+MODES = ("heuristic", "execution", "llm")
+REGRADE_PAGE_SIZE = int(os.getenv("REGRADE_PAGE_SIZE", "256"))
+REGRADE_WORKERS = int(os.getenv("REGRADE_WORKERS", str(os.cpu_count() or 2)))
+REGRADE_CONCURRENCY = int(os.getenv("REGRADE_CONCURRENCY", "4"))
+# Answers per task sent to a heuristic worker process.
+_CHUNK = 64
+# Scores `compare` can diff; rows written before multi-part exams have no total.
+_SCORES = {"code": "code_score", "error": "error_score", "total": "COALESCE(total_score, code_score)"}
+
+
+# ===== Reading =====
+def iter_pages(after_id: int = 0, page_size: int = REGRADE_PAGE_SIZE) -> Iterator[list]:
+    """Yields pages of submission rows (every exam part) with id > `after_id`, in id order."""
+    conn = persistence.reader()
+    while True:
+        rows = conn.execute(
+            f"SELECT id, question AS code_question, {blob_store.text_sql('code_answer', 'code_blob')} AS code_answer, "
+            f"error_question, {blob_store.text_sql('error_answer', 'error_blob')} AS error_answer "
+            "FROM submissions WHERE id > ? ORDER BY id LIMIT ?",
+            (after_id, page_size),
+        ).fetchall()
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1]["id"]
+
+
+def _part_rows(rows: list, part: str) -> list:
+    # Every submission has a code part; the others only where their question was set.
+    return rows if part == "code" else [r for r in rows if r[f"{part}_question"] is not None]
+
+
+def _by_question(rows: list, part: str = "code") -> "OrderedDict[Optional[str], list]":
+    groups: "OrderedDict[Optional[str], list]" = OrderedDict()
+    for row in _part_rows(rows, part):
+        groups.setdefault(row[f"{part}_question"], []).append(row)
+    return groups
+
+
+# ===== Grading one page =====
+# Each returns {submission id: {part: marks}} for the parts it graded.
+def _grade_heuristic(rows: list, pool: Executor, parts=tuple(grading.PART_MAX)) -> Dict[int, Dict[str, float]]:
+    scores: Dict[int, Dict[str, float]] = {r["id"]: {} for r in rows}
+    for part in parts:
+        group = _part_rows(rows, part)
+        answers = [r[f"{part}_answer"] or "" for r in group]
+        chunks = [answers[i:i + _CHUNK] for i in range(0, len(answers), _CHUNK)]
+        marks = [m for chunk in pool.map(grading.grade_heuristic_batch, chunks, [part] * len(chunks)) for m in chunk]
+        for r, m in zip(group, marks):
+            scores[r["id"]][part] = m
+    return scores
+
+
+def _grade_execution(rows: list, pool: Executor) -> Dict[int, Dict[str, float]]:
+    # Only code runs in the sandbox; debugging answers get the rule engine.
+    scores = _grade_heuristic(rows, pool, [p for p in grading.PART_MAX if p != "code"])
+    fallback = []
+    for question, group in _by_question(rows).items():
+        marks = grading.grade_execution_batch([r["code_answer"] for r in group], question)
+        for row, m in zip(group, marks):
+            if m is None:
+                fallback.append(row)
+            else:
+                scores[row["id"]]["code"] = m
+    if fallback:
+        for sid, parts in _grade_heuristic(fallback, pool, ["code"]).items():
+            scores[sid].update(parts)
+    return scores
+
+
+async def _grade_llm(rows: list, pool: Executor, concurrency: int) -> Dict[int, Dict[str, float]]:
+    # Each (part, question) group is one grade_code_batch call on a thread;
+    # the semaphore caps how many are talking to the LLM at once.
+    loop = asyncio.get_running_loop()
+    sem = asyncio.Semaphore(concurrency)
+    scores: Dict[int, Dict[str, float]] = {r["id"]: {} for r in rows}
+
+    async def grade_group(part, question, group):
+        async with sem:
+            marks = await loop.run_in_executor(
+                pool, grading.grade_code_batch, [r[f"{part}_answer"] or "" for r in group], question,
+                grading.PART_MAX[part], part,
+            )
+        for r, m in zip(group, marks):
+            scores[r["id"]][part] = m
+
+    await asyncio.gather(*(grade_group(p, q, g) for p in grading.PART_MAX for q, g in _by_question(rows, p).items()))
+    return scores
+
+
+def _checkpoint(conn, run_id: int, scores: Dict[int, Dict[str, float]], last_id: int):
+    conn.executemany(
+        "INSERT OR REPLACE INTO run_scores (run_id, submission_id, code_score, error_score, total_score) "
+        "VALUES (?, ?, ?, ?, ?)",
+        [(run_id, sid, parts["code"], parts.get("error"), sum(parts.values())) for sid, parts in scores.items()],
+    )
+    conn.execute(
+        "UPDATE grading_runs SET last_submission_id = ?, graded = (SELECT COUNT(*) FROM run_scores WHERE run_id = ?), "
+        "updated_at = ? WHERE id = ?",
+        (last_id, run_id, time.time(), run_id),
+    )
+
+
+# ===== Public API =====
+def create_run(mode: str, name: Optional[str] = None) -> int:
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {', '.join(MODES)}")
+    return persistence.write(lambda conn: conn.execute(
+        "INSERT INTO grading_runs (name, mode, rubric_version, code_max, started_at) VALUES (?, ?, ?, ?, ?)",
+        (name, mode, grading.RUBRIC_VERSION, grading.CODE_MAX, time.time()),
+    ).lastrowid)
+
+
+def get_run(run_id: int) -> Optional[dict]:
+    row = persistence.reader().execute("SELECT * FROM grading_runs WHERE id = ?", (run_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def execute_run(run_id: int, page_size: int = REGRADE_PAGE_SIZE, workers: int = REGRADE_WORKERS,
+                concurrency: int = REGRADE_CONCURRENCY, limit: Optional[int] = None) -> dict:
+    """
+    Grades every submission after the run's checkpoint and marks the run done.
+    Safe to call again on an interrupted run: it picks up where it stopped.
+    """
+    run = get_run(run_id)
+    if run is None:
+        raise ValueError(f"grading run {run_id} does not exist")
+    if run["status"] == "done":
+        return run
+    if run["rubric_version"] != grading.RUBRIC_VERSION or run["code_max"] != grading.CODE_MAX:
+        logger.warning(f"⚠️ Run {run_id} started under rubric {run['rubric_version']} / CODE_MAX {run['code_max']}; "
+                       f"continuing under {grading.RUBRIC_VERSION} / {grading.CODE_MAX}.")
+    mode = run["mode"]
+    graded, started = 0, time.perf_counter()
+    if mode == "llm":
+        pool: Executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="regrade")
+    else:
+        # forkserver: this process already runs the writer thread, which fork would copy mid-lock.
+        methods = multiprocessing.get_all_start_methods()
+        ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+    try:
+        for rows in iter_pages(run["last_submission_id"], page_size):
+            if limit is not None and graded >= limit:
+                break
+            if mode == "heuristic":
+                scores = _grade_heuristic(rows, pool)
+            elif mode == "execution":
+                scores = _grade_execution(rows, pool)
+            else:
+                scores = asyncio.run(_grade_llm(rows, pool, concurrency))
+            last_id = rows[-1]["id"]
+            persistence.write(lambda conn: _checkpoint(conn, run_id, scores, last_id))
+            graded += len(rows)
+            logger.info(f"Run {run_id}: graded up to submission {last_id} ({graded} this session, "
+                        f"{graded / (time.perf_counter() - started):.1f}/s).")
+        else:
+            persistence.write(lambda conn: conn.execute(
+                "UPDATE grading_runs SET status = 'done', finished_at = ? WHERE id = ?", (time.time(), run_id)
+            ))
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    return get_run(run_id)
+
+
+def compare(run_id: int, against: Optional[int] = None, top: int = 10, score: str = "total") -> dict:
+    """
+    Score differences between a run and another run (or, by default, the live
+    scores in `submissions`), aggregated in SQL so the cohort is never loaded.
+    `score` is "code", "error" or "total" (rows without that score are skipped).
+    """
+    if score not in _SCORES:
+        raise ValueError(f"score must be one of {', '.join(_SCORES)}")
+    column = _SCORES[score]
+    if against is None:
+        base_sql = f"SELECT id AS submission_id, {column} AS score FROM submissions"
+        params: tuple = ()
+    else:
+        base_sql = f"SELECT submission_id, {column} AS score FROM run_scores WHERE run_id = ?"
+        params = (against,)
+    joined = (
+        f"SELECT n.submission_id, b.score AS old, n.score AS new, n.score - b.score AS delta "
+        f"FROM (SELECT submission_id, {column} AS score FROM run_scores WHERE run_id = ?) n "
+        f"JOIN ({base_sql}) b ON b.submission_id = n.submission_id "
+        f"WHERE n.score IS NOT NULL AND b.score IS NOT NULL"
+    )
+    conn = persistence.reader()
+    summary = conn.execute(
+        f"SELECT COUNT(*) AS compared, AVG(old) AS old_mean, AVG(new) AS new_mean, AVG(delta) AS mean_delta, "
+        f"AVG(ABS(delta)) AS mean_abs_delta, SUM(delta != 0) AS changed, SUM(delta > 0) AS raised, "
+        f"SUM(delta < 0) AS lowered FROM ({joined})",
+        (run_id, *params),
+    ).fetchone()
+    histogram = conn.execute(
+        f"SELECT delta, COUNT(*) AS n FROM ({joined}) GROUP BY delta ORDER BY delta", (run_id, *params)
+    ).fetchall()
+    largest = conn.execute(
+        f"SELECT * FROM ({joined}) ORDER BY ABS(delta) DESC, submission_id LIMIT ?", (run_id, *params, top)
+    ).fetchall()
+    result = {k: (round(v, 4) if isinstance(v, float) else v) for k, v in dict(summary).items()}
+    return {
+        "run": get_run(run_id),
+        "against": get_run(against) if against is not None else "live",
+        "score": score,
+        **result,
+        "delta_histogram": {str(r["delta"]): r["n"] for r in histogram},
+        "largest_changes": [dict(r) for r in largest],
+    }
+
+
+# ===== CLI =====
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Re-grade stored submissions as a versioned grading run.")
+    parser.add_argument("--db", default=os.getenv("EXAM_DB_PATH", "exam_results.db"))
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_p = sub.add_parser("run", help="start a new grading run")
+    run_p.add_argument("--mode", choices=MODES, default="heuristic")
+    run_p.add_argument("--name")
+    resume_p = sub.add_parser("resume", help="continue an interrupted run")
+    resume_p.add_argument("run_id", type=int)
+    for p in (run_p, resume_p):
+        p.add_argument("--page-size", type=int, default=REGRADE_PAGE_SIZE)
+        p.add_argument("--workers", type=int, default=REGRADE_WORKERS, help="processes for heuristic grading")
+        p.add_argument("--concurrency", type=int, default=REGRADE_CONCURRENCY, help="LLM batches in flight")
+        p.add_argument("--limit", type=int, help="stop (resumably) after about this many submissions")
+
+    cmp_p = sub.add_parser("compare", help="compare a run with the live scores or another run")
+    cmp_p.add_argument("run_id", type=int)
+    cmp_p.add_argument("--against", type=int)
+    cmp_p.add_argument("--top", type=int, default=10)
+    cmp_p.add_argument("--score", choices=list(_SCORES), default="total", help="which score to compare")
+    sub.add_parser("list", help="list grading runs")
+    args = parser.parse_args(argv)
+
+    persistence.setup_database(args.db)
+    persistence.start(args.db)
+    try:
+        if args.command == "list":
+            out = [dict(r) for r in persistence.reader().execute("SELECT * FROM grading_runs ORDER BY id")]
+        elif args.command == "compare":
+            out = compare(args.run_id, args.against, args.top, args.score)
+        else:
+            run_id = create_run(args.mode, args.name) if args.command == "run" else args.run_id
+            # Same cache and surrogate tables as the server, so LLM grades are shared both ways.
+            grading_cache.configure(True)
+            surrogate.configure(True)
+            try:
+                out = execute_run(run_id, args.page_size, args.workers, args.concurrency, args.limit)
+            except KeyboardInterrupt:
+                logger.warning(f"⚠️ Interrupted; continue with: python -m app.services.regrade resume {run_id}")
+                out = get_run(run_id)
+        print(json.dumps(out, indent=2, default=str))
+    finally:
+        persistence.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import base64
+from typing import Optional
+
+from app.services import persistence
+
+MAX_PAGE_SIZE = 500
+
+_COLUMNS = "id, full_name, code_score, error_score, total_score, version, updated_at"
+
+
+def _row(r) -> dict:
+    return {
+        "id": r["id"],
+        "full_name": r["full_name"],
+        "code_score": r["code_score"],
+        "error_score": r["error_score"],
+        "total_score": r["total_score"],
+        "version": r["version"],
+        "updated_at": r["updated_at"],
+    }
+
+
+def _encode_cursor(score: float, row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{score}:{row_id}".encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        score, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return float(score), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("invalid cursor")
+
+
+def list_results(limit: int = 100, cursor: Optional[str] = None) -> dict:
+    """
+    One page of results, best score first. Uses keyset pagination on
+    (code_score DESC, id), so every page is an index range scan no matter how
+    deep the client has paged.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    conn = persistence.reader()
+    if cursor:
+        score, row_id = _decode_cursor(cursor)
+        rows = conn.execute(
+            f"SELECT {_COLUMNS} FROM results "
+            "WHERE code_score < ? OR (code_score = ? AND id > ?) "
+            "ORDER BY code_score DESC, id LIMIT ?",
+            (score, score, row_id, limit + 1),
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            f"SELECT {_COLUMNS} FROM results ORDER BY code_score DESC, id LIMIT ?",
+            (limit + 1,),
+        ).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = _encode_cursor(rows[-1]["code_score"], rows[-1]["id"]) if has_more else None
+    return {"items": [_row(r) for r in rows], "next_cursor": next_cursor}
+
+
+def changes_since(version: int = 0, limit: int = 100) -> dict:
+    """
+    Rows written after `version`, oldest change first. Clients keep the
+    returned `version` and pass it back to get only what changed since.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    rows = persistence.reader().execute(
+        f"SELECT {_COLUMNS} FROM results WHERE version > ? ORDER BY version LIMIT ?",
+        (version, limit + 1),
+    ).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "items": [_row(r) for r in rows],
+        "version": rows[-1]["version"] if rows else version,
+        "has_more": has_more,
+    }
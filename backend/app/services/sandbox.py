@@ -1,22 +1,373 @@
-import subprocess
-import tempfile
+"""
+Sandboxed execution of submitted bash / Python code.
+
+Runs happen on a pool of pre-started worker processes (one per core by
+default), so a burst of submissions executes in parallel without paying for
+a fresh pool each time. Each run gets a private scratch directory as its
+working directory and HOME, rlimits on CPU, memory, file size and open
+files, capped output, and a wall-clock kill of its whole process group.
+Admission is bounded: when too many runs are already waiting, `run()` raises
+SandboxBusy instead of queueing forever.
+
+Candidate code runs under bubblewrap (bwrap) as an unprivileged uid, in fresh
+user, mount, PID, IPC and network namespaces. The only writable path is the
+scratch directory; system directories are read-only and nothing else of the
+host (the backend, its .env, the results database) is visible. The process
+cap (RLIMIT_NPROC) is set inside the sandbox, after bwrap has created the
+user namespace, so it counts only the candidate's processes and never the
+service uid's threads and pool workers (per-namespace counts need Linux
+5.14+). SANDBOX_ISOLATION=none has no process cap. Without bwrap
+the sandbox refuses to run code unless SANDBOX_ISOLATION=none is set
+explicitly (local development only).
+"""
 import os
+import sys
+import time
+import signal
+import shutil
+import tarfile
+import logging
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
 
+try:
+    import resource
+except ImportError:  # Windows: no rlimits, runs are still timed and isolated to a temp dir
+    resource = None
 
-def run_user_code(code: str) -> str:
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".py", mode="w") as tmp:
-        tmp.write(code)
-        tmp_path = tmp.name
+logger = logging.getLogger(__name__)
+
+# ===== Config =====
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", str(os.cpu_count() or 2)))
+# Runs allowed to wait for a worker, per worker, before new runs are refused.
+SANDBOX_QUEUE_PER_WORKER = int(os.getenv("SANDBOX_QUEUE_PER_WORKER", "4"))
+SANDBOX_ADMIT_TIMEOUT = float(os.getenv("SANDBOX_ADMIT_TIMEOUT", "30"))
+# "bwrap" (namespaces + read-only root) or "none" (rlimits only; never on a shared host).
+SANDBOX_ISOLATION = os.getenv("SANDBOX_ISOLATION", "bwrap").lower()
+SANDBOX_BWRAP = os.getenv("SANDBOX_BWRAP", "") or shutil.which("bwrap")
+SANDBOX_UID = int(os.getenv("SANDBOX_UID", "65534"))  # nobody
+
+DEFAULT_LIMITS = {
+    "wall_seconds": 3.0,
+    "cpu_seconds": 2,
+    "memory_bytes": 256 * 1024 * 1024,
+    "max_processes": 64,
+    "file_size_bytes": 8 * 1024 * 1024,
+    "open_files": 64,
+    "output_bytes": 64 * 1024,
+}
+
+_INTERPRETERS = {
+    "bash": (shutil.which("bash") or shutil.which("sh") or "sh", "main.sh"),
+    "python": (os.path.realpath(sys.executable) if sys.executable else "python", "main.py"),
+}
+
+# Host paths visible (read-only) inside the bwrap sandbox.
+_SYSTEM_PATHS = ["/usr", "/bin", "/sbin", "/lib", "/lib32", "/lib64", "/etc/alternatives",
+                 "/etc/ld.so.cache", "/etc/localtime", "/etc/passwd", "/etc/group"]
+# Where the run's directory is mounted inside the sandbox.
+_JAIL = "/sandbox"
+# Runs inside the sandbox: caps processes for the sandbox uid, then becomes the interpreter.
+_LIMIT_SHELL = shutil.which("bash")
+_LIMIT_SCRIPT = 'ulimit -u "$1" || exit 126; shift; exec "$@"'
+
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+_ADMISSION: Optional[threading.BoundedSemaphore] = None
+
+
+class SandboxBusy(Exception):
+    """Raised when the admission queue is full."""
+
+
+class SandboxUnavailable(Exception):
+    """Raised when code cannot be run isolated (bwrap missing and isolation not disabled)."""
+
+
+def available() -> bool:
+    """True if runs can be isolated as configured."""
+    return SANDBOX_ISOLATION == "none" or bool(SANDBOX_BWRAP and os.name == "posix")
+
+
+def _check_available():
+    if not available():
+        raise SandboxUnavailable("bubblewrap (bwrap) is not installed; install it or set SANDBOX_ISOLATION=none")
+
+
+# ===== Worker side (runs inside the pool processes) =====
+def _warm():
+    return os.getpid()
+
+
+def _apply_limits(limits: dict):
+    def preexec():
+        os.setsid()
+        if resource is None:
+            return
+        cpu = int(limits["cpu_seconds"])
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 1))
+        resource.setrlimit(resource.RLIMIT_AS, (limits["memory_bytes"],) * 2)
+        resource.setrlimit(resource.RLIMIT_FSIZE, (limits["file_size_bytes"],) * 2)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limits["open_files"],) * 2)
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+        # No RLIMIT_NPROC here: it would count every thread of the service's
+        # own uid. _bwrap_command applies it inside the user namespace instead.
+    return preexec
+
+
+def _read_capped(path: str, cap: int) -> tuple:
+    with open(path, "rb") as f:
+        data = f.read(cap + 1)
+    return data[:cap].decode("utf-8", errors="replace"), len(data) > cap
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
 
+
+def _safe_join(base: str, rel: str) -> str:
+    path = os.path.realpath(os.path.join(base, rel))
+    if not path.startswith(os.path.realpath(base) + os.sep):
+        raise ValueError(f"fixture path escapes the scratch directory: {rel}")
+    return path
+
+
+def _snapshot(scratch: str, limit: int = 200) -> List[str]:
+    """Relative paths left in the scratch directory, for graders that check side effects."""
+    paths = []
+    for root, dirs, files in os.walk(scratch):
+        for name in dirs + files:
+            paths.append(os.path.relpath(os.path.join(root, name), scratch))
+            if len(paths) >= limit:
+                return sorted(paths)
+    return sorted(paths)
+
+
+def _archives(scratch: str, files: List[str], limit: int = 200) -> Dict[str, List[str]]:
+    """Member names of the tar archives a run left behind, for graders that check backups."""
+    listed = {}
+    for rel in files:
+        if not rel.endswith((".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")):
+            continue
+        path = os.path.join(scratch, rel)
+        if os.path.islink(path) or not os.path.isfile(path):
+            continue
+        try:
+            with tarfile.open(path) as archive:
+                listed[rel] = archive.getnames()[:limit]
+        except (tarfile.TarError, OSError, EOFError):
+            listed[rel] = []  # not a readable archive (e.g. an empty file named like one)
+    return listed
+
+
+def _seed(scratch: str, files: Dict[str, str], dirs: List[str], symlinks: Dict[str, str]):
+    """Creates the fixture tree: files with content, empty directories and symlinks."""
+    for rel in dirs:
+        os.makedirs(_safe_join(scratch, rel), exist_ok=True)
+    for rel, content in files.items():
+        path = _safe_join(scratch, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+    for rel, target in symlinks.items():
+        path = _safe_join(scratch, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.symlink(target, path)
+
+
+def _bwrap_command(base: str, script_name: str, language: str, interpreter: str, args: List[str],
+                   max_processes: int) -> List[str]:
+    """
+    bwrap invocation that runs the script in `base` with only `base/work`
+    writable and at most `max_processes` processes for the sandbox uid.
+    """
+    cmd = [SANDBOX_BWRAP, "--unshare-all", "--die-with-parent", "--new-session",
+           "--uid", str(SANDBOX_UID), "--gid", str(SANDBOX_UID)]
+    system = list(_SYSTEM_PATHS)
+    if language == "python":
+        system.append(sys.base_prefix)  # the interpreter and stdlib, not the backend's packages
+    for path in system:
+        if os.path.islink(path):
+            cmd += ["--symlink", os.readlink(path), path]
+        else:
+            cmd += ["--ro-bind-try", path, path]
+    cmd += ["--proc", "/proc", "--dev", "/dev", "--tmpfs", "/tmp",
+            "--ro-bind", os.path.join(base, script_name), f"{_JAIL}/{script_name}",
+            "--bind", os.path.join(base, "work"), f"{_JAIL}/work", "--chdir", f"{_JAIL}/work"]
+    run = [interpreter, f"{_JAIL}/{script_name}", *args]
+    if _LIMIT_SHELL:
+        run = [_LIMIT_SHELL, "-c", _LIMIT_SCRIPT, "sandbox", str(max_processes), *run]
+    return cmd + run
+
+
+def _execute(code: str, language: str, args: List[str], files: Dict[str, str], limits: dict,
+             dirs: List[str] = (), symlinks: Dict[str, str] = None) -> dict:
+    interpreter, script_name = _INTERPRETERS[language]
+    base = tempfile.mkdtemp(prefix="sandbox-")
+    scratch = os.path.join(base, "work")
+    os.mkdir(scratch)
     try:
-        result = subprocess.run(
-            ["python", tmp_path],
-            capture_output=True,
-            text=True,
-            timeout=3
-        )
-        return result.stdout + result.stderr
-    except subprocess.TimeoutExpired:
-        return "Execution timed out"
+        _seed(scratch, files or {}, list(dirs or []), symlinks or {})
+        script = os.path.join(base, script_name)
+        with open(script, "w", newline="\n") as f:
+            f.write(code)
+
+        isolated = SANDBOX_ISOLATION != "none"
+        workdir = f"{_JAIL}/work" if isolated else scratch
+        env = {
+            "PATH": "/usr/local/bin:/usr/bin:/bin" if isolated else os.environ.get("PATH", "/usr/bin:/bin"),
+            "HOME": workdir,
+            "TMPDIR": workdir,
+            "LANG": "C.UTF-8",
+            "USER": "candidate",
+        }
+        if isolated:
+            command = _bwrap_command(base, script_name, language, interpreter, args, limits["max_processes"])
+        else:
+            command = [interpreter, script, *args]
+        out_path, err_path = os.path.join(base, "stdout"), os.path.join(base, "stderr")
+        started = time.monotonic()
+        timed_out = False
+        rusage = None
+        with open(out_path, "wb") as out, open(err_path, "wb") as err:
+            popen_kwargs = {}
+            if os.name == "posix":
+                popen_kwargs["preexec_fn"] = _apply_limits(limits)
+            proc = subprocess.Popen(
+                command, cwd=scratch, env=env,
+                stdin=subprocess.DEVNULL, stdout=out, stderr=err, **popen_kwargs,
+            )
+            deadline = started + limits["wall_seconds"]
+            if hasattr(os, "wait4"):
+                while True:
+                    pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+                    if pid:
+                        proc.returncode = os.waitstatus_to_exitcode(status)
+                        break
+                    if time.monotonic() > deadline:
+                        timed_out = True
+                        try:
+                            os.killpg(proc.pid, signal.SIGKILL)
+                        except ProcessLookupError:
+                            pass
+                        _, status, rusage = os.wait4(proc.pid, 0)
+                        proc.returncode = os.waitstatus_to_exitcode(status)
+                        break
+                    time.sleep(0.005)
+            else:
+                try:
+                    proc.wait(timeout=limits["wall_seconds"])
+                except subprocess.TimeoutExpired:
+                    timed_out = True
+                    proc.kill()
+                    proc.wait()
+        wall = time.monotonic() - started
+
+        stdout, out_cut = _read_capped(out_path, limits["output_bytes"])
+        stderr, err_cut = _read_capped(err_path, limits["output_bytes"])
+        files = _snapshot(scratch)
+        return {
+            "exit_code": proc.returncode,
+            "stdout": stdout,
+            "stderr": stderr,
+            "timed_out": timed_out,
+            "output_truncated": out_cut or err_cut,
+            "usage": {
+                "wall_seconds": round(wall, 4),
+                "cpu_user_seconds": round(rusage.ru_utime, 4) if rusage else None,
+                "cpu_system_seconds": round(rusage.ru_stime, 4) if rusage else None,
+                "max_rss_kb": rusage.ru_maxrss if rusage else None,
+                "disk_bytes": _dir_size(scratch),
+            },
+            "files": files,
+            "archives": _archives(scratch, files),
+        }
     finally:
-        os.remove(tmp_path)
+        shutil.rmtree(base, ignore_errors=True)
+
+
+# ===== Pool management =====
+def start_pool(workers: int = SANDBOX_WORKERS):
+    """Starts the worker processes and waits until each one is up."""
+    global _POOL, _ADMISSION
+    _check_available()
+    with _POOL_LOCK:
+        if _POOL is not None:
+            return
+        methods = multiprocessing.get_all_start_methods()
+        ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        _POOL = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+        _ADMISSION = threading.BoundedSemaphore(workers * (1 + SANDBOX_QUEUE_PER_WORKER))
+        # Pre-warm: make every worker process start now rather than on the first run.
+        pids = {f.result() for f in [_POOL.submit(_warm) for _ in range(workers * 2)]}
+        logger.info(f"✅ Sandbox pool ready with {len(pids)} worker process(es).")
+
+
+def shutdown_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=True, cancel_futures=True)
+            _POOL = None
+
+
+def submit(code: str, language: str = "bash", args: Optional[List[str]] = None,
+           files: Optional[Dict[str, str]] = None, limits: Optional[dict] = None,
+           dirs: Optional[List[str]] = None, symlinks: Optional[Dict[str, str]] = None):
+    """
+    Queues a run and returns a Future for its result dict. Raises SandboxBusy
+    if the admission queue stays full for SANDBOX_ADMIT_TIMEOUT seconds.
+    """
+    if language not in _INTERPRETERS:
+        raise ValueError(f"unsupported language: {language}")
+    _check_available()
+    if _POOL is None:
+        start_pool()
+    # Held locally: a pool restart below replaces the global semaphore, and
+    # this run's permit must go back to the one it was taken from.
+    admission = _ADMISSION
+    if not admission.acquire(timeout=SANDBOX_ADMIT_TIMEOUT):
+        raise SandboxBusy("sandbox admission queue is full")
+    merged = {**DEFAULT_LIMITS, **(limits or {})}
+    call = (_execute, code, language, list(args or []), dict(files or {}), merged,
+            list(dirs or []), dict(symlinks or {}))
+    try:
+        try:
+            fut = _POOL.submit(*call)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed by the OS); replace the pool once.
+            logger.warning("⚠️ Sandbox pool is broken; restarting it.")
+            shutdown_pool()
+            start_pool()
+            fut = _POOL.submit(*call)
+    except Exception:
+        admission.release()
+        raise
+    fut.add_done_callback(lambda _: admission.release())
+    return fut
+
+
+def run(code: str, language: str = "bash", args: Optional[List[str]] = None,
+        files: Optional[Dict[str, str]] = None, limits: Optional[dict] = None,
+        dirs: Optional[List[str]] = None, symlinks: Optional[Dict[str, str]] = None) -> dict:
+    """Runs `code` in the sandbox and returns exit code, capped output and resource usage."""
+    return submit(code, language, args, files, limits, dirs, symlinks).result()
+
+
+def run_user_code(code: str) -> str:
+    result = run(code, language="python")
+    if result["timed_out"]:
+        return "Execution timed out"
+    return result["stdout"] + result["stderr"]
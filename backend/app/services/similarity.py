@@ -0,0 +1,197 @@
+"""
+Near-duplicate detection over submitted code (MinHash + LSH).
+
+Each answer is normalised (comments and whitespace dropped, see
+grading_cache.normalize_code), split into shell tokens and turned into
+overlapping k-token shingles. A MinHash signature of NUM_PERM values estimates
+the Jaccard similarity of two shingle sets; the signature is cut into BANDS
+bands, and answers to the same question that agree on any whole band share an
+LSH bucket. A lookup therefore only compares against the few submissions in
+the same buckets instead of every earlier answer.
+
+Signatures are stored in the `similarity_signatures` table and the buckets are
+rebuilt in memory from them at startup.
+"""
+import os
+import re
+import random
+import hashlib
+import logging
+import threading
+from array import array
+from typing import Dict, List, Optional
+
+from app.services import blob_store, grading_cache, persistence
+
+logger = logging.getLogger(__name__)
+
+# ===== Config =====
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = int(os.getenv("SIMILARITY_SHINGLE_SIZE", "4"))
+# Submissions from different candidates at or above this similarity are logged as possible copies.
+FLAG_THRESHOLD = float(os.getenv("SIMILARITY_FLAG_THRESHOLD", "0.8"))
+# Reuse an earlier grade for an answer at least this similar (0 disables reuse).
+REUSE_THRESHOLD = float(os.getenv("SIMILARITY_REUSE_THRESHOLD", "0"))
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)  # fixed seed: signatures must stay comparable across restarts
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_TOKEN = re.compile(r"\$\{?\w+\}?|[A-Za-z_][\w.-]*|\d+|\S")
+
+_LOCK = threading.Lock()
+_SIGNATURES: Dict[int, tuple] = {}  # submission id -> (question key, signature)
+_BUCKETS: Dict[tuple, List[int]] = {}
+_STATS = {"indexed": 0, "queries": 0, "candidates_checked": 0}
+
+
+# ===== Signatures =====
+def _question_key(question: Optional[str]) -> str:
+    return hashlib.sha1(grading_cache.normalize_question(question).encode("utf-8")).hexdigest()[:16]
+
+
+def _shingle_hashes(code: str) -> set:
+    tokens = _TOKEN.findall(grading_cache.normalize_code(code))
+    if not tokens:
+        return set()
+    k = min(SHINGLE_SIZE, len(tokens))
+    return {
+        int.from_bytes(hashlib.blake2b(" ".join(tokens[i:i + k]).encode("utf-8"), digest_size=8).digest(), "big")
+        for i in range(len(tokens) - k + 1)
+    }
+
+
+def signature(code: str) -> Optional[List[int]]:
+    """MinHash signature of `code`, or None for an answer with no tokens."""
+    shingles = _shingle_hashes(code or "")
+    if not shingles:
+        return None
+    return [min((a * x + b) % _PRIME for x in shingles) for a, b in _PERMS]
+
+
+def estimate(sig_a: List[int], sig_b: List[int]) -> float:
+    """Estimated Jaccard similarity of the two answers' shingle sets."""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+def _bands(qkey: str, sig: List[int]):
+    for band in range(BANDS):
+        yield (qkey, band, tuple(sig[band * ROWS:(band + 1) * ROWS]))
+
+
+def _to_blob(sig: List[int]) -> bytes:
+    return array("Q", sig).tobytes()
+
+
+def _from_blob(blob: bytes) -> List[int]:
+    values = array("Q")
+    values.frombytes(blob)
+    return values.tolist()
+
+
+def _add(submission_id: int, qkey: str, sig: List[int]):
+    # Caller holds _LOCK.
+    if submission_id in _SIGNATURES:
+        return
+    _SIGNATURES[submission_id] = (qkey, sig)
+    for bucket in _bands(qkey, sig):
+        _BUCKETS.setdefault(bucket, []).append(submission_id)
+
+
+def _query(qkey: str, sig: List[int], threshold: float, before: Optional[int]) -> List[dict]:
+    # Caller holds _LOCK.
+    candidates = set()
+    for bucket in _bands(qkey, sig):
+        candidates.update(_BUCKETS.get(bucket, ()))
+    _STATS["queries"] += 1
+    _STATS["candidates_checked"] += len(candidates)
+    matches = []
+    for other in candidates:
+        if before is not None and other >= before:
+            continue
+        score = estimate(sig, _SIGNATURES[other][1])
+        if score >= threshold:
+            matches.append({"submission_id": other, "similarity": round(score, 4)})
+    matches.sort(key=lambda m: (-m["similarity"], m["submission_id"]))
+    return matches
+
+
+def _log_persist_failure(fut):
+    if fut.exception() is not None:
+        logger.warning(f"⚠️ Could not persist similarity signature: {fut.exception()}")
+
+
+# ===== Public API =====
+def load(conn):
+    """Rebuilds the in-memory buckets from the stored signatures (at startup)."""
+    with _LOCK:
+        _SIGNATURES.clear()
+        _BUCKETS.clear()
+        for row in conn.execute("SELECT submission_id, question_key, signature FROM similarity_signatures"):
+            _add(row["submission_id"], row["question_key"], _from_blob(row["signature"]))
+        count = len(_SIGNATURES)
+    if count:
+        logger.info(f"Loaded {count} similarity signature(s).")
+
+
+def index_submission(submission_id: int, question: Optional[str], code: str,
+                     threshold: Optional[float] = None) -> List[dict]:
+    """
+    Adds a submission to the index and returns the earlier submissions to the
+    same question that are at least `threshold` similar (FLAG_THRESHOLD by
+    default). Stores the signature through the persistence writer.
+    """
+    sig = signature(code)
+    if sig is None:
+        return []
+    qkey = _question_key(question)
+    with _LOCK:
+        matches = _query(qkey, sig, FLAG_THRESHOLD if threshold is None else threshold, before=submission_id)
+        is_new = submission_id not in _SIGNATURES
+        _add(submission_id, qkey, sig)
+        if is_new:
+            _STATS["indexed"] += 1
+    if is_new:
+        fut = persistence.submit(lambda conn: conn.execute(
+            "INSERT OR IGNORE INTO similarity_signatures (submission_id, question_key, signature) VALUES (?, ?, ?)",
+            (submission_id, qkey, _to_blob(sig)),
+        ))
+        fut.add_done_callback(_log_persist_failure)
+    return matches
+
+
+def similar_to(submission_id: int, threshold: float = FLAG_THRESHOLD) -> Optional[List[dict]]:
+    """
+    Earlier submissions to the same question at least `threshold` similar to
+    `submission_id`, with their candidate names. Returns None if the
+    submission does not exist.
+    """
+    with _LOCK:
+        known = _SIGNATURES.get(submission_id)
+    if known is None:
+        row = persistence.reader().execute(
+            f"SELECT question, {blob_store.text_sql('code_answer', 'code_blob')} AS code_answer "
+            "FROM submissions WHERE id = ?", (submission_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        sig = signature(row["code_answer"])
+        if sig is None:
+            return []
+        known = (_question_key(row["question"]), sig)
+    with _LOCK:
+        matches = _query(known[0], known[1], threshold, before=submission_id)
+    if matches:
+        ids = [m["submission_id"] for m in matches]
+        names = dict(persistence.reader().execute(
+            f"SELECT id, full_name FROM submissions WHERE id IN ({','.join('?' * len(ids))})", ids
+        ).fetchall())
+        for m in matches:
+            m["full_name"] = names.get(m["submission_id"])
+    return matches
+
+
+def stats() -> dict:
+    with _LOCK:
+        return {**_STATS, "signatures": len(_SIGNATURES), "buckets": len(_BUCKETS)}
@@ -0,0 +1,150 @@
+"""
+Deterministic stand-in for the grading LLM.
+
+It understands the single and batch grading prompts built in `grading.py` and
+answers them with marks derived from the script text alone, so the same input
+always gets the same grade. Run it as a server for offline load tests:
+
+    python -m app.services.stub_llm --port 8765 --latency 0.2 --error-rate 0.05
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from typing import Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.services.llm_backends import LLMBackend
+
+
+class StubUnavailableError(Exception):
+    """Simulated transient provider failure (like a 503 or rate limit)."""
+    retryable = True
+
+
+_SUBMISSION_RE = re.compile(r"<<<SUBMISSION (\d+)>>>\n(.*?)\n<<<END SUBMISSION \1>>>", re.DOTALL)
+_SINGLE_RE = re.compile(r"```bash\n(.*?)\n```", re.DOTALL)
+_MAX_RE = re.compile(r"between 0\.0 and ([0-9.]+)")
+_QUESTION_TASKS = [
+    "prints the five largest files under a directory given as an argument",
+    "counts how many lines in a log file contain the word ERROR",
+    "renames every .txt file in a directory to .bak",
+    "reports the disk usage of each sub-directory of a given path",
+    "lists the users that currently have running processes",
+]
+
+
+def stub_marks(code: str, max_marks: float = 3.0) -> float:
+    """Stable score in quarter steps, loosely rewarding what the rubric asks for."""
+    if not code or not code.strip():
+        return 0.0
+    score = 0.75
+    if code.lstrip().startswith("#!"): score += 0.5
+    if re.search(r"\b(for|while|if|case)\b", code): score += 0.5
+    if re.search(r'"\$\{?\w+', code): score += 0.5
+    if re.search(r"set -[euo]|\|\| *(exit|echo)", code): score += 0.5
+    if len(code.splitlines()) >= 5: score += 0.25
+    return min(max_marks, round(score * 4) / 4)
+
+
+class StubBackend(LLMBackend):
+    """
+    In-process stub. `latency` (seconds) and `error_rate` simulate a slow or
+    flaky provider; `drop_rate` omits items from batch answers to exercise the
+    per-item re-grade path. Randomness is seeded, so runs are reproducible.
+    """
+    name = "stub"
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, drop_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _roll(self) -> float:
+        with self._lock:
+            self.calls += 1
+            return self._rng.random()
+
+    def generate(self, prompt: str, timeout: Optional[float] = None, system: Optional[str] = None) -> str:
+        if system:
+            prompt = f"{system}\n\n{prompt}"
+        if self.latency:
+            if timeout is not None and self.latency > timeout:
+                time.sleep(timeout)
+                raise TimeoutError("stub LLM: simulated timeout")
+            time.sleep(self.latency)
+        if self._roll() < self.error_rate:
+            raise StubUnavailableError("stub LLM: simulated provider error")
+
+        if "Generate a unique coding question" in prompt:
+            n = self._roll()
+            task = _QUESTION_TASKS[int(n * len(_QUESTION_TASKS))]
+            return f"Write a shell script that {task} (variant {int(n * 10000)})."
+
+        m = _MAX_RE.search(prompt)
+        max_marks = float(m.group(1)) if m else 3.0
+
+        items = _SUBMISSION_RE.findall(prompt)
+        if items:
+            out = []
+            for sid, code in items:
+                if self.drop_rate and self._roll() < self.drop_rate:
+                    continue
+                out.append({"id": int(sid), "marks": stub_marks(code, max_marks), "feedback": "Stub feedback."})
+            return json.dumps(out)
+
+        m = _SINGLE_RE.search(prompt)
+        code = m.group(1) if m else ""
+        return json.dumps({"marks": stub_marks(code, max_marks), "feedback": "Stub feedback."})
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765, backend: StubBackend = None) -> ThreadingHTTPServer:
+    """Starts the stub on a background thread and returns the server (call `.shutdown()` to stop)."""
+    backend = backend or StubBackend()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                text = backend.generate(payload.get("prompt", ""), system=payload.get("system"))
+                body, status = json.dumps({"text": text}), 200
+            except Exception as e:
+                body, status = json.dumps({"error": str(e)}), 503
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-llm", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic stub LLM server for offline grading tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls that fail with 503")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="fraction of batch items left out")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    srv = serve(args.host, args.port, StubBackend(args.latency, args.error_rate, args.drop_rate, args.seed))
+    print(f"Stub LLM listening on http://{args.host}:{args.port}/generate")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        srv.shutdown()
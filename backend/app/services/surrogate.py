@@ -0,0 +1,250 @@
+"""
+Local surrogate grader: k-nearest-neighbour marks from earlier LLM grades.
+
+Every answer the LLM grades becomes a labelled example. Answers are turned
+into hashed token / token-bigram vectors (sublinear tf, L2-normalised), and
+the examples for each question and rubric live in one NumPy matrix, so
+scoring a new answer (or a whole batch) is one matrix product. When the
+nearest neighbours are close enough and agree on the mark, their consensus is
+returned and the LLM is skipped.
+
+To keep the thresholds honest, a sample of confident predictions
+(SURROGATE_SHADOW_RATE) is still sent to the LLM, and every LLM grade is
+compared with what the surrogate would have said; `stats()` reports the
+agreement rate.
+"""
+import os
+import re
+import math
+import random
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # surrogate grading is skipped without numpy
+    np = None
+
+from app.services import blob_store, grading_cache, persistence
+
+logger = logging.getLogger(__name__)
+
+# ===== Config =====
+SURROGATE_ENABLED = os.getenv("SURROGATE_ENABLED", "1") == "1" and np is not None
+SURROGATE_DIM = int(os.getenv("SURROGATE_DIM", "1024"))
+SURROGATE_K = int(os.getenv("SURROGATE_K", "5"))
+# Neighbours must be at least this cosine-similar to count ...
+SURROGATE_MIN_SIMILARITY = float(os.getenv("SURROGATE_MIN_SIMILARITY", "0.85"))
+# ... there must be at least this many of them ...
+SURROGATE_MIN_NEIGHBOURS = int(os.getenv("SURROGATE_MIN_NEIGHBOURS", "3"))
+# ... and their marks may differ by at most this much.
+SURROGATE_MAX_SPREAD = float(os.getenv("SURROGATE_MAX_SPREAD", "0.25"))
+# Fraction of confident predictions still checked against the LLM.
+SURROGATE_SHADOW_RATE = float(os.getenv("SURROGATE_SHADOW_RATE", "0.1"))
+# Examples kept per question; the oldest are overwritten beyond this.
+SURROGATE_MAX_EXAMPLES = int(os.getenv("SURROGATE_MAX_EXAMPLES", "5000"))
+# A prediction within this many marks of the LLM's grade counts as agreeing.
+AGREEMENT_TOLERANCE = 0.25
+
+_TOKEN = re.compile(r"\$\{?\w+\}?|[A-Za-z_][\w.-]*|\d+|[^\s\w]+")
+
+_LOCK = threading.Lock()
+_INDEXES: Dict[str, "_Index"] = {}
+_PERSIST = False
+_STATS = {
+    "examples": 0, "predictions": 0, "confident": 0, "llm_skipped": 0,
+    "compared": 0, "agreed": 0, "abs_error_sum": 0.0,
+}
+
+
+class _Index:
+    """Examples for one (rubric, question): a growable vector matrix plus their marks."""
+
+    def __init__(self):
+        self.vectors = np.zeros((16, SURROGATE_DIM), dtype=np.float32)
+        self.marks = np.zeros(16, dtype=np.float32)
+        self.rows: Dict[str, int] = {}  # example key -> row
+        self.keys: List[str] = []  # row -> example key
+        self.size = 0
+        self.added = 0
+
+    def add(self, key: str, vector, marks: float):
+        row = self.rows.get(key)
+        if row is None:
+            if self.size < SURROGATE_MAX_EXAMPLES:
+                if self.size == len(self.marks):
+                    capacity = min(SURROGATE_MAX_EXAMPLES, len(self.marks) * 2)
+                    self.vectors = np.resize(self.vectors, (capacity, SURROGATE_DIM))
+                    self.marks = np.resize(self.marks, capacity)
+                row = self.size
+                self.size += 1
+                self.keys.append(key)
+            else:
+                row = self.added % SURROGATE_MAX_EXAMPLES
+                del self.rows[self.keys[row]]
+                self.keys[row] = key
+            self.rows[key] = row
+            self.added += 1
+        self.vectors[row] = vector
+        self.marks[row] = marks
+
+    def neighbours(self, queries):
+        """(similarities, marks) of the SURROGATE_K nearest examples, one row per query."""
+        sims = queries @ self.vectors[:self.size].T
+        k = min(SURROGATE_K, self.size)
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        return np.take_along_axis(sims, top, axis=1), self.marks[top]
+
+
+# ===== Vectors =====
+def _index_key(question: Optional[str], namespace: str) -> str:
+    return hashlib.sha1(f"{namespace}\0{grading_cache.normalize_question(question)}".encode("utf-8")).hexdigest()
+
+
+def _bucket(feature: str) -> tuple:
+    h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+    return h % SURROGATE_DIM, (1.0 if (h >> 63) else -1.0)
+
+
+def vectorize(code: str):
+    """Hashed token + bigram vector of a normalised answer, L2-normalised."""
+    tokens = _TOKEN.findall(grading_cache.normalize_code(code))
+    counts: Dict[str, int] = {}
+    for i, token in enumerate(tokens):
+        counts[token] = counts.get(token, 0) + 1
+        if i:
+            bigram = tokens[i - 1] + " " + token
+            counts[bigram] = counts.get(bigram, 0) + 1
+    vector = np.zeros(SURROGATE_DIM, dtype=np.float32)
+    for feature, n in counts.items():
+        index, sign = _bucket(feature)
+        vector[index] += sign * (1.0 + math.log(n))
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+def _consensus(sims, marks) -> Optional[dict]:
+    close = sims >= SURROGATE_MIN_SIMILARITY
+    n = int(close.sum())
+    if n == 0:
+        return None
+    near_sims, near_marks = sims[close], marks[close]
+    mean = float((near_sims * near_marks).sum() / near_sims.sum())
+    spread = float(near_marks.max() - near_marks.min())
+    return {
+        "marks": mean,
+        "neighbours": n,
+        "similarity": round(float(near_sims.mean()), 4),
+        "spread": spread,
+        "confident": n >= SURROGATE_MIN_NEIGHBOURS and spread <= SURROGATE_MAX_SPREAD,
+    }
+
+
+def _index_for(index_key: str) -> "_Index":
+    # Caller holds _LOCK.
+    index = _INDEXES.get(index_key)
+    if index is None:
+        index = _INDEXES[index_key] = _Index()
+    return index
+
+
+def _log_persist_failure(fut):
+    if fut.exception() is not None:
+        logger.warning(f"⚠️ Could not persist surrogate example: {fut.exception()}")
+
+
+# ===== Public API =====
+def configure(persist: bool):
+    """
+    Turns the `surrogate_examples` table on or off. Enabling it reloads the
+    stored examples into memory; needs the persistence writer to be running.
+    """
+    global _PERSIST
+    _PERSIST = persist
+    if not (persist and SURROGATE_ENABLED):
+        return
+    rows = persistence.reader().execute(
+        f"SELECT key, index_key, {blob_store.text_sql('code_answer', 'code_blob')} AS code_answer, marks "
+        "FROM surrogate_examples ORDER BY rowid"
+    ).fetchall()
+    with _LOCK:
+        _INDEXES.clear()
+        for row in rows:
+            _index_for(row["index_key"]).add(row["key"], vectorize(row["code_answer"]), row["marks"])
+        _STATS["examples"] = sum(index.size for index in _INDEXES.values())
+    if rows:
+        logger.info(f"Loaded {len(rows)} surrogate grading example(s).")
+
+
+def predict_batch(code_answers: List[str], question: Optional[str], namespace: str = "") -> List[Optional[dict]]:
+    """
+    Nearest-neighbour prediction for each answer: {"marks", "neighbours",
+    "similarity", "spread", "confident"}, or None when no close example exists.
+    """
+    if not SURROGATE_ENABLED or not code_answers:
+        return [None] * len(code_answers)
+    queries = np.stack([vectorize(code) for code in code_answers])
+    with _LOCK:
+        index = _INDEXES.get(_index_key(question, namespace))
+        if index is None or index.size == 0:
+            return [None] * len(code_answers)
+        sims, marks = index.neighbours(queries)
+    predictions = [_consensus(s, m) for s, m in zip(sims, marks)]
+    with _LOCK:
+        _STATS["predictions"] += len(predictions)
+        _STATS["confident"] += sum(1 for p in predictions if p and p["confident"])
+    return predictions
+
+
+def should_skip_llm(prediction: Optional[dict]) -> bool:
+    """True for a confident prediction that is not sampled for a shadow LLM check."""
+    if not prediction or not prediction["confident"]:
+        return False
+    if random.random() < SURROGATE_SHADOW_RATE:
+        return False
+    with _LOCK:
+        _STATS["llm_skipped"] += 1
+    return True
+
+
+def observe(code_answer: str, question: Optional[str], marks: float, namespace: str = "",
+            prediction: Optional[dict] = None):
+    """
+    Adds an LLM-graded answer as a new example and, if a prediction was made
+    for it, records whether the surrogate agreed with the LLM.
+    """
+    if not SURROGATE_ENABLED:
+        return
+    key = grading_cache.make_key(question, code_answer, namespace)
+    index_key = _index_key(question, namespace)
+    vector = vectorize(code_answer)
+    with _LOCK:
+        _index_for(index_key).add(key, vector, marks)
+        _STATS["examples"] = sum(i.size for i in _INDEXES.values())
+        if prediction is not None:
+            error = abs(prediction["marks"] - marks)
+            _STATS["compared"] += 1
+            _STATS["agreed"] += error <= AGREEMENT_TOLERANCE
+            _STATS["abs_error_sum"] += error
+            compared, agreed = _STATS["compared"], _STATS["agreed"]
+    if prediction is not None and compared % 50 == 0:
+        logger.info(f"Surrogate agreed with the LLM on {agreed}/{compared} answers ({agreed / compared:.0%}).")
+    if _PERSIST:
+        fut = persistence.submit(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO surrogate_examples (key, index_key, code_answer, code_blob, marks) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key, index_key, *blob_store.store(conn, code_answer), marks),
+        ))
+        fut.add_done_callback(_log_persist_failure)
+
+
+def stats() -> dict:
+    with _LOCK:
+        s = dict(_STATS)
+    s["enabled"] = SURROGATE_ENABLED
+    s["agreement_rate"] = round(s["agreed"] / s["compared"], 4) if s["compared"] else None
+    error_sum = s.pop("abs_error_sum")
+    s["mean_abs_error"] = round(error_sum / s["compared"], 4) if s["compared"] else None
+    return s
@@ -0,0 +1,226 @@
+"""
+Topic index over syllabus / assignment documents.
+
+The vocabulary (single words or phrases, TOPIC_VOCABULARY_FILE or the built-in
+list) is compiled once into an Aho–Corasick automaton, so a document is
+scanned a single time however many terms there are. For each document the
+index keeps term counts; document frequencies are updated as documents are
+added or replaced, and TF-IDF weights are computed from them on demand.
+Question generation picks topics by these weights instead of rescanning text.
+"""
+import os
+import math
+import random
+import logging
+import threading
+from collections import Counter, deque
+from typing import Dict, Iterable, List, Optional
+
+from app.services import persistence
+
+logger = logging.getLogger(__name__)
+
+# ===== Config =====
+TOPIC_VOCABULARY_FILE = os.getenv("TOPIC_VOCABULARY_FILE")
+DEFAULT_TOPIC = "shell scripting in operating systems"
+
+DEFAULT_VOCABULARY = [
+    "process", "scheduling", "threads", "memory", "paging", "deadlock", "filesystem",
+    "synchronization", "semaphores", "mutex", "race condition", "critical section",
+    "virtual memory", "page fault", "segmentation", "round robin", "context switch",
+    "signals", "pipes", "inter-process communication", "file permissions", "inodes",
+    "system calls", "cron", "log rotation", "disk usage", "networking", "sockets",
+    "environment variables", "regular expressions", "text processing", "backups",
+    "user management", "process monitoring",
+]
+
+_LOCK = threading.Lock()
+_DOC_TERMS: Dict[str, Counter] = {}
+_DF: Counter = Counter()
+_PERSIST = False
+
+
+class _Matcher:
+    """Aho–Corasick automaton over lowercase terms, matching on word boundaries."""
+
+    def __init__(self, terms: Iterable[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[str]] = [[]]
+        for term in terms:
+            term = " ".join(term.lower().split())
+            if not term:
+                continue
+            node = 0
+            for ch in term:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = nxt
+            if term not in self.out[node]:
+                self.out[node].append(term)
+        # Breadth-first pass to set failure links and merge outputs.
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                nxt = self.goto[f].get(ch, 0)
+                self.fail[child] = nxt if nxt != child else 0
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def count(self, text: str) -> Counter:
+        counts: Counter = Counter()
+        # Collapse whitespace so phrases match across line breaks.
+        text = " ".join(text.lower().split())
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            for term in self.out[node]:
+                start, end = i - len(term) + 1, i + 1
+                if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                    counts[term] += 1
+        return counts
+
+
+def _load_vocabulary() -> List[str]:
+    if TOPIC_VOCABULARY_FILE:
+        try:
+            with open(TOPIC_VOCABULARY_FILE, encoding="utf-8") as f:
+                return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        except OSError as e:
+            logger.warning(f"⚠️ Could not read TOPIC_VOCABULARY_FILE, using the built-in vocabulary: {e}")
+    return DEFAULT_VOCABULARY
+
+
+_MATCHER = _Matcher(_load_vocabulary())
+
+
+def _forget(counts: Counter):
+    # Caller holds _LOCK.
+    for term in counts:
+        _DF[term] -= 1
+        if _DF[term] <= 0:
+            del _DF[term]
+
+
+def _log_persist_failure(fut):
+    if fut.exception() is not None:
+        logger.warning(f"⚠️ Could not persist topic index document: {fut.exception()}")
+
+
+def _store(conn, doc_id: str, counts: Counter):
+    conn.execute("DELETE FROM topic_terms WHERE doc_id = ?", (doc_id,))
+    conn.executemany(
+        "INSERT INTO topic_terms (doc_id, term, count) VALUES (?, ?, ?)",
+        [(doc_id, term, n) for term, n in counts.items()],
+    )
+
+
+# ===== Public API =====
+def set_vocabulary(terms: Iterable[str]):
+    """Replaces the vocabulary. Documents already indexed keep their old counts until re-added."""
+    global _MATCHER
+    matcher = _Matcher(terms)
+    with _LOCK:
+        _MATCHER = matcher
+
+
+def term_counts(text: str) -> Counter:
+    """Vocabulary terms found in `text`, with counts, from one pass over it."""
+    return _MATCHER.count(text or "")
+
+
+def configure(persist: bool):
+    """
+    Turns storage in the `topic_terms` table on or off. Enabling it reloads
+    the stored documents; needs the persistence writer to be running.
+    """
+    global _PERSIST
+    _PERSIST = persist
+    if not persist:
+        return
+    docs: Dict[str, Counter] = {}
+    for row in persistence.reader().execute("SELECT doc_id, term, count FROM topic_terms"):
+        docs.setdefault(row["doc_id"], Counter())[row["term"]] = row["count"]
+    with _LOCK:
+        _DOC_TERMS.clear()
+        _DF.clear()
+        for doc_id, counts in docs.items():
+            _DOC_TERMS[doc_id] = counts
+            _DF.update(counts.keys())
+
+
+def add_document(doc_id: str, text: str) -> Counter:
+    """Indexes (or re-indexes) one document and returns its term counts."""
+    counts = term_counts(text)
+    with _LOCK:
+        old = _DOC_TERMS.get(doc_id)
+        if old is not None:
+            _forget(old)
+        _DOC_TERMS[doc_id] = counts
+        _DF.update(counts.keys())
+    if _PERSIST:
+        fut = persistence.submit(lambda conn: _store(conn, doc_id, counts))
+        fut.add_done_callback(_log_persist_failure)
+    return counts
+
+
+def remove_document(doc_id: str):
+    with _LOCK:
+        old = _DOC_TERMS.pop(doc_id, None)
+        if old is None:
+            return
+        _forget(old)
+    if _PERSIST:
+        fut = persistence.submit(lambda conn: conn.execute("DELETE FROM topic_terms WHERE doc_id = ?", (doc_id,)))
+        fut.add_done_callback(_log_persist_failure)
+
+
+def tfidf(doc_id: Optional[str] = None) -> Dict[str, float]:
+    """
+    TF-IDF weight per term for one document (sublinear tf, smoothed idf), or
+    summed over every document when `doc_id` is None.
+    """
+    with _LOCK:
+        n_docs = len(_DOC_TERMS)
+        if doc_id is None:
+            docs = list(_DOC_TERMS.values())
+        else:
+            docs = [_DOC_TERMS[doc_id]] if doc_id in _DOC_TERMS else []
+        df = dict(_DF)
+    weights: Counter = Counter()
+    for counts in docs:
+        for term, n in counts.items():
+            idf = math.log((1 + n_docs) / (1 + df.get(term, 0))) + 1
+            weights[term] += (1 + math.log(n)) * idf
+    return dict(weights)
+
+
+def top_topics(doc_id: Optional[str] = None, limit: int = 10) -> List[dict]:
+    weights = tfidf(doc_id)
+    ranked = sorted(weights.items(), key=lambda kv: (-kv[1], kv[0]))[:limit]
+    return [{"term": term, "weight": round(w, 4)} for term, w in ranked]
+
+
+def pick_topic(doc_id: Optional[str] = None, rng: Optional[random.Random] = None) -> Optional[str]:
+    """A topic drawn at random in proportion to its TF-IDF weight, or None if nothing is indexed."""
+    weights = tfidf(doc_id)
+    if not weights:
+        return None
+    terms = sorted(weights)
+    return (rng or random).choices(terms, weights=[weights[t] for t in terms])[0]
+
+
+def stats() -> dict:
+    with _LOCK:
+        return {"documents": len(_DOC_TERMS), "terms": len(_DF), "vocabulary_nodes": len(_MATCHER.goto)}
@@ -1,14 +1,154 @@
+"""
+Text extraction from uploaded PDFs.
+
+Pages are extracted one at a time, so a page pypdf cannot parse is recorded
+and skipped instead of failing the whole file. Large documents are split into
+page ranges and extracted on a process pool. Results are cached on disk under
+PDF_CACHE_DIR, keyed by the SHA-256 of the file's bytes, so re-uploading the
+same assignment does not parse it again.
+"""
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
 from pypdf import PdfReader
 
-def extract_text_from_pdf(file_path: str) -> str:
+logger = logging.getLogger(__name__)
+
+# ===== Config =====
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", os.path.join(tempfile.gettempdir(), "pariksha-pdf-cache"))
+# Documents with at least this many pages are extracted in parallel.
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 2)))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+# Bump when extraction changes so older cache entries are ignored.
+_CACHE_VERSION = "1"
+
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+
+# ===== Page extraction =====
+def _page_text(reader: PdfReader, index: int) -> Tuple[int, Optional[str], Optional[str]]:
+    try:
+        return index, reader.pages[index].extract_text() or "", None
+    except Exception as e:
+        return index, None, f"{type(e).__name__}: {e}"
+
+
+def iter_pages(file_path: str, start: int = 0, stop: Optional[int] = None) -> Iterator[Tuple[int, Optional[str], Optional[str]]]:
     """
-    Extracts text from a PDF file and returns it as a string.
+    Yields `(page_index, text, error)` for each page in [start, stop). `text`
+    is None and `error` says why when a page could not be extracted.
+    """
+    reader = PdfReader(file_path)
+    stop = len(reader.pages) if stop is None else min(stop, len(reader.pages))
+    for index in range(start, stop):
+        yield _page_text(reader, index)
+
+
+def _extract_range(file_path: str, start: int, stop: int) -> list:
+    # Runs in a pool process, which opens its own reader.
+    return list(iter_pages(file_path, start, stop))
+
+
+def _pool() -> ProcessPoolExecutor:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+        return _POOL
+
+
+def shutdown_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=True, cancel_futures=True)
+            _POOL = None
+
+
+# ===== Cache =====
+def file_sha256(file_path: str) -> str:
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _cache_path(digest: str) -> str:
+    return os.path.join(PDF_CACHE_DIR, f"{digest}.v{_CACHE_VERSION}.json")
+
+
+def _cache_load(digest: str) -> Optional[dict]:
+    try:
+        with open(_cache_path(digest), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _cache_store(digest: str, result: dict):
+    try:
+        os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=PDF_CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        os.replace(tmp, _cache_path(digest))
+    except OSError as e:
+        logger.warning(f"⚠️ Could not cache extracted PDF text: {e}")
+
+
+# ===== Public API =====
+def extract_pages(file_path: str, use_cache: bool = True) -> dict:
+    """
+    Extracts every page of a PDF. Returns {"sha256", "page_count", "pages",
+    "failed_pages"}: `pages` holds one string per page ("" for a failed page)
+    and `failed_pages` lists {"page", "error"} (1-based page numbers).
+    Raises RuntimeError if the file cannot be opened as a PDF at all.
     """
+    digest = file_sha256(file_path)
+    if use_cache:
+        cached = _cache_load(digest)
+        if cached is not None:
+            return cached
+
     try:
-        reader = PdfReader(file_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text.strip()
+        page_count = len(PdfReader(file_path).pages)
     except Exception as e:
         raise RuntimeError(f"Failed to read PDF: {str(e)}")
+
+    if page_count >= PDF_PARALLEL_MIN_PAGES and PDF_WORKERS > 1:
+        ranges = [(s, min(s + PDF_PAGES_PER_TASK, page_count)) for s in range(0, page_count, PDF_PAGES_PER_TASK)]
+        pool = _pool()
+        futures = [pool.submit(_extract_range, file_path, s, e) for s, e in ranges]
+        extracted = [page for fut in futures for page in fut.result()]
+    else:
+        extracted = list(iter_pages(file_path))
+
+    pages: List[str] = []
+    failed = []
+    for index, text, error in extracted:
+        pages.append(text or "")
+        if error is not None:
+            failed.append({"page": index + 1, "error": error})
+    if failed:
+        logger.warning(f"⚠️ {len(failed)} of {page_count} page(s) could not be extracted from {os.path.basename(file_path)}.")
+
+    result = {"sha256": digest, "page_count": page_count, "pages": pages, "failed_pages": failed}
+    if use_cache:
+        _cache_store(digest, result)
+    return result
+
+
+def extract_text_from_pdf(file_path: str) -> str:
+    """
+    Extracts text from a PDF file and returns it as a string.
+    """
+    return "\n".join(extract_pages(file_path)["pages"]).strip()
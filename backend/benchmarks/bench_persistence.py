@@ -0,0 +1,101 @@
+"""
+Write-throughput benchmark: the old per-request connection + UPDATE/INSERT
+path against the group-committing writer in `app.services.persistence`.
+
+    cd backend
+    python benchmarks/bench_persistence.py --threads 32 --writes 50
+
+Prints one JSON object, so results can be diffed across commits.
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services import persistence  # noqa: E402
+
+
+def legacy_write(db_path: str, full_name: str, code_score: float):
+    # Same statements as the pre-persistence submit_code route.
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("UPDATE results SET code_score = ? WHERE full_name = ?", (code_score, full_name))
+    if cursor.rowcount == 0:
+        cursor.execute("INSERT INTO results (full_name, code_score) VALUES (?, ?)", (full_name, code_score))
+    conn.commit()
+    conn.close()
+
+
+def writer_write(db_path: str, full_name: str, code_score: float):
+    persistence.write(lambda conn: persistence.upsert_result(conn, full_name, code_score))
+
+
+def run(write, db_path: str, threads: int, writes: int) -> dict:
+    errors = {"locked": 0, "other": 0}
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker(t: int):
+        barrier.wait()
+        for i in range(writes):
+            try:
+                write(db_path, f"candidate-{t}-{i % 10}", float(i % 13) / 4)
+            except sqlite3.OperationalError as e:
+                with lock:
+                    errors["locked" if "locked" in str(e) else "other"] += 1
+            except Exception:
+                with lock:
+                    errors["other"] += 1
+
+    pool = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    total = threads * writes
+    return {
+        "writes": total,
+        "seconds": round(elapsed, 3),
+        "writes_per_sec": round(total / elapsed, 1),
+        "lock_errors": errors["locked"],
+        "other_errors": errors["other"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--writes", type=int, default=50, help="writes per thread")
+    args = parser.parse_args()
+
+    report = {"threads": args.threads, "writes_per_thread": args.writes}
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_db = os.path.join(tmp, "legacy.db")
+        conn = sqlite3.connect(legacy_db)
+        conn.execute(persistence.SCHEMA[0])
+        conn.close()
+        report["legacy"] = run(legacy_write, legacy_db, args.threads, args.writes)
+
+        writer_db = os.path.join(tmp, "writer.db")
+        persistence.setup_database(writer_db)
+        persistence.start(writer_db)
+        try:
+            report["writer"] = run(writer_write, writer_db, args.threads, args.writes)
+            report["writer"]["commits"] = persistence.stats()["commits"]
+        finally:
+            persistence.stop()
+
+    report["speedup"] = round(report["writer"]["writes_per_sec"] / report["legacy"]["writes_per_sec"], 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
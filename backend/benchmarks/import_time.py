@@ -0,0 +1,65 @@
+"""
+Import-time check for the backend: imports `app.main` in fresh interpreters
+and verifies that doing so is fast and has no side effects (no database file
+created, no LLM client built).
+
+    cd backend
+    python benchmarks/import_time.py --runs 5 --max-seconds 2.0
+
+Prints one JSON object and exits non-zero if the best run exceeds the budget
+or importing touched the database, so CI can gate on it.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PROBE = """
+import json, time
+start = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - start
+from app.services import grading
+print(json.dumps({"seconds": elapsed, "llm_built": grading._BACKEND_READY}))
+"""
+
+
+def measure(db_path: str) -> dict:
+    env = {**os.environ, "EXAM_DB_PATH": db_path, "PYTHONDONTWRITEBYTECODE": "1"}
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=2.0, help="budget for the fastest import")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "import-check.db")
+        runs = [measure(db_path) for _ in range(args.runs)]
+        db_created = os.path.exists(db_path)
+
+    seconds = sorted(r["seconds"] for r in runs)
+    report = {
+        "runs": args.runs,
+        "best_seconds": round(seconds[0], 3),
+        "median_seconds": round(seconds[len(seconds) // 2], 3),
+        "max_seconds": args.max_seconds,
+        "db_created": db_created,
+        "llm_built": any(r["llm_built"] for r in runs),
+    }
+    report["ok"] = report["best_seconds"] <= args.max_seconds and not db_created and not report["llm_built"]
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Exam-day load test: N candidates fetch a question, then all submit at the
+same moment (the deadline burst), and the run waits for every submission to
+be graded. The app runs under uvicorn on a fresh temporary database, grading
+against the stub LLM server with simulated latency and errors.
+
+    cd backend
+    python benchmarks/load_test.py --candidates 200 --latency 0.2 --error-rate 0.05
+
+Prints one JSON object (throughput, p50/p95/p99 latency, errors and SQLite
+lock errors per phase), so results can be diffed across commits.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from app.services import stub_llm  # noqa: E402
+
+ANSWERS = [
+    "#!/bin/bash\nset -euo pipefail\ndir=\"${1:-.}\"\nfind \"$dir\" -type f -exec du -a {} + | sort -rn | head -n 5\n",
+    "#!/bin/bash\nfor f in \"$1\"/*.txt; do\n  mv \"$f\" \"${f%.txt}.bak\"\ndone\n",
+    "grep -c ERROR \"$1\"\n",
+    "#!/bin/bash\nif [ -z \"$1\" ]; then echo usage; exit 1; fi\ndu -sh \"$1\"/*\n",
+    "ps -eo user= | sort -u\n",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def request(base: str, method: str, path: str, body=None, timeout: float = 60.0):
+    """Returns (status, json body or None, seconds). Status 0 means no HTTP response."""
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    req = urllib.request.Request(base + path, data=data, method=method, headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            status, raw = resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        status, raw = e.code, e.read()
+    except (urllib.error.URLError, OSError):
+        return 0, None, time.perf_counter() - start
+    elapsed = time.perf_counter() - start
+    try:
+        return status, json.loads(raw or b"null"), elapsed
+    except ValueError:
+        return status, None, elapsed
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+class Phase:
+    """Latencies and status codes of one kind of request."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.statuses = Counter()
+        self.lock_errors = 0
+        self.started = self.finished = None
+
+    def record(self, status: int, body, seconds: float):
+        now = time.perf_counter()
+        with self.lock:
+            self.started = now - seconds if self.started is None else min(self.started, now - seconds)
+            self.finished = now if self.finished is None else max(self.finished, now)
+            self.latencies.append(seconds)
+            self.statuses[status] += 1
+            if "locked" in json.dumps(body or "").lower():
+                self.lock_errors += 1
+
+    def report(self) -> dict:
+        lat = sorted(self.latencies)
+        elapsed = (self.finished - self.started) if lat else 0.0
+        errors = sum(n for status, n in self.statuses.items() if not 200 <= status < 300)
+        return {
+            "requests": len(lat),
+            "errors": errors,
+            "statuses": {str(k): v for k, v in sorted(self.statuses.items())},
+            "lock_errors": self.lock_errors,
+            "seconds": round(elapsed, 3),
+            "throughput_per_sec": round(len(lat) / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": round(percentile(lat, 50) * 1000, 1),
+            "p95_ms": round(percentile(lat, 95) * 1000, 1),
+            "p99_ms": round(percentile(lat, 99) * 1000, 1),
+            "max_ms": round(lat[-1] * 1000, 1) if lat else 0.0,
+        }
+
+
+def start_server(port: int, db_path: str, llm_url: str, log_path: str, extra_env: dict) -> subprocess.Popen:
+    env = {**os.environ, "EXAM_DB_PATH": db_path, "LLM_BACKEND": "http", "LLM_HTTP_URL": llm_url, **extra_env}
+    log = open(log_path, "w")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with code {proc.returncode}; see {log_path}")
+        status, _, _ = request(base, "GET", "/", timeout=1)
+        if status == 200:
+            return proc
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"server did not start within 60s; see {log_path}")
+
+
+def run(base: str, candidates: int, grading_timeout: float) -> dict:
+    phases = {"generate": Phase(), "submit": Phase(), "poll": Phase()}
+    barrier = threading.Barrier(candidates)
+    graded = Phase()  # time from submit to a final grading status
+    outcomes = Counter()
+
+    def candidate(i: int):
+        name = f"candidate-{i}"
+        status, body, seconds = request(base, "POST", "/exam/generate?" + urllib.parse.urlencode({"full_name": name}))
+        phases["generate"].record(status, body, seconds)
+        question = (body or {}).get("code_question")
+        # Everyone hits submit together, as at the exam deadline.
+        barrier.wait()
+        submitted = time.perf_counter()
+        payload = {"full_name": name, "code_answer": ANSWERS[i % len(ANSWERS)] + f"# {name}\n", "question": question}
+        status, body, seconds = request(base, "POST", "/exam/submit_code", payload)
+        phases["submit"].record(status, body, seconds)
+        submission_id = (body or {}).get("submission_id")
+        if submission_id is None:
+            outcomes["not_submitted"] += 1
+            return
+        deadline = submitted + grading_timeout
+        while time.perf_counter() < deadline:
+            status, body, seconds = request(base, "GET", f"/exam/submission/{submission_id}")
+            phases["poll"].record(status, body, seconds)
+            state = (body or {}).get("status")
+            if state in ("done", "failed"):
+                graded.record(200 if state == "done" else 500, None, time.perf_counter() - submitted)
+                outcomes[state] += 1
+                return
+            time.sleep(0.25)
+        outcomes["timed_out"] += 1
+
+    threads = [threading.Thread(target=candidate, args=(i,)) for i in range(candidates)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    report = {name: phase.report() for name, phase in phases.items()}
+    report["grading"] = {**graded.report(), "outcomes": dict(outcomes)}
+    report["total_seconds"] = round(time.perf_counter() - start, 3)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--candidates", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.2, help="stub LLM seconds per call")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="fraction of stub LLM calls that fail")
+    parser.add_argument("--grading-timeout", type=float, default=120.0, help="seconds to wait for each grade")
+    parser.add_argument("--workers", type=int, default=None, help="GRADING_WORKERS for the server")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    stub_port, app_port = free_port(), free_port()
+    stub = stub_llm.serve(port=stub_port, backend=stub_llm.StubBackend(args.latency, args.error_rate))
+    extra_env = {"GRADING_WORKERS": str(args.workers)} if args.workers else {}
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = os.path.join(tmp, "server.log")
+        server = start_server(app_port, os.path.join(tmp, "load.db"), f"http://127.0.0.1:{stub_port}/generate", log_path, extra_env)
+        try:
+            report = {"candidates": args.candidates, "llm_latency": args.latency, "llm_error_rate": args.error_rate}
+            report.update(run(f"http://127.0.0.1:{app_port}", args.candidates, args.grading_timeout))
+        finally:
+            server.terminate()
+            server.wait(30)
+            stub.shutdown()
+        with open(log_path, encoding="utf-8", errors="replace") as f:
+            log = f.read()
+    report["server_lock_errors"] = log.lower().count("database is locked")
+    report["server_errors"] = log.count("❌")
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,16 @@
+import json
+import time
 import streamlit as st
 import pandas as pd
-import sqlite3
-import os
+import requests
 
 # --- Configuration ---
-DB_PATH = "D:/testAI/backend/exam_results.db"  # Assumes the DB is in the same folder as this script
+BACKEND_URL = "http://127.0.0.1:10000"  # Ensure this matches your backend port
+CHANGES_URL = f"{BACKEND_URL}/results/changes"
+AGGREGATES_URL = f"{BACKEND_URL}/results/aggregates"
+EVENTS_URL = f"{BACKEND_URL}/events"
+EXPORT_URL = f"{BACKEND_URL}/export"
+PAGE_SIZE = 500
 
 # --- Page Setup ---
 st.set_page_config(
@@ -17,43 +23,117 @@ st.title("📊 Exam Results Dashboard")
 st.markdown("This dashboard displays the results from the CodeCraft Online Exam.")
 
 
-# --- Database Connection ---
-def fetch_data():
-    """Connects to the SQLite database and fetches all results."""
-    if not os.path.exists(DB_PATH):
-        st.error(
-            f"Database file not found at '{DB_PATH}'. Please make sure the backend has run and created the database.")
-        return None
+# --- Session State ---
+# Rows already fetched, keyed by candidate, and the last row version we saw.
+st.session_state.setdefault("rows", {})
+st.session_state.setdefault("version", 0)
+st.session_state.setdefault("last_event_id", None)
+
 
+# --- Backend Connection ---
+def fetch_data():
+    """
+    Pulls only the rows that changed since the last run (all rows on the first
+    run) plus the server-side aggregates, and merges them into session state.
+    """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        # Use pandas to easily read the SQL query into a DataFrame
-        df = pd.read_sql_query("SELECT full_name, code_score FROM results ORDER BY code_score DESC", conn)
-        conn.close()
-        return df
-    except Exception as e:
-        st.error(f"An error occurred while connecting to the database: {e}")
+        while True:
+            res = requests.get(CHANGES_URL, params={"since": st.session_state.version, "limit": PAGE_SIZE}, timeout=10)
+            res.raise_for_status()
+            page = res.json()
+            for row in page["items"]:
+                st.session_state.rows[row["full_name"]] = row
+            st.session_state.version = page["version"]
+            if not page["has_more"]:
+                break
+
+        res = requests.get(AGGREGATES_URL, timeout=10)
+        res.raise_for_status()
+        return res.json()
+    except requests.exceptions.RequestException as e:
+        st.error(f"Could not reach the backend at '{BACKEND_URL}': {e}")
         return None
 
 
-# --- Main Dashboard ---
-data = fetch_data()
+def apply_graded(event):
+    """Merges one `graded` event into the local rows; stale versions are ignored."""
+    known = st.session_state.rows.get(event["full_name"])
+    if known and known.get("version", 0) >= event["version"]:
+        return False
+    st.session_state.rows[event["full_name"]] = {
+        "full_name": event["full_name"],
+        "code_score": event["code_score"],
+        "error_score": event.get("error_score"),
+        "total_score": event.get("total_score", event["code_score"]),
+        "version": event["version"],
+    }
+    st.session_state.version = max(st.session_state.version, event["version"])
+    return True
+
+
+def iter_events():
+    """Yields (event, data) pairs from the backend's Server-Sent Events stream."""
+    headers = {}
+    if st.session_state.last_event_id is not None:
+        headers["Last-Event-ID"] = str(st.session_state.last_event_id)
+    with requests.get(EVENTS_URL, headers=headers, stream=True, timeout=(5, 60)) as res:
+        res.raise_for_status()
+        yield "connected", None
+        event, data = "message", []
+        for line in res.iter_lines(decode_unicode=True):
+            if line is None:
+                continue
+            if not line:
+                if data:
+                    yield event, json.loads("\n".join(data))
+                event, data = "message", []
+            elif line.startswith("id:"):
+                st.session_state.last_event_id = int(line[3:].strip())
+            elif line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:"):
+                data.append(line[5:].strip())
+
+
+# --- Rendering ---
+def render_metrics(slot, stats):
+    with slot.container():
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Total Submissions", f"{stats['count']} 🧑‍🎓")
+        col2.metric("Average Score", f"{stats['mean']:.2f} / {stats.get('max_score', 3.0):.1f}")
+        col3.metric("Highest Score", f"{stats['max']:.2f} ⭐")
+
+
+def render_table(slot):
+    data = pd.DataFrame(list(st.session_state.rows.values()),
+                        columns=["full_name", "code_score", "error_score", "total_score"])
+    if not data.empty:
+        data = data.sort_values("total_score", ascending=False, ignore_index=True)
+    # Display the dataframe with an interactive table
+    slot.dataframe(data, use_container_width=True, height=500)
+
+
+def render_chart(slot, stats):
+    with slot.container():
+        if stats["count"]:
+            # Server-side histogram: one bar per score step, not one per candidate
+            hist = pd.DataFrame(stats["histogram"]).set_index("score")["count"]
+            st.bar_chart(hist)
+            st.caption(f"Median {stats['p50']} · p90 {stats['p90']} · p99 {stats['p99']}")
+        else:
+            st.info("No data available to display chart.")
+
 
-if data is not None:
-    if st.button("🔄 Refresh Data"):
-        st.rerun()
+# --- Main Dashboard ---
+stats = fetch_data()
 
+if stats is not None:
+    status = st.empty()
     st.divider()
 
     # --- Key Metrics ---
-    col1, col2, col3 = st.columns(3)
-    total_submissions = len(data)
-    average_score = data['code_score'].mean() if not data.empty else 0
-    highest_score = data['code_score'].max() if not data.empty else 0
-
-    col1.metric("Total Submissions", f"{total_submissions} 🧑‍🎓")
-    col2.metric("Average Score", f"{average_score:.2f} / 3.0")
-    col3.metric("Highest Score", f"{highest_score:.2f} ⭐")
+    metrics_slot = st.empty()
+    render_metrics(metrics_slot, stats)
 
     st.divider()
 
@@ -62,16 +142,41 @@ if data is not None:
 
     with col1:
         st.markdown("### 📝 All Submissions")
-        # Display the dataframe with an interactive table
-        st.dataframe(data, use_container_width=True, height=500)
+        table_slot = st.empty()
+        render_table(table_slot)
+        # Streamed by the backend, so the full cohort never has to fit in this page.
+        st.markdown(f"⬇️ Download: [results (CSV)]({EXPORT_URL}/results) · "
+                    f"[all submissions (CSV, gzip)]({EXPORT_URL}/submissions?compression=gzip)")
 
     with col2:
         st.markdown("### 📈 Score Distribution")
-        if not data.empty:
-            # Create a simple bar chart of scores
-            st.bar_chart(data.set_index('full_name')['code_score'])
-        else:
-            st.info("No data available to display chart.")
+        chart_slot = st.empty()
+        render_chart(chart_slot, stats)
+
+    # --- Live Updates ---
+    # The script stays in this loop and redraws only the affected widgets as
+    # events arrive, instead of rerunning and reloading everything.
+    while True:
+        try:
+            status.caption("🟢 Live: updates appear as submissions are graded.")
+            for event, data in iter_events():
+                if event == "graded":
+                    if apply_graded(data):
+                        render_table(table_slot)
+                elif event == "aggregates_changed":
+                    render_metrics(metrics_slot, data)
+                    render_chart(chart_slot, data)
+                elif event in ("connected", "reset", "dropped"):
+                    # Grades written while we were not subscribed (or events we
+                    # missed) are picked up through the deltas endpoint.
+                    stats = fetch_data()
+                    if stats is not None:
+                        render_table(table_slot)
+                        render_metrics(metrics_slot, stats)
+                        render_chart(chart_slot, stats)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            status.caption(f"🟠 Reconnecting to live updates... ({e})")
+            time.sleep(3)
 
 else:
-    st.warning("Could not load data to display the dashboard.")
\ No newline at end of file
+    st.warning("Could not load data to display the dashboard.")
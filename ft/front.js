@@ -1,12 +1,12 @@
 'use client';
 
-import React, { useState, useEffect, useCallback, useMemo } from 'react';
+import React, { useState, useEffect, useCallback, useMemo, useRef } from 'react';
 
 // --- Configuration ---
 const BACKEND_URL = "http://10.1.89.131:10002"; // Your FastAPI backend port
-const GENERATE_URL = `${BACKEND_URL}/exam/generate`;
+const SESSION_START_URL = `${BACKEND_URL}/exam/session/start`;
 const SUBMIT_CODE_URL = `${BACKEND_URL}/exam/submit_code`;
-const EXAM_DURATION_SECONDS = 600; // 10 minutes
+const EXAM_DURATION_SECONDS = 600; // 10 minutes (the backend's session deadline is authoritative)
 
 // --- Helper Components ---
 
@@ -77,13 +77,21 @@ const Confetti = () => {
 // --- Main Application Component ---
 export default function ExamPage() {
     // --- State Management ---
-    const [page, setPage] = useState('start'); // 'start', 'exam', 'submitted'
+    const [page, setPage] = useState('start'); // 'start', 'exam', 'submitted', 'late'
     const [fullName, setFullName] = useState('');
     const [question, setQuestion] = useState('Loading question...');
     const [answer, setAnswer] = useState('');
+    // Debugging part (find and fix the error), when the exam has one.
+    const [errorQuestion, setErrorQuestion] = useState(null);
+    const [errorAnswer, setErrorAnswer] = useState('');
     const [timeLeft, setTimeLeft] = useState(EXAM_DURATION_SECONDS);
+    const [sessionId, setSessionId] = useState(null);
+    const [deadlineMs, setDeadlineMs] = useState(null); // server deadline, in local clock time
     const [isSubmitting, setIsSubmitting] = useState(false);
     const [error, setError] = useState('');
+    // Idempotency-Key for the answers being submitted: retries of the same
+    // answers reuse it, so the backend stores and grades them only once.
+    const submitKey = useRef({ key: null, answers: null });
 
     // --- Submission Logic ---
     const submitAnswer = useCallback(async (reason = "") => {
@@ -101,13 +109,28 @@ export default function ExamPage() {
                 full_name: fullName,
                 code_answer: answer,
                 question: question,
+                session_id: sessionId,
             };
+            if (errorQuestion) {
+                payload.error_answer = errorAnswer;
+                payload.error_question = errorQuestion;
+            }
+            const answers = JSON.stringify([answer, errorAnswer]);
+            if (submitKey.current.key === null || submitKey.current.answers !== answers) {
+                submitKey.current = { key: crypto.randomUUID(), answers };
+            }
             const response = await fetch(SUBMIT_CODE_URL, {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', 'Idempotency-Key': submitKey.current.key },
                 body: JSON.stringify(payload)
             });
 
+            // 409: too late; the server already closed the session and
+            // auto-submitted the last saved draft instead of this answer.
+            if (response.status === 409) {
+                setPage('late');
+                return;
+            }
             if (!response.ok) {
                 throw new Error(`Server responded with status: ${response.status}`);
             }
@@ -116,7 +139,7 @@ export default function ExamPage() {
             setError(`Submission failed: ${err.message}. Please try again.`);
             setIsSubmitting(false); // Re-enable button on failure
         }
-    }, [answer, fullName, question, isSubmitting]);
+    }, [answer, errorAnswer, errorQuestion, fullName, question, sessionId, isSubmitting]);
 
     // --- Timer Logic ---
     useEffect(() => {
@@ -128,11 +151,27 @@ export default function ExamPage() {
         }
 
         const timerId = setInterval(() => {
-            setTimeLeft(prevTime => prevTime - 1);
+            setTimeLeft(Math.max(0, Math.floor((deadlineMs - Date.now()) / 1000)));
         }, 1000);
 
         return () => clearInterval(timerId);
-    }, [page, timeLeft, submitAnswer]);
+    }, [page, timeLeft, deadlineMs, submitAnswer]);
+
+    // --- Session Heartbeat ---
+    // Saves the drafts every 15s so the server can auto-submit them at the deadline.
+    useEffect(() => {
+        if (page !== 'exam' || !sessionId) return;
+
+        const beatId = setInterval(() => {
+            fetch(`${BACKEND_URL}/exam/session/${sessionId}/heartbeat`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(errorQuestion ? { draft: answer, error_answer: errorAnswer } : { draft: answer })
+            }).catch(() => {});
+        }, 15000);
+
+        return () => clearInterval(beatId);
+    }, [page, sessionId, answer, errorAnswer, errorQuestion]);
 
     // --- Anti-Cheating: Tab Switch Detection ---
     useEffect(() => {
@@ -161,11 +200,20 @@ export default function ExamPage() {
         setIsSubmitting(true);
 
         try {
-            const response = await fetch(GENERATE_URL, { method: 'POST' });
+            const response = await fetch(SESSION_START_URL, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ full_name: fullName.trim() })
+            });
             if (!response.ok) throw new Error(`Server returned status: ${response.status}`);
 
             const data = await response.json();
-            setQuestion(data.code_question || "⚠️ No question received.");
+            setQuestion(data.question || "⚠️ No question received.");
+            setErrorQuestion(data.error_question || null);
+            setSessionId(data.session_id);
+            // Translate the server deadline into local clock time once.
+            setDeadlineMs(data.deadline * 1000 - (data.server_time * 1000 - Date.now()));
+            setTimeLeft(data.time_left);
             setPage('exam');
         } catch (err) {
             setError(`⚠️ Connection Error: Could not start the exam. ${err.message}`);
@@ -220,6 +268,17 @@ export default function ExamPage() {
                                  placeholder="Enter your shell script code here..."
                                  className="w-full h-96 p-4 border border-gray-300 rounded-md font-mono text-sm focus:outline-none focus:ring-2 focus:ring-teal-500"
                              />
+                             {errorQuestion && (
+                                 <>
+                                     <h3 className="text-xl font-bold text-gray-800 mt-6 mb-2">🔧 Debugging</h3>
+                                     <textarea
+                                         value={errorAnswer}
+                                         onChange={(e) => setErrorAnswer(e.target.value)}
+                                         placeholder="Explain the error and give the corrected script..."
+                                         className="w-full h-64 p-4 border border-gray-300 rounded-md font-mono text-sm focus:outline-none focus:ring-2 focus:ring-teal-500"
+                                     />
+                                 </>
+                             )}
                              {error && <p className="text-red-500 text-sm mt-4 text-center">{error}</p>}
                              <button
                                  onClick={() => submitAnswer('manual')}
@@ -243,6 +302,11 @@ export default function ExamPage() {
                                  <div className="bg-teal-50 border border-teal-200 text-teal-800 p-4 rounded-md text-sm">
                                     <span className="font-bold">📌 Note:</span> {question}
                                  </div>
+                                 {errorQuestion && (
+                                     <div className="bg-amber-50 border border-amber-200 text-amber-800 p-4 rounded-md text-sm mt-4 whitespace-pre-wrap">
+                                        <span className="font-bold">🔧 Debugging:</span> {errorQuestion}
+                                     </div>
+                                 )}
                              </div>
                         </div>
                     </div>
@@ -258,6 +322,16 @@ export default function ExamPage() {
                         </div>
                      </div>
                 );
+            case 'late':
+                return (
+                     <div className="w-full max-w-2xl mx-auto text-center">
+                        <div className="bg-white p-10 rounded-lg shadow-xl border border-gray-200">
+                           <p className="text-2xl font-bold text-red-600 mb-4">⏰ Submission too late</p>
+                           <p className="text-gray-700 text-lg mb-2">Your answer arrived after the deadline and was not accepted.</p>
+                           <h2 className="text-xl text-gray-800 font-semibold mt-6">Your last autosaved draft has been submitted instead.</h2>
+                        </div>
+                     </div>
+                );
             default:
                 return null;
         }
@@ -1,13 +1,18 @@
 import streamlit as st
 import requests
 import time
+import uuid
 from streamlit_autorefresh import st_autorefresh
 
 # --- Configuration ---
 BACKEND_URL = "http://127.0.0.1:10000"  # Ensure this matches your backend port
-GENERATE_URL = f"{BACKEND_URL}/exam/generate"
+SESSION_START_URL = f"{BACKEND_URL}/exam/session/start"
+SESSION_URL = f"{BACKEND_URL}/exam/session"
 SUBMIT_CODE_URL = f"{BACKEND_URL}/exam/submit_code"
-EXAM_DURATION_SECONDS = 600  # 10 minutes
+EXAM_DURATION_SECONDS = 600  # 10 minutes (the backend's session deadline is authoritative)
+# The countdown runs in the browser; the script only reruns this often to save
+# the draft and pick up the server's view of the deadline.
+HEARTBEAT_MS = 15000
 
 # --- Page Setup ---
 st.set_page_config(
@@ -55,15 +60,30 @@ load_css()
 st.session_state.setdefault("started", False)
 st.session_state.setdefault("question", "Loading question...")
 st.session_state.setdefault("answer", "")
+st.session_state.setdefault("error_question", None)  # debugging part, if the exam has one
+st.session_state.setdefault("error_answer", "")
 st.session_state.setdefault("time_left", EXAM_DURATION_SECONDS)
-st.session_state.setdefault("start_time", None)
+st.session_state.setdefault("session_id", None)
+st.session_state.setdefault("deadline", None)
+st.session_state.setdefault("clock_offset", 0.0)  # server clock minus local clock
 st.session_state.setdefault("submitted", False)
+st.session_state.setdefault("late", False)  # the server closed the session before our submit arrived
 st.session_state.setdefault("full_name", "")
 st.session_state.setdefault("submission_triggered", False)
 st.session_state.setdefault("disable_submit", False)  # ✅ disable submit button
 st.session_state.setdefault("disable_start", False)   # ✅ disable start button
+st.session_state.setdefault("submit_key", None)       # Idempotency-Key of the pending submission
+st.session_state.setdefault("submit_key_answer", None)
 
 # --- Submission Logic ---
+def submission_key(answer):
+    # Retries of the same answer (a failed post, tab switch plus time-up) reuse
+    # one key, so the backend stores and grades it only once.
+    if st.session_state.submit_key is None or st.session_state.submit_key_answer != answer:
+        st.session_state.submit_key = str(uuid.uuid4())
+        st.session_state.submit_key_answer = answer
+    return st.session_state.submit_key
+
 def submit_answer(reason=""):
     if st.session_state.submission_triggered:
         return
@@ -83,9 +103,20 @@ def submit_answer(reason=""):
             payload = {
                 "full_name": st.session_state.full_name,
                 "code_answer": st.session_state.answer,
-                "question": st.session_state.question
+                "question": st.session_state.question,
+                "session_id": st.session_state.session_id,
             }
-            res = requests.post(SUBMIT_CODE_URL, json=payload)
+            if st.session_state.error_question:
+                payload["error_answer"] = st.session_state.error_answer
+                payload["error_question"] = st.session_state.error_question
+            headers = {"Idempotency-Key": submission_key((st.session_state.answer, st.session_state.error_answer))}
+            res = requests.post(SUBMIT_CODE_URL, json=payload, headers=headers)
+            if res.status_code == 409:
+                # Too late: the server already closed this session and
+                # auto-submitted the last saved draft instead of this answer.
+                st.session_state.late = True
+                st.session_state.submitted = True
+                st.rerun()
             res.raise_for_status()
             st.session_state.submitted = True
             st.rerun()   # ✅ Immediately redirect to thank you page with balloons
@@ -100,6 +131,12 @@ st.markdown("<h3 style='text-align: center; color: #555;'>Assess Your Shell Scri
 st.divider()
 
 # --- Thank You Page ---
+if st.session_state.submitted and st.session_state.late:
+    with st.container():
+        st.error("⏰ Your submission arrived after the deadline and was not accepted.")
+        st.markdown("<h2 style='text-align: center;'>Your last autosaved draft has been submitted instead.</h2>", unsafe_allow_html=True)
+    st.stop()
+
 if st.session_state.submitted:
     with st.container():
         st.success("🎉 Thank You! Your submission has been recorded successfully.")
@@ -127,12 +164,16 @@ if not st.session_state.started:
                     st.session_state.full_name = full_name.strip()
                     with st.spinner("Generating your question..."):
                         try:
-                            res = requests.post(GENERATE_URL)
+                            res = requests.post(SESSION_START_URL, json={"full_name": st.session_state.full_name})
                             res.raise_for_status()
                             data = res.json()
-                            st.session_state.question = data.get("code_question", "⚠️ No question received.")
+                            st.session_state.question = data.get("question") or "⚠️ No question received."
+                            st.session_state.error_question = data.get("error_question")
+                            st.session_state.session_id = data["session_id"]
+                            st.session_state.deadline = data["deadline"]
+                            st.session_state.clock_offset = data["server_time"] - time.time()
+                            st.session_state.time_left = data["time_left"]
                             st.session_state.started = True
-                            st.session_state.start_time = time.time()
                             st.rerun()
                         except requests.exceptions.RequestException as e:
                             st.error(f"⚠️ Connection Error: Could not connect to the backend. {e}")
@@ -140,11 +181,32 @@ if not st.session_state.started:
     st.stop()
 
 # --- Timer Logic ---
-if st.session_state.start_time:
-    elapsed = int(time.time() - st.session_state.start_time)
-    st.session_state.time_left = max(EXAM_DURATION_SECONDS - elapsed, 0)
+# The server owns the deadline. Each (infrequent) rerun saves the draft and
+# reads back the time left; the second-by-second countdown is pure browser JS.
+def send_heartbeat():
+    try:
+        res = requests.post(
+            f"{SESSION_URL}/{st.session_state.session_id}/heartbeat",
+            json={"draft": st.session_state.answer, "error_answer": st.session_state.error_answer},
+            timeout=5,
+        )
+        res.raise_for_status()
+        data = res.json()
+        st.session_state.deadline = data["deadline"]
+        st.session_state.clock_offset = data["server_time"] - time.time()
+        st.session_state.time_left = data["time_left"]
+        if data["status"] != "active":
+            st.session_state.submitted = True
+            st.rerun()
+    except requests.exceptions.RequestException:
+        # Keep counting down locally against the last known deadline.
+        st.session_state.time_left = max(
+            int(st.session_state.deadline - (time.time() + st.session_state.clock_offset)), 0
+        )
+
+send_heartbeat()
 
-st_autorefresh(interval=1000, key="timer_refresh")
+st_autorefresh(interval=HEARTBEAT_MS, key="timer_refresh")
 
 # --- Tab Switch Detection ---
 cheat_detection_component = st.components.v1.html(
@@ -185,6 +247,16 @@ with col1:
             label_visibility="collapsed"
         )
 
+        if st.session_state.error_question:
+            st.markdown("### 🐞 Debugging Question")
+            st.info(st.session_state.error_question, icon="🔧")
+            st.session_state.error_answer = st.text_area(
+                "Your fix and explanation:",
+                value=st.session_state.error_answer,
+                height=250,
+                placeholder="Explain the error and paste the corrected script...",
+            )
+
         if st.button("Submit Final Answer",
                      type="primary",
                      use_container_width=True,
@@ -194,9 +266,27 @@ with col1:
 with col2:
     with st.container():
         st.markdown("### ⏳ Status & Timer")
-        mins, secs = divmod(st.session_state.time_left, 60)
-        st.metric("Time Remaining", f"{mins:02d}:{secs:02d}")
-        st.progress((EXAM_DURATION_SECONDS - st.session_state.time_left) / EXAM_DURATION_SECONDS)
+        # Counts down to the server deadline in the browser, without reruns.
+        deadline_ms = int((st.session_state.deadline - st.session_state.clock_offset) * 1000)
+        st.components.v1.html(
+            f"""<div style="font-family: sans-serif;">
+            <div style="font-size: 0.9rem; color: #555;">Time Remaining</div>
+            <div id="countdown" style="font-size: 2.75rem; color: #1abc9c; font-weight: bold;">--:--</div>
+            </div>
+            <script>
+            const deadline = {deadline_ms};
+            function tick() {{
+                const left = Math.max(0, Math.floor((deadline - Date.now()) / 1000));
+                const m = String(Math.floor(left / 60)).padStart(2, '0');
+                const s = String(left % 60).padStart(2, '0');
+                document.getElementById('countdown').textContent = m + ':' + s;
+            }}
+            tick();
+            setInterval(tick, 1000);
+            </script>""",
+            height=90,
+        )
+        st.progress(max(0.0, min(1.0, (EXAM_DURATION_SECONDS - st.session_state.time_left) / EXAM_DURATION_SECONDS)))
 
     st.write("")
 